@@ -0,0 +1,70 @@
+import logging
+import os
+import tempfile
+import time
+
+import click
+import numpy as np
+import synthetic
+
+from lausanne_greening_scenarios import settings
+from lausanne_greening_scenarios.scenarios import utils as scenario_utils
+
+
+@click.command()
+@click.option('--size', default=2000)
+@click.option('--num-scenario-runs', default=3)
+@click.option('--change-prop-step', default=.125)
+@click.option('--shade-threshold', default=.75)
+@click.option('--nested', is_flag=True)
+@click.option('--executor',
+              type=click.Choice(['threads', 'processes']),
+              default='threads')
+@click.option('--num-workers', '-w', multiple=True, type=int)
+@click.option('--repeat', default=3)
+def main(size, num_scenario_runs, change_prop_step, shade_threshold, nested,
+         executor, num_workers, repeat):
+    # time `ScenarioGenerator.generate_scenario_lulc_da` on a synthetic
+    # raster for each number of generation workers (the best of `repeat`
+    # runs), checking that the scenarios do not depend on it
+    logger = logging.getLogger(__name__)
+    if not num_workers:
+        num_workers = [1, 2, 4, 8]
+    change_props = np.arange(0, 1 + change_prop_step, change_prop_step)
+    scenario_runs = range(num_scenario_runs)
+    logger.info("%d CPUs available", len(os.sched_getaffinity(0)))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lulc_raster_filepath, biophysical_table_filepath, _ = \
+            synthetic.make_synthetic_inputs(tmp_dir, size)
+        ref_lulc_arr = None
+        for _num_workers in num_workers:
+            times = []
+            for _ in range(repeat):
+                # the generator is initialized anew so that the rankings are
+                # not cached across runs
+                sg = scenario_utils.ScenarioGenerator(
+                    lulc_raster_filepath, biophysical_table_filepath, seed=0)
+                start = time.perf_counter()
+                lulc_arr = sg.generate_scenario_lulc_da(
+                    change_props,
+                    scenario_runs,
+                    shade_threshold,
+                    nested=nested,
+                    num_workers=_num_workers,
+                    executor=executor).values
+                times.append(time.perf_counter() - start)
+            if ref_lulc_arr is None:
+                ref_lulc_arr = lulc_arr
+            elif not np.array_equal(lulc_arr, ref_lulc_arr):
+                raise ValueError(
+                    f"The scenarios of {_num_workers} workers differ")
+            logger.info("%d workers (%s): %.2f s (%d scenarios of %dx%d)",
+                        _num_workers, executor, min(times),
+                        np.prod(lulc_arr.shape[:-2]), size, size)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format=settings.DEFAULT_LOG_FMT)
+
+    main()
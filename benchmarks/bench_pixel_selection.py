@@ -0,0 +1,99 @@
+import logging
+import time
+
+import click
+import numpy as np
+import pandas as pd
+from scipy import ndimage as ndi
+
+from lausanne_greening_scenarios import settings
+from lausanne_greening_scenarios.scenarios import utils as scenario_utils
+
+
+def _select_pixels_baseline(conv_result, change_df, num_to_change,
+                            interaction):
+    # selection of the pixels to change of the original
+    # `ScenarioGenerator.generate_lulc_arr`, i.e., a full sort of the
+    # neighbourhood counts and a random sample of the pixels at the
+    # threshold count with pandas
+    sorted_idx = conv_result.argsort()
+    if interaction == 'scatter':
+        comparison_op = np.less
+    else:  # 'cluster'
+        sorted_idx = sorted_idx[::-1]
+        comparison_op = np.greater
+    conv_result_threshold = conv_result[sorted_idx[num_to_change - 1]]
+    pixels_to_change_df = change_df[comparison_op(conv_result,
+                                                  conv_result_threshold)]
+    return pd.concat([
+        pixels_to_change_df,
+        change_df[conv_result == conv_result_threshold].sample(
+            num_to_change - len(pixels_to_change_df))
+    ])
+
+
+def _time(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+@click.command()
+@click.option('--size', default=10000)
+@click.option('--high-tree-prop', default=.3)
+@click.option('--change-pixel-prop', default=.25)
+@click.option('--change-prop', '-p', 'change_props', multiple=True, type=float)
+def main(size, high_tree_prop, change_pixel_prop, change_props):
+    # time the selection of the pixels to change of the cluster and scatter
+    # interactions, i.e., `scenario_utils._select_pixels`, against the
+    # original full sort (see `_select_pixels_baseline`) on a synthetic
+    # `size` x `size` raster, checking that both select pixels with the same
+    # neighbourhood counts
+    logger = logging.getLogger(__name__)
+    if not change_props:
+        change_props = [.25, .5, .75]
+    rng = np.random.default_rng(0)
+
+    # neighbourhood counts of high tree cover pixels (see
+    # `ScenarioGenerator._get_ranking`) of the changeable pixels, which were
+    # computed as `int32` originally
+    conv_result = ndi.convolve(
+        (rng.random((size, size), dtype=np.float32)
+         < high_tree_prop).astype(np.int8),
+        scenario_utils.KERNEL_MOORE.astype(np.int8)).ravel()
+    change_idx = np.flatnonzero(
+        rng.random(size * size, dtype=np.float32) < change_pixel_prop)
+    conv_result = conv_result[change_idx]
+    baseline_conv_result = conv_result.astype(np.int32)
+    change_df = pd.DataFrame(
+        {'next_code': np.ones(len(change_idx), dtype=np.int32)},
+        index=change_idx)
+    logger.info("%d changeable pixels of %dx%d", len(change_idx), size, size)
+
+    for interaction in ['cluster', 'scatter']:
+        # `_select_pixels` selects the lowest scores
+        scores = -conv_result if interaction == 'cluster' else conv_result
+        for change_prop in change_props:
+            num_to_change = int(len(change_idx) * change_prop)
+            baseline_df, baseline_time = _time(_select_pixels_baseline,
+                                               baseline_conv_result, change_df,
+                                               num_to_change, interaction)
+            select_pos, select_time = _time(scenario_utils._select_pixels,
+                                            scores, num_to_change, rng)
+            if not np.array_equal(
+                    np.bincount(conv_result[change_idx.searchsorted(
+                        baseline_df.index)],
+                                minlength=10),
+                    np.bincount(conv_result[select_pos], minlength=10)):
+                raise ValueError(
+                    "The selected neighbourhood counts are different")
+            logger.info(
+                "%s, change prop. %.2f: baseline %.2f s, "
+                "argpartition %.2f s (%.1fx)", interaction, change_prop,
+                baseline_time, select_time, baseline_time / select_time)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format=settings.DEFAULT_LOG_FMT)
+
+    main()
@@ -0,0 +1,130 @@
+import logging
+import tempfile
+import time
+from os import path
+
+import click
+import dask
+import numpy as np
+import synthetic
+import xarray as xr
+
+from lausanne_greening_scenarios import settings
+from lausanne_greening_scenarios.scenarios import utils as scenario_utils
+
+
+def _get_scenario_ds(size, num_scenario_runs, change_prop_step,
+                     shade_threshold, tmp_dir):
+    # scenario dataset (as dumped by `make_scenario_ds.py`) of a synthetic
+    # raster, with the temperatures simulated by the native engine
+    lulc_raster_filepath, biophysical_table_filepath, \
+        ref_et_raster_filepath = synthetic.make_synthetic_inputs(
+            tmp_dir, size)
+    sg = scenario_utils.ScenarioGenerator(lulc_raster_filepath,
+                                          biophysical_table_filepath,
+                                          seed=0)
+    scenario_lulc_ds = sg.generate_scenario_lulc_ds(
+        np.arange(0, 1 + change_prop_step, change_prop_step),
+        range(num_scenario_runs), shade_threshold)
+    scenario_T_da = scenario_utils.simulate_scenario_T_da(
+        scenario_lulc_ds['LULC'],
+        biophysical_table_filepath,
+        ref_et_raster_filepath,
+        20.,
+        5., {},
+        'float32',
+        backend='serial',
+        engine='native',
+        endpoint_lulc_da=scenario_lulc_ds.get('LULC_endpoint'))
+    scenario_lulc_da = scenario_utils.expand_scenario_endpoints(
+        scenario_lulc_ds)['LULC']
+    scenario_ds = xr.Dataset(
+        {
+            'LULC': scenario_lulc_da,
+            'T': scenario_T_da
+        },
+        attrs=dict(pyproj_srs=scenario_lulc_da.attrs['pyproj_srs'],
+                   seed=scenario_lulc_da.attrs['seed']))
+    return scenario_ds.compute()
+
+
+@click.command()
+@click.option('--size', default=500)
+@click.option('--num-scenario-runs', default=3)
+@click.option('--change-prop-step', default=.125)
+@click.option('--shade-threshold', default=.75)
+@click.option('--complevel', default=4)
+@click.option('--t-precision', default=.01)
+@click.option('--num-reads', default=20)
+def main(size, num_scenario_runs, change_prop_step, shade_threshold, complevel,
+         t_precision, num_reads):
+    # write one synthetic scenario dataset with the baseline netCDF encoding
+    # (i.e., `to_netcdf` without encoding) and with the encoding of
+    # `dump_scenario_ds` (with and without compact endpoints), and report
+    # the file size and the time to read the arrays of a scenario (i.e.,
+    # `isel`) from each file
+    logger = logging.getLogger(__name__)
+    # read the arrays of the scenarios sequentially
+    dask.config.set(scheduler='synchronous')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scenario_ds = _get_scenario_ds(size, num_scenario_runs,
+                                       change_prop_step, shade_threshold,
+                                       tmp_dir)
+        scenario_dims = scenario_ds['LULC'].dims[:-2]
+        logger.info("%d scenarios of %dx%d",
+                    np.prod(scenario_ds['LULC'].shape[:-2]), size, size)
+
+        def dump_baseline(dst_filepath):
+            scenario_ds.to_netcdf(dst_filepath, mode='w')
+
+        def dump_encoded(dst_filepath, compact_endpoints=False):
+            _scenario_ds = scenario_ds
+            if compact_endpoints:
+                _scenario_ds = scenario_utils.compact_scenario_endpoints(
+                    _scenario_ds)
+            scenario_utils.dump_scenario_ds(_scenario_ds,
+                                            dst_filepath,
+                                            complevel=complevel,
+                                            t_precision=t_precision)
+
+        rng = np.random.default_rng(0)
+        read_isels = [{
+            dim: rng.integers(scenario_ds.sizes[dim])
+            for dim in scenario_dims
+        } for _ in range(num_reads)]
+        for label, dump_func in [
+            ('baseline', dump_baseline),
+            (f'complevel={complevel}, t-precision={t_precision}',
+             dump_encoded),
+            ('+ compact endpoints',
+             lambda dst_filepath: dump_encoded(dst_filepath, True))
+        ]:
+            dst_filepath = path.join(tmp_dir, 'scenarios.nc')
+            start = time.perf_counter()
+            dump_func(dst_filepath)
+            dump_time = time.perf_counter() - start
+            read_times = []
+            with scenario_utils.open_scenario_ds(dst_filepath) as src_ds:
+                for read_isel in read_isels:
+                    start = time.perf_counter()
+                    read_ds = src_ds[['LULC', 'T']].isel(read_isel).load()
+                    read_times.append(time.perf_counter() - start)
+                    # check the values of the scenario
+                    expected_ds = scenario_ds.isel(read_isel)
+                    if not np.array_equal(read_ds['LULC'],
+                                          expected_ds['LULC']):
+                        raise ValueError(f"The LULC of {label} differs")
+                    t_diff = np.nanmax(np.abs(read_ds['T'] - expected_ds['T']))
+                    if t_diff > t_precision:
+                        raise ValueError(f"The T of {label} differs")
+            logger.info("%s: %.1f MB, dump %.2f s, isel read %.1f ms (median)",
+                        label,
+                        path.getsize(dst_filepath) / 2**20, dump_time,
+                        np.median(read_times) * 1000)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format=settings.DEFAULT_LOG_FMT)
+
+    main()
@@ -0,0 +1,92 @@
+import logging
+import os
+import tempfile
+import time
+
+import click
+import dask
+import numpy as np
+import synthetic
+
+from lausanne_greening_scenarios import settings
+from lausanne_greening_scenarios.scenarios import utils as scenario_utils
+
+BACKENDS = ['serial', 'threads', 'processes', 'distributed']
+
+
+@click.command()
+@click.option('--size', default=500)
+@click.option('--num-scenario-runs', default=3)
+@click.option('--change-prop-step', default=.125)
+@click.option('--shade-threshold', default=.75)
+@click.option('--t-ref', default=20.)
+@click.option('--uhi-max', default=5.)
+@click.option('--ucm-engine',
+              type=click.Choice(['invest', 'native']),
+              default='native')
+@click.option('--backend',
+              '-b',
+              'backends',
+              multiple=True,
+              type=click.Choice(BACKENDS))
+@click.option('--num-workers', type=int)
+@click.option('--chunksize', type=int)
+def main(size, num_scenario_runs, change_prop_step, shade_threshold, t_ref,
+         uhi_max, ucm_engine, backends, num_workers, chunksize):
+    # time `simulate_scenario_T_da` on the scenarios of a synthetic raster
+    # for each simulation backend, checking that the temperatures do not
+    # depend on it
+    logger = logging.getLogger(__name__)
+    # disable the logging of the local cluster of the 'distributed' backend
+    dask.config.set({'logging.distributed': 'warning'})
+    if not backends:
+        backends = BACKENDS
+    if num_workers is None:
+        num_workers = len(os.sched_getaffinity(0))
+    logger.info("%d CPUs available, %d workers", len(os.sched_getaffinity(0)),
+                num_workers)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lulc_raster_filepath, biophysical_table_filepath, \
+            ref_et_raster_filepath = synthetic.make_synthetic_inputs(
+                tmp_dir, size)
+        sg = scenario_utils.ScenarioGenerator(lulc_raster_filepath,
+                                              biophysical_table_filepath,
+                                              seed=0)
+        # eager scenarios with compact endpoints, as in
+        # `make_scenario_ds.py`
+        scenario_lulc_ds = sg.generate_scenario_lulc_ds(
+            np.arange(0, 1 + change_prop_step, change_prop_step),
+            range(num_scenario_runs), shade_threshold)
+        ref_T_arr = None
+        for backend in backends:
+            start = time.perf_counter()
+            # without cache, so that every backend simulates all the
+            # scenarios
+            T_arr = scenario_utils.simulate_scenario_T_da(
+                scenario_lulc_ds['LULC'],
+                biophysical_table_filepath,
+                ref_et_raster_filepath,
+                t_ref,
+                uhi_max, {},
+                'float32',
+                backend=backend,
+                num_workers=num_workers,
+                chunksize=chunksize,
+                engine=ucm_engine,
+                endpoint_lulc_da=scenario_lulc_ds.get('LULC_endpoint')).values
+            elapsed = time.perf_counter() - start
+            num_scenarios = np.prod(T_arr.shape[:-2])
+            if ref_T_arr is None:
+                ref_T_arr = T_arr
+            elif not np.allclose(T_arr, ref_T_arr, equal_nan=True):
+                raise ValueError(f"The temperatures of {backend} differ")
+            logger.info("%s: %.2f scenarios/s (%d scenarios of %dx%d)",
+                        backend, num_scenarios / elapsed, num_scenarios, size,
+                        size)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format=settings.DEFAULT_LOG_FMT)
+
+    main()
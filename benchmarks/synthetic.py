@@ -0,0 +1,76 @@
+import itertools
+from os import path
+
+import numpy as np
+import pandas as pd
+import rasterio as rio
+from rasterio import transform
+from scipy import ndimage as ndi
+
+from lausanne_greening_scenarios.scenarios import utils as scenario_utils
+
+# levels of both the tree and building cover of the codes of each original
+# LULC class
+COVER_VALS = np.linspace(0, 1, 9)[1::2]
+# resolution (in meters) of the synthetic rasters
+RES = 10
+LULC_NODATA = 0
+
+
+def make_synthetic_inputs(dst_dir, size, seed=0):
+    # write a synthetic LULC raster of `size` x `size` pixels (with spatially
+    # autocorrelated original classes, each with codes for the combinations
+    # of tree and building cover, like the reclassified agglomeration
+    # raster), a reference evapotranspiration raster on the same grid and
+    # the biophysical table. Returns the paths of the three files
+    rng = np.random.default_rng(seed)
+    orig_lulc_codes = scenario_utils.ORIG_LULC_CODES + [5, 13]
+    biophysical_df = pd.DataFrame([
+        dict(orig_lucode=orig_lucode,
+             shade=shade,
+             building_intensity=building_intensity,
+             kc=rng.uniform(.2, 1),
+             albedo=rng.uniform(.1, .3),
+             green_area=int(orig_lucode in (5, 11)))
+        for orig_lucode, shade, building_intensity in itertools.product(
+            orig_lulc_codes, COVER_VALS, COVER_VALS)
+    ])
+    biophysical_df.insert(0, 'lucode', np.arange(len(biophysical_df)) + 1)
+    biophysical_table_filepath = path.join(dst_dir, 'biophysical-table.csv')
+    biophysical_df.to_csv(biophysical_table_filepath, index=False)
+
+    noise = ndi.gaussian_filter(
+        rng.standard_normal((size, size), dtype=np.float32), 4)
+    class_idx = np.digitize(
+        noise,
+        np.quantile(noise,
+                    np.linspace(0, 1,
+                                len(orig_lulc_codes) + 1)[1:-1]))
+    del noise
+    lulc_arr = np.zeros((size, size), dtype=np.uint16)
+    for i, orig_lucode in enumerate(orig_lulc_codes):
+        class_mask = class_idx == i
+        lulc_arr[class_mask] = rng.choice(
+            biophysical_df[biophysical_df['orig_lucode'] == orig_lucode]
+            ['lucode'], class_mask.sum())
+    del class_idx
+    lulc_arr[:size // 40, :size // 7] = LULC_NODATA
+    rio_meta = dict(driver='GTiff',
+                    dtype='uint16',
+                    nodata=LULC_NODATA,
+                    width=size,
+                    height=size,
+                    count=1,
+                    crs='epsg:2056',
+                    transform=transform.from_origin(2530000, 1160000, RES,
+                                                    RES))
+    lulc_raster_filepath = path.join(dst_dir, 'lulc.tif')
+    with rio.open(lulc_raster_filepath, 'w', **rio_meta) as dst:
+        dst.write(lulc_arr, 1)
+    ref_et_raster_filepath = path.join(dst_dir, 'ref-et.tif')
+    with rio.open(ref_et_raster_filepath, 'w',
+                  **dict(rio_meta, dtype='float32', nodata=-1)) as dst:
+        dst.write(rng.uniform(3, 6, size=(size, size)).astype(np.float32), 1)
+
+    return lulc_raster_filepath, biophysical_table_filepath, \
+        ref_et_raster_filepath
@@ -1,6 +1,7 @@
 import json
 import logging
 import warnings
+from os import path
 
 import click
 import numpy as np
@@ -22,9 +23,61 @@ from lausanne_greening_scenarios.scenarios import utils as scenario_utils
 @click.option('--num-scenario-runs', default=10)
 @click.option('--change-prop-step', default=0.125)
 @click.option('--dst-t-dtype', default='float32')
+@click.option('--interaction',
+              'interactions',
+              multiple=True,
+              type=click.Choice([
+                  'random', 'cluster', 'scatter', 'cluster_dynamic',
+                  'scatter_dynamic'
+              ]))
+@click.option('--nested', is_flag=True)
+@click.option('--lazy', is_flag=True)
+@click.option('--lulc-storage',
+              type=click.Choice(['dense', 'delta']),
+              default='dense')
+@click.option('--seed', type=int)
+@click.option('--num-generation-workers', default=1)
+@click.option('--generation-executor',
+              type=click.Choice(['threads', 'processes']),
+              default='threads')
+@click.option('--lulc-memmap-filepath', type=click.Path())
+@click.option('--ucm-cache-dir', type=click.Path())
+@click.option('--ucm-cache-max-mb', type=float)
+@click.option('--simulation-backend',
+              type=click.Choice(
+                  ['serial', 'threads', 'processes', 'distributed']),
+              default='processes')
+@click.option('--num-simulation-workers', type=int)
+@click.option('--simulation-chunksize', type=int)
+@click.option('--scheduler-address')
+@click.option('--t-store', type=click.Path())
+@click.option('--ucm-engine',
+              type=click.Choice(['invest', 'native']),
+              default='invest')
+@click.option('--simulation-batch-size', type=int)
+@click.option('--incremental-simulation', is_flag=True)
+@click.option('--output-format',
+              type=click.Choice(['netcdf', 'zarr']),
+              default='netcdf')
+@click.option('--complevel', type=int)
+@click.option('--t-precision', type=float)
+@click.option('--compact-endpoints', is_flag=True)
+@click.option('--metrics-filepath', type=click.Path())
+@click.option('--incremental-metrics',
+              is_flag=True,
+              help='Update the metrics of each scenario from the previous '
+              'change proportion of its scenario run. Not applicable with '
+              '--t-store, whose tasks hold a single scenario each.')
 def main(agglom_lulc_filepath, biophysical_table_filepath, station_t_filepath,
          ref_et_raster_filepath, calibrated_params_filepath, dst_filepath,
-         shade_threshold, num_scenario_runs, change_prop_step, dst_t_dtype):
+         shade_threshold, num_scenario_runs, change_prop_step, dst_t_dtype,
+         interactions, nested, lazy, lulc_storage, seed,
+         num_generation_workers, generation_executor, lulc_memmap_filepath,
+         ucm_cache_dir, ucm_cache_max_mb, simulation_backend,
+         num_simulation_workers, simulation_chunksize, scheduler_address,
+         t_store, ucm_engine, simulation_batch_size, incremental_simulation,
+         output_format, complevel, t_precision, compact_endpoints,
+         metrics_filepath, incremental_metrics):
     logger = logging.getLogger(__name__)
     # disable InVEST's logging
     for module in ('natcap.invest.urban_cooling_model', 'natcap.invest.utils',
@@ -34,8 +87,16 @@ def main(agglom_lulc_filepath, biophysical_table_filepath, station_t_filepath,
     warnings.filterwarnings('ignore')
 
     # 1. generate a data array with the scenario land use/land cover
+    if seed is None and t_store is not None and path.exists(t_store):
+        # resume the scenarios of an existing store from the seed that they
+        # were generated from (stored as a string, see
+        # `scenario_utils.simulate_scenario_T_store`)
+        store_seed = xr.open_zarr(t_store).attrs.get('seed')
+        if store_seed is not None:
+            seed = int(store_seed)
     sg = scenario_utils.ScenarioGenerator(agglom_lulc_filepath,
-                                          biophysical_table_filepath)
+                                          biophysical_table_filepath,
+                                          seed=seed)
 
     scenario_runs = range(num_scenario_runs)
     # change_props = rn.uniform(size=num_scenario_samples)
@@ -45,10 +106,51 @@ def main(agglom_lulc_filepath, biophysical_table_filepath, station_t_filepath,
     #     change_props[0] = 0
     #     change_props[-1] = 1
     change_props = np.arange(0, 1 + change_prop_step, change_prop_step)
-    scenario_lulc_da = sg.generate_scenario_lulc_da(change_props,
-                                                    scenario_runs,
-                                                    shade_threshold)
-    num_scenarios = np.prod(scenario_lulc_da.shape[:-2])
+    if interactions:
+        interactions = list(interactions)
+    else:
+        interactions = ['random', 'cluster', 'scatter']
+    if lulc_storage == 'delta':
+        # store only the changed pixels of each scenario, which are lazily
+        # reconstructed into full LULC arrays for the simulation below
+        change_ds = sg.generate_scenario_change_ds(change_props,
+                                                   scenario_runs,
+                                                   shade_threshold,
+                                                   interactions=interactions,
+                                                   nested=nested)
+        scenario_lulc_da = change_ds.scenario_lulc.to_dataarray()
+        endpoint_lulc_da = None
+    else:
+        if lulc_memmap_filepath is not None:
+            # write the scenario LULC arrays to a memory-mapped file rather
+            # than keeping them in memory (except for the change proportions
+            # of 0 and 1, which are generated only once)
+            num_inner_change_props = np.sum((change_props != 0)
+                                            & (change_props != 1))
+            out = np.memmap(lulc_memmap_filepath,
+                            dtype=sg.lulc_arr.dtype,
+                            mode='w+',
+                            shape=(len(interactions), num_inner_change_props,
+                                   len(scenario_runs), *sg.lulc_arr.shape))
+        else:
+            out = None
+        # keep the scenarios of the change proportions other than 0 and 1
+        # apart from the endpoints (see `compact_scenario_endpoints`), so
+        # that they are simulated below as they are generated (i.e., in
+        # memory or memory-mapped) rather than as a dask array
+        scenario_lulc_ds = sg.generate_scenario_lulc_ds(
+            change_props,
+            scenario_runs,
+            shade_threshold,
+            interactions=interactions,
+            nested=nested,
+            lazy=lazy,
+            num_workers=num_generation_workers,
+            executor=generation_executor,
+            out=out)
+        scenario_lulc_da = scenario_lulc_ds['LULC']
+        endpoint_lulc_da = scenario_lulc_ds.get('LULC_endpoint')
+    num_scenarios = len(interactions) * len(change_props) * len(scenario_runs)
     logger.info("generated %d scenario LULC arrays", num_scenarios)
 
     # 2. simulate the air temperature (of the day with maximum UHI magnitude)
@@ -62,22 +164,111 @@ def main(agglom_lulc_filepath, biophysical_table_filepath, station_t_filepath,
     with open(calibrated_params_filepath) as src:
         ucm_params = json.load(src)
 
-    # 2.3 execute (at scale) the model for each scenario LULC array
+    # 2.3 execute (at scale) the model for each scenario LULC array, reusing
+    # the cached results of previous executions if possible
     # rio_meta = sg.lulc_meta.copy()
-    scenario_T_da = scenario_utils.simulate_scenario_T_da(
-        scenario_lulc_da, biophysical_table_filepath, ref_et_raster_filepath,
-        t_ref, uhi_max, ucm_params, dst_t_dtype)
+    if ucm_cache_dir is not None:
+        if ucm_cache_max_mb is not None:
+            ucm_cache_max_size = int(ucm_cache_max_mb * 2**20)
+        else:
+            ucm_cache_max_size = None
+        ucm_cache = scenario_utils.UCMResultCache(ucm_cache_dir,
+                                                  max_size=ucm_cache_max_size)
+    else:
+        ucm_cache = None
+    simulate_kws = dict(ucm_cache=ucm_cache,
+                        backend=simulation_backend,
+                        num_workers=num_simulation_workers,
+                        chunksize=simulation_chunksize,
+                        scheduler_address=scheduler_address,
+                        engine=ucm_engine)
+    if metrics_filepath is not None:
+        # compute the landscape metrics of each scenario in the task that
+        # simulates it, i.e., where its LULC array is materialized, rather
+        # than reading the dumped dataset back (as in
+        # `make_scenario_metrics.py`), with the exact proportion of landscape
+        # of every scenario
+        high_tree_codes = sg.biophysical_df[
+            sg.biophysical_df['shade'] >= shade_threshold][sg.lulc_col].values
+        metrics_kws = dict(high_tree_codes=high_tree_codes,
+                           res=sg.lulc_meta['transform'].a,
+                           incremental=incremental_metrics)
+    else:
+        metrics_kws = None
+    if t_store is not None:
+        if incremental_simulation:
+            raise click.UsageError(
+                "--incremental-simulation is not supported with --t-store")
+        # stream each temperature array (and the metrics, if any) to the
+        # store as soon as it is simulated (resuming the simulations if the
+        # store already exists), and then read it lazily to dump the dataset
+        # below
+        simulated = scenario_utils.simulate_scenario_T_store(
+            scenario_lulc_da,
+            t_store,
+            biophysical_table_filepath,
+            ref_et_raster_filepath,
+            t_ref,
+            uhi_max,
+            ucm_params,
+            dst_t_dtype,
+            endpoint_lulc_da=endpoint_lulc_da,
+            metrics_kws=metrics_kws,
+            **simulate_kws)
+    else:
+        simulated = scenario_utils.simulate_scenario_T_da(
+            scenario_lulc_da,
+            biophysical_table_filepath,
+            ref_et_raster_filepath,
+            t_ref,
+            uhi_max,
+            ucm_params,
+            dst_t_dtype,
+            batch_size=simulation_batch_size,
+            incremental=incremental_simulation,
+            endpoint_lulc_da=endpoint_lulc_da,
+            metrics_kws=metrics_kws,
+            **simulate_kws)
+    if metrics_kws is not None:
+        scenario_T_da, scenario_metrics_df = simulated
+    else:
+        scenario_T_da = simulated
     logger.info("simulated air temperature rasters for the %d scenarios",
                 num_scenarios)
+    if metrics_kws is not None:
+        scenario_metrics_df.to_csv(metrics_filepath, index=False)
+        logger.info("dumped scenario metrics data frame to %s",
+                    metrics_filepath)
 
     # 3. dump the dataset into a file
-    xr.Dataset(
-        {
-            'LULC': scenario_lulc_da,
-            'T': scenario_T_da
-        },
-        attrs=dict(pyproj_srs=scenario_lulc_da.attrs['pyproj_srs'])).to_netcdf(
-            dst_filepath, mode='w')
+    if lulc_storage == 'delta':
+        scenario_ds = change_ds.assign(T=scenario_T_da)
+    else:
+        # broadcast the endpoints (if any) only now
+        scenario_lulc_da = scenario_utils.expand_scenario_endpoints(
+            scenario_lulc_ds)['LULC']
+        scenario_ds = xr.Dataset(
+            {
+                'LULC': scenario_lulc_da,
+                'T': scenario_T_da
+            },
+            attrs=dict(pyproj_srs=scenario_lulc_da.attrs['pyproj_srs'],
+                       seed=scenario_lulc_da.attrs['seed']))
+    if compact_endpoints:
+        # store the scenarios of the change proportions of 0 and 1 only once
+        # rather than for each interaction and scenario run (use
+        # `scenario_utils.open_scenario_ds` to read the dataset)
+        scenario_ds = scenario_utils.compact_scenario_endpoints(scenario_ds)
+    if output_format == 'netcdf' and complevel is None and t_precision is None:
+        scenario_ds.to_netcdf(dst_filepath, mode='w')
+    else:
+        # chunk the dataset by scenario, with minimal integer dtypes and
+        # (optionally) compression and packed temperatures
+        scenario_utils.dump_scenario_ds(scenario_ds,
+                                        dst_filepath,
+                                        fmt=output_format,
+                                        complevel=complevel,
+                                        t_precision=t_precision)
     logger.info("dumped scenario dataset to %s", dst_filepath)
 
 
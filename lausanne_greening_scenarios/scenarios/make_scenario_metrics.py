@@ -1,37 +1,94 @@
+import functools
 import itertools
 import logging
 
 import click
+import dask
 import numpy as np
 import pandas as pd
 import pylandstats as pls
 import salem  # noqa: F401
 import xarray as xr
-from tqdm import tqdm
 
 from lausanne_greening_scenarios import settings
-
-# register tqdm with pandas to be able to use `progress_apply`
-tqdm.pandas()
-
-HIGH_TREE_CLASS_VAL = 1
-OTHER_CLASS_VAL = 2
+from lausanne_greening_scenarios.scenarios import utils as scenario_utils
 
 # metrics = ('MPS', 'ED', 'MSI')
 METRICS = ['area_mn', 'edge_density', 'shape_index_mn']
 
 
+# each worker (process) opens the dataset once and then only reads the
+# scenario LULC arrays of its tasks (one chunk per scenario)
+@functools.lru_cache(maxsize=1)
+def _get_scenario_reader(scenario_ds_filepath):
+    # the LULC arrays might be stored as sparse changes (deltas)
+    return scenario_utils.ScenarioReader(
+        scenario_utils.get_scenario_lulc_da(
+            xr.open_dataset(scenario_ds_filepath)))
+
+
+def compute_metrics(scenario_ds_filepath, scenario_sels, landscape_lut,
+                    high_tree_codes, res, nodata, metrics, engine):
+    # compute the metrics of a batch of scenarios, returning a data frame with
+    # a row for each scenario
+    # landscape_arr = sg.generate_landscape_arr(shade_threshold,
+    #                                           row['change_prop'],
+    #                                           interaction=row['interaction'])
+    scenario_reader = _get_scenario_reader(scenario_ds_filepath)
+    landscape_arrs = [
+        scenario_utils.get_landscape_arr(scenario_reader.read(scenario_sel),
+                                         landscape_lut, high_tree_codes,
+                                         nodata)
+        for scenario_sel in scenario_sels
+    ]
+    if engine == 'native':
+        # the whole batch is processed at once
+        return scenario_utils.compute_landscape_metrics(
+            landscape_arrs, scenario_utils.HIGH_TREE_CLASS_VAL, res, nodata,
+            metrics)
+    elif engine == 'incremental':
+        # the batch is a sequence of increasing change proportions
+        return scenario_utils.compute_incremental_landscape_metrics(
+            landscape_arrs, scenario_utils.HIGH_TREE_CLASS_VAL, res, nodata,
+            metrics)
+
+    metrics_sers = []
+    for landscape_arr in landscape_arrs:
+        ls = pls.Landscape(landscape_arr, (res, res), nodata)
+        # return [
+        #     getattr(ls, metric)(high_tree_class_val) for metric in metrics]
+        metrics_sers.append(
+            pd.Series({
+                metric:
+                getattr(ls, metric)(scenario_utils.HIGH_TREE_CLASS_VAL)
+                for metric in metrics
+            }))
+    return pd.DataFrame(metrics_sers, columns=metrics)
+
+
 @click.command()
 @click.argument('scenario_ds_filepath', type=click.Path(exists=True))
 @click.argument('biophysical_table_filepath', type=click.Path(exists=True))
 @click.argument('dst_filepath', type=click.Path())
 @click.option('--shade-threshold', default=0.75)
+@click.option('--backend',
+              type=click.Choice(
+                  ['serial', 'threads', 'processes', 'distributed']),
+              default='serial')
+@click.option('--num-workers', type=int)
+@click.option('--chunksize', type=int)
+@click.option('--scheduler-address')
+@click.option('--metrics-engine',
+              type=click.Choice(['pylandstats', 'native', 'incremental']),
+              default='pylandstats')
+@click.option('--metrics-batch-size', type=int)
 def main(scenario_ds_filepath, biophysical_table_filepath, dst_filepath,
-         shade_threshold):
+         shade_threshold, backend, num_workers, chunksize, scheduler_address,
+         metrics_engine, metrics_batch_size):
     logger = logging.getLogger(__name__)
 
     scenario_ds = xr.open_dataset(scenario_ds_filepath)
-    scenario_lulc_da = scenario_ds['LULC']
+    scenario_lulc_da = _get_scenario_reader(scenario_ds_filepath).scenario_da
 
     # scenario_dims = scenario_lulc_da.coords.dims[:2]
     scenario_dims = scenario_lulc_da.coords.dims[:-2]
@@ -43,38 +100,65 @@ def main(scenario_ds_filepath, biophysical_table_filepath, dst_filepath,
     scenario_runs = scenario_lulc_da['scenario_run'].values
 
     biophysical_df = pd.read_csv(biophysical_table_filepath)
-
-    # define the functions so that the fixed arguments are curried into them,
-    # except for `metrics`
-    def compute_metrics(row, metrics):
-        # landscape_arr = sg.generate_landscape_arr(shade_threshold,
-        #                                           row['change_prop'],
-        #                                           interaction=row['interaction'])
-        lulc_arr = scenario_lulc_da.sel({
+    high_tree_codes = biophysical_df[biophysical_df['shade'] >=
+                                     shade_threshold]['lucode'].values
+    # the look-up table is computed only once (and shipped to the workers)
+    landscape_lut = scenario_utils.get_landscape_lut(scenario_lulc_da.dtype,
+                                                     high_tree_codes, nodata)
+
+    # each batch of scenarios is a task that reads its own LULC arrays from
+    # the dataset file, so that the tasks can be distributed to any worker
+    # (note that the order of the results does not depend on the backend). By
+    # default, the native engine processes `NATIVE_METRICS_BATCH_SIZE`
+    # scenarios per task and pylandstats one, whereas the incremental engine
+    # processes all the change proportions of a scenario run of an
+    # interaction (regardless of `metrics_batch_size`)
+    if metrics_batch_size is None:
+        if metrics_engine == 'native':
+            metrics_batch_size = scenario_utils.NATIVE_METRICS_BATCH_SIZE
+        else:
+            metrics_batch_size = 1
+    if metrics_engine == 'incremental' and not scenario_lulc_da.attrs.get(
+            'nested'):
+        logger.warning(
+            "the scenarios are not nested, so the incremental engine will "
+            "label the landscape of each change proportion")
+
+    def compute_metrics_df(scenario_df, metrics):
+        scenario_sels = [{
             scenario_dim: row[scenario_dim]
             for scenario_dim in scenario_dims
-        }).values
-        landscape_arr = np.full_like(lulc_arr, nodata)
-        landscape_arr[lulc_arr != nodata] = OTHER_CLASS_VAL
-        landscape_arr[np.isin(
-            lulc_arr,
-            biophysical_df[biophysical_df['shade'] >= shade_threshold]
-            ['lucode'])] = HIGH_TREE_CLASS_VAL
-        ls = pls.Landscape(landscape_arr, (res, res), nodata)
-        # return [
-        #     getattr(ls, metric)(high_tree_class_val) for metric in metrics]
-        return pd.Series({
-            metric: getattr(ls, metric)(HIGH_TREE_CLASS_VAL)
-            for metric in metrics
-        })
-
-    def compute_endpoint_metrics(row, metrics):
-        # interaction could be anything, since we are changing none or all the
-        # changeable pixels
-        _row = dict(interaction='cluster',
-                    change_prop=row['change_prop'],
-                    scenario_run=0)
-        return compute_metrics(_row, metrics)
+        } for _, row in scenario_df.iterrows()]
+        # positions of the scenarios of each batch
+        if metrics_engine == 'incremental':
+            scenario_change_props = scenario_df['change_prop'].values
+            run_batches = scenario_df.groupby(['interaction', 'scenario_run'],
+                                              sort=False).indices.values()
+            batches = [
+                batch[np.argsort(scenario_change_props[batch], kind='stable')]
+                for batch in run_batches
+            ]
+        else:
+            batches = [
+                np.arange(start,
+                          min(start + metrics_batch_size, len(scenario_df)))
+                for start in range(0, len(scenario_df), metrics_batch_size)
+            ]
+        tasks = [
+            dask.delayed(compute_metrics)(scenario_ds_filepath,
+                                          [scenario_sels[i] for i in batch],
+                                          landscape_lut, high_tree_codes, res,
+                                          nodata, metrics, metrics_engine)
+            for batch in batches
+        ]
+        metrics_dfs = scenario_utils.compute_tasks(
+            tasks,
+            backend=backend,
+            num_workers=num_workers,
+            chunksize=chunksize,
+            scheduler_address=scheduler_address)
+        return pd.concat(list(metrics_dfs), ignore_index=True).set_axis(
+            scenario_df.index[np.concatenate(batches)]).loc[scenario_df.index]
 
     # prepare the dataframe of metrics (except PLAND) for each scenario,
     # except for the endpoints (change proportion of 0 and 1, since these will
@@ -86,18 +170,18 @@ def main(scenario_ds_filepath, biophysical_table_filepath, dst_filepath,
                               scenario_ds['scenario_run'].values)),
         columns=['interaction', 'change_prop', 'scenario_run'])
     scenario_df[METRICS] = np.nan
-    # TODO: use dask here
     # now fill it by computing the landscape metrics
-    scenario_df[METRICS] = scenario_df.progress_apply(compute_metrics,
-                                                      axis=1,
-                                                      args=(METRICS, ))
+    scenario_df[METRICS] = compute_metrics_df(scenario_df, METRICS)
 
     # now compute the metrics (including PLAND) for the endpoints
     endpoint_metrics = ['proportion_of_landscape'] + METRICS
     endpoint_scenario_df = pd.DataFrame([0, 1], columns=['change_prop'])
-    endpoint_scenario_df[
-        endpoint_metrics] = endpoint_scenario_df.progress_apply(
-            compute_endpoint_metrics, axis=1, args=(endpoint_metrics, ))
+    # interaction could be anything, since we are changing none or all the
+    # changeable pixels
+    endpoint_scenario_df[endpoint_metrics] = compute_metrics_df(
+        endpoint_scenario_df.assign(interaction=interactions[0],
+                                    scenario_run=scenario_runs[0]),
+        endpoint_metrics)
     # repeat the endpoint metrics accross `interactions` and `scenario_runs`
     # to have a consistent data frame structure with `scenario_df`
     num_interactions = len(interactions)
@@ -0,0 +1,390 @@
+import numpy as np
+import pandas as pd
+from scipy import ndimage as ndi
+from scipy import sparse
+from scipy.sparse import csgraph
+
+# Moore neighborhood, with which the patches are labeled (as in pylandstats)
+KERNEL_MOORE = ndi.generate_binary_structure(2, 2)
+
+# values of the high tree cover and other classes of the landscape arrays of
+# the scenario metrics (see `get_landscape_arr`)
+HIGH_TREE_CLASS_VAL = 1
+OTHER_CLASS_VAL = 2
+# class-level landscape metrics of the native engine (with the definitions
+# of FRAGSTATS/pylandstats, see `compute_landscape_metrics`), in the column
+# order of the data frames of `make_scenario_metrics.py`
+NATIVE_LANDSCAPE_METRICS = [
+    'area_mn', 'edge_density', 'shape_index_mn', 'proportion_of_landscape'
+]
+# number of landscape arrays whose metrics are computed at once by each task
+# of the native engine
+NATIVE_METRICS_BATCH_SIZE = 8
+
+
+def get_landscape_lut(lulc_dtype, high_tree_codes, nodata):
+    # look-up table from each LULC code to its landscape class (high tree
+    # cover, other or nodata), indexed by the codes viewed as unsigned
+    # integers (see `get_landscape_arr`). Only 8 and 16-bit codes are
+    # supported, otherwise returns None
+    lulc_dtype = np.dtype(lulc_dtype)
+    if lulc_dtype.kind not in 'iu' or lulc_dtype.itemsize > 2:
+        return None
+    uint_dtype = np.dtype(f'u{lulc_dtype.itemsize}')
+    lut = np.full(np.iinfo(uint_dtype).max + 1, OTHER_CLASS_VAL, lulc_dtype)
+    lut[np.asarray(high_tree_codes,
+                   dtype=lulc_dtype).view(uint_dtype)] = HIGH_TREE_CLASS_VAL
+    lut[np.asarray(nodata, dtype=lulc_dtype).view(uint_dtype)] = nodata
+    return lut
+
+
+def get_landscape_arr(lulc_arr, landscape_lut, high_tree_codes, nodata):
+    # binarize the LULC array into high tree cover and other pixels with a
+    # single gather from the look-up table (if any)
+    if landscape_lut is not None:
+        return landscape_lut[lulc_arr.view(f'u{lulc_arr.itemsize}')]
+    landscape_arr = np.full_like(lulc_arr, nodata)
+    landscape_arr[lulc_arr != nodata] = OTHER_CLASS_VAL
+    landscape_arr[np.isin(lulc_arr, high_tree_codes)] = HIGH_TREE_CLASS_VAL
+    return landscape_arr
+
+
+def _count_edge_sides(class_cond, other_cond):
+    # number of cell sides shared by a class cell and a cell of another
+    # (non-nodata) class, along the rows and along the columns of the last
+    # two axes
+    return np.count_nonzero(
+        (class_cond[..., 1:, :] & other_cond[..., :-1, :]) |
+        (class_cond[..., :-1, :] & other_cond[..., 1:, :]),
+        axis=(-2, -1)) + np.count_nonzero(
+            (class_cond[..., 1:] & other_cond[..., :-1]) |
+            (class_cond[..., :-1] & other_cond[..., 1:]),
+            axis=(-2, -1))
+
+
+def _get_exposed_sides(class_cond):
+    # number of sides of each cell (along the last two axes) that are not
+    # shared with a class cell, including the sides at the landscape boundary
+    padded_cond = np.pad(class_cond,
+                         [(0, 0)] * (class_cond.ndim - 2) + [(1, 1), (1, 1)])
+    return 4 - (padded_cond[..., :-2, 1:-1].astype(np.uint8) +
+                padded_cond[..., 2:, 1:-1] + padded_cond[..., 1:-1, :-2] +
+                padded_cond[..., 1:-1, 2:])
+
+
+def _get_shape_index(patch_areas, patch_perimeters):
+    # shape index of patches of square cells (with their areas and perimeters
+    # in number of cells and cell sides respectively), i.e., the perimeter
+    # relative to the minimum perimeter of a patch of the same area
+    n = np.floor(np.sqrt(patch_areas))
+    min_perimeters = np.where(
+        patch_areas == n**2, 4 * n,
+        np.where(patch_areas <= n * (n + 1), 4 * n + 2, 4 * n + 4))
+    return patch_perimeters / min_perimeters
+
+
+def compute_landscape_metrics(landscape_arrs,
+                              class_val,
+                              res,
+                              nodata,
+                              metrics=None):
+    # compute class-level metrics (among `NATIVE_LANDSCAPE_METRICS`) of a
+    # stack of landscape arrays of square cells of size `res`, returning a
+    # data frame with a row for each landscape. As in pylandstats' defaults,
+    # the patches are labeled with the Moore neighborhood, the perimeter of
+    # the patches includes the landscape boundary and the nodata pixels,
+    # whereas the total edge does not. The stack is labeled at once (with a
+    # structure that does not connect the landscapes) and the patch areas and
+    # perimeters are obtained with `np.bincount`
+    if metrics is None:
+        metrics = NATIVE_LANDSCAPE_METRICS
+    landscape_arrs = np.asarray(landscape_arrs)
+    num_landscapes = len(landscape_arrs)
+    data_cond = landscape_arrs != nodata
+    class_cond = landscape_arrs == class_val
+    other_cond = data_cond & ~class_cond
+    landscape_cells = np.count_nonzero(data_cond, axis=(1, 2))
+    class_cells = np.count_nonzero(class_cond, axis=(1, 2))
+    cell_area = res * res
+
+    metrics_dict = {}
+    if 'proportion_of_landscape' in metrics:
+        metrics_dict['proportion_of_landscape'] = (100 * class_cells /
+                                                   landscape_cells)
+    if 'edge_density' in metrics:
+        edge_sides = _count_edge_sides(class_cond, other_cond)
+        metrics_dict['edge_density'] = (edge_sides * res * 10000 /
+                                        (landscape_cells * cell_area))
+
+    if 'area_mn' in metrics or 'shape_index_mn' in metrics:
+        structure = np.zeros((3, 3, 3), dtype=bool)
+        structure[1] = KERNEL_MOORE
+        label_arrs, num_patches = ndi.label(class_cond, structure)
+        # the patches are labeled in order, so the labels of each landscape
+        # are greater than those of the previous ones
+        landscape_max_labels = np.maximum.accumulate(
+            label_arrs.reshape(num_landscapes, -1).max(axis=1))
+        patch_landscapes = np.searchsorted(landscape_max_labels,
+                                           np.arange(1, num_patches + 1))
+        landscape_num_patches = np.bincount(patch_landscapes,
+                                            minlength=num_landscapes)
+        patch_areas = np.bincount(label_arrs.ravel(),
+                                  minlength=num_patches + 1)[1:]
+
+        def _mean(patch_values):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.bincount(
+                    patch_landscapes,
+                    weights=patch_values,
+                    minlength=num_landscapes) / landscape_num_patches
+
+        if 'area_mn' in metrics:
+            metrics_dict['area_mn'] = _mean(patch_areas * cell_area / 10000)
+        if 'shape_index_mn' in metrics:
+            # the sides of each class cell that are not adjacent to another
+            # class cell (i.e., of the same patch) are part of the perimeter
+            exposed_sides = _get_exposed_sides(class_cond)
+            patch_perimeters = np.bincount(label_arrs[class_cond],
+                                           weights=exposed_sides[class_cond],
+                                           minlength=num_patches + 1)[1:]
+            metrics_dict['shape_index_mn'] = _mean(
+                _get_shape_index(patch_areas, patch_perimeters))
+
+    return pd.DataFrame(metrics_dict, columns=metrics)
+
+
+class IncrementalLandscapeMetrics:
+    # class-level landscape metrics (as in `compute_landscape_metrics`) of a
+    # landscape array that is updated by converting pixels to the class,
+    # e.g., the scenarios of increasing change proportions of a nested run.
+    # The patches are kept as a union-find forest of patch labels, so that
+    # each conversion only visits the (Moore) neighbors of the converted
+    # pixels, merging the patches that they connect and updating the area and
+    # perimeter of the (root) patches and the total edge. Any other change
+    # (e.g., pixels that are no longer of the class or different nodata
+    # pixels) requires labeling the whole landscape again
+    def __init__(self, landscape_arr, class_val, res, nodata):
+        self.class_val = class_val
+        self.res = res
+        self.nodata = nodata
+        self.shape = landscape_arr.shape
+        # the pixel arrays are flattened with a one-pixel padding (which is
+        # neither data nor of the class), so that the neighbors of a pixel
+        # are always at the same offsets of its flat index
+        padded_width = self.shape[1] + 2
+        self.side_offsets = np.array([-padded_width, padded_width, -1, 1])
+        self.moore_offsets = np.array([
+            row_offset * padded_width + col_offset
+            for row_offset, col_offset in np.argwhere(KERNEL_MOORE) - 1
+            if row_offset or col_offset
+        ])
+        self._label(landscape_arr)
+
+    def _pad(self, arr):
+        return np.pad(arr, 1).ravel()
+
+    def _label(self, landscape_arr):
+        data_cond = landscape_arr != self.nodata
+        class_cond = landscape_arr == self.class_val
+        label_arr, num_patches = ndi.label(class_cond, KERNEL_MOORE)
+        # the arrays of the patches are indexed by their label (the values
+        # for the label 0, i.e., not of the class, are meaningless)
+        self.parent = np.arange(num_patches + 1)
+        self.patch_areas = np.bincount(label_arr.ravel(),
+                                       minlength=num_patches + 1)
+        self.patch_perimeters = np.bincount(
+            label_arr.ravel(),
+            weights=_get_exposed_sides(class_cond).ravel(),
+            minlength=num_patches + 1).astype(np.int64)
+        self.is_root = self.parent > 0
+        self.landscape_cells = np.count_nonzero(data_cond)
+        self.class_cells = np.count_nonzero(class_cond)
+        self.edge_sides = _count_edge_sides(class_cond,
+                                            data_cond & ~class_cond)
+        self.data_cond = self._pad(data_cond)
+        self.class_cond = self._pad(class_cond)
+        self.label_arr = self._pad(label_arr)
+
+    def _find(self, labels):
+        # get the root of each patch label, compressing their paths
+        roots = self.parent[labels]
+        while True:
+            parent_roots = self.parent[roots]
+            if np.array_equal(parent_roots, roots):
+                break
+            roots = parent_roots
+        self.parent[labels] = roots
+        return roots
+
+    def add_pixels(self, idx):
+        # convert the (non-nodata) pixels of unique flat indices `idx`, which
+        # must not be of the class, to the class
+        rows, cols = np.divmod(np.asarray(idx), self.shape[1])
+        self._add_pixels((rows + 1) * (self.shape[1] + 2) + cols + 1)
+
+    def _add_pixels(self, idx):
+        # same as `add_pixels` but with flat indices of the padded arrays
+        num_pixels = len(idx)
+        if num_pixels == 0:
+            return
+        # the neighbor arrays have a row for each offset and a column for
+        # each converted pixel
+        side_idx = idx + self.side_offsets[:, np.newaxis]
+        # each converted pixel removes an edge with each neighboring class
+        # pixel (and the exposed side of the latter)...
+        class_side_cond = self.class_cond[side_idx]
+        self.class_cond[idx] = True
+        # ...and adds an edge with each neighboring pixel of another
+        # (non-nodata) class, whereas its exposed sides are those that are
+        # not shared with a class pixel (including the converted ones)
+        new_class_side_cond = self.class_cond[side_idx]
+        self.class_cells += num_pixels
+        self.edge_sides += np.count_nonzero(
+            self.data_cond[side_idx]
+            & ~new_class_side_cond) - np.count_nonzero(class_side_cond)
+
+        # each converted pixel is first a patch of its own. Since the removed
+        # exposed sides belong to the neighboring patches, which will be
+        # merged with the pixel's patch, they are subtracted from the latter
+        perimeters = np.full(num_pixels, 4, dtype=np.int64)
+        for side_cond in [class_side_cond, new_class_side_cond]:
+            for offset_cond in side_cond:
+                perimeters -= offset_cond
+        num_labels = len(self.parent)
+        labels = np.arange(num_labels, num_labels + num_pixels)
+        self.label_arr[idx] = labels
+        self.parent = np.concatenate([self.parent, labels])
+        self.patch_areas = np.concatenate([
+            self.patch_areas,
+            np.ones(num_pixels, dtype=self.patch_areas.dtype)
+        ])
+        self.patch_perimeters = np.concatenate(
+            [self.patch_perimeters, perimeters])
+        self.is_root = np.concatenate(
+            [self.is_root, np.ones(num_pixels, dtype=bool)])
+
+        # union of the patches of the converted pixels with the patches of
+        # their neighboring class pixels as the connected components of a
+        # graph whose nodes are the converted pixels followed by the roots of
+        # the neighboring patches (the edges between converted pixels are
+        # only added once)
+        src_nodes = []
+        dst_labels = []
+        for offset in self.moore_offsets:
+            neighbor_idx = idx + offset
+            nodes = np.flatnonzero(self.class_cond[neighbor_idx])
+            neighbor_labels = self.label_arr[neighbor_idx[nodes]]
+            edge_cond = (neighbor_labels < num_labels) | (offset > 0)
+            src_nodes.append(nodes[edge_cond])
+            dst_labels.append(neighbor_labels[edge_cond])
+        src_nodes = np.concatenate(src_nodes)
+        dst_roots = self._find(np.concatenate(dst_labels))
+        root_cond = np.zeros(num_labels, dtype=bool)
+        root_cond[dst_roots[dst_roots < num_labels]] = True
+        node_labels = np.concatenate([labels, np.flatnonzero(root_cond)])
+        label_nodes = np.empty(len(self.parent), dtype=np.int64)
+        label_nodes[node_labels] = np.arange(len(node_labels))
+        num_components, component_idx = csgraph.connected_components(
+            sparse.coo_matrix((np.ones(len(src_nodes), dtype=bool),
+                               (src_nodes, label_nodes[dst_roots])),
+                              shape=(len(node_labels), len(node_labels))),
+            directed=False)
+        # each component is merged into one of its nodes (any of them)
+        component_roots = np.empty(num_components, dtype=np.int64)
+        component_roots[component_idx] = node_labels
+        for patch_arr in [self.patch_areas, self.patch_perimeters]:
+            component_sums = np.bincount(component_idx,
+                                         weights=patch_arr[node_labels],
+                                         minlength=num_components)
+            patch_arr[component_roots] = component_sums
+        self.parent[node_labels] = component_roots[component_idx]
+        self.is_root[node_labels] = False
+        self.is_root[component_roots] = True
+
+    def update(self, landscape_arr):
+        # update the landscape to `landscape_arr`, incrementally if it only
+        # differs by pixels converted to the class
+        data_cond = self._pad(landscape_arr != self.nodata)
+        class_cond = self._pad(landscape_arr == self.class_val)
+        removed_cond = self.class_cond & ~class_cond
+        if np.array_equal(data_cond,
+                          self.data_cond) and not removed_cond.any():
+            self._add_pixels(np.flatnonzero(class_cond & ~self.class_cond))
+        else:
+            self._label(landscape_arr)
+
+    def get_metrics(self, metrics=None):
+        if metrics is None:
+            metrics = NATIVE_LANDSCAPE_METRICS
+        cell_area = self.res * self.res
+        roots = np.flatnonzero(self.is_root)
+        patch_areas = self.patch_areas[roots]
+        metrics_dict = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if 'proportion_of_landscape' in metrics:
+                metrics_dict['proportion_of_landscape'] = (
+                    100 * self.class_cells / self.landscape_cells)
+            if 'edge_density' in metrics:
+                metrics_dict['edge_density'] = (
+                    self.edge_sides * self.res * 10000 /
+                    (self.landscape_cells * cell_area))
+            if 'area_mn' in metrics:
+                metrics_dict['area_mn'] = np.sum(
+                    patch_areas * cell_area / 10000) / len(roots)
+            if 'shape_index_mn' in metrics:
+                metrics_dict['shape_index_mn'] = np.sum(
+                    _get_shape_index(
+                        patch_areas,
+                        self.patch_perimeters[roots])) / len(roots)
+
+        return pd.Series(metrics_dict)[metrics]
+
+
+def compute_incremental_landscape_metrics(landscape_arrs,
+                                          class_val,
+                                          res,
+                                          nodata,
+                                          metrics=None):
+    # compute the metrics of a sequence of landscape arrays (as in
+    # `compute_landscape_metrics`), where each array is labeled only if it
+    # is not obtained by converting pixels of the previous one to the class
+    # (see `IncrementalLandscapeMetrics`), e.g., the increasing change
+    # proportions of a nested scenario run
+    if metrics is None:
+        metrics = NATIVE_LANDSCAPE_METRICS
+    landscape_metrics = None
+    metrics_sers = []
+    for landscape_arr in landscape_arrs:
+        if landscape_metrics is None:
+            landscape_metrics = IncrementalLandscapeMetrics(
+                landscape_arr, class_val, res, nodata)
+        else:
+            landscape_metrics.update(landscape_arr)
+        metrics_sers.append(landscape_metrics.get_metrics(metrics))
+
+    return pd.DataFrame(metrics_sers, columns=metrics)
+
+
+def compute_lulc_metrics(lulc_arrs,
+                         high_tree_codes,
+                         res,
+                         nodata,
+                         metrics,
+                         incremental=False):
+    # compute the metrics of the high tree cover class of a batch of LULC
+    # arrays (with `compute_incremental_landscape_metrics` if `incremental`
+    # is True, i.e., for a sequence of increasing change proportions),
+    # returning an array with a row for each LULC array. The look-up table is
+    # built within the batch so that tasks do not need to carry it
+    landscape_lut = get_landscape_lut(lulc_arrs[0].dtype, high_tree_codes,
+                                      nodata)
+    landscape_arrs = [
+        get_landscape_arr(lulc_arr, landscape_lut, high_tree_codes, nodata)
+        for lulc_arr in lulc_arrs
+    ]
+    if incremental:
+        compute_func = compute_incremental_landscape_metrics
+    else:
+        compute_func = compute_landscape_metrics
+    return compute_func(landscape_arrs, HIGH_TREE_CLASS_VAL, res, nodata,
+                        metrics).values
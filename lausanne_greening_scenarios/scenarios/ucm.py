@@ -0,0 +1,805 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import weakref
+from os import path
+
+import dask
+import invest_ucm_calibration as iuc
+import numpy as np
+import pandas as pd
+import rasterio as rio
+from dask import diagnostics
+from rasterio import shutil as rio_shutil
+from rasterio import warp
+from scipy import fft, signal
+
+from lausanne_greening_scenarios.scenarios.metrics import compute_lulc_metrics
+
+# nodata values of the intermediate rasters of the urban cooling model and of
+# the convolved ones, including the output air temperature (see
+# `NativeUCMRunner`)
+UCM_NODATA = -1
+UCM_T_NODATA = np.finfo(np.float32).min
+# decimals to which the convolutions are rounded in the comparisons of the
+# heat mitigation index (see `NativeUCMRunner`)
+UCM_DECIMALS = 9
+# number of LULC arrays that are simulated at once by each task of the native
+# engine (see `simulate_scenario_T_da`)
+NATIVE_UCM_BATCH_SIZE = 4
+# maximum proportion of the grid affected by the changed pixels for which the
+# air temperature is updated incrementally rather than fully simulated (see
+# `NativeUCMRunner.update_state`)
+INCREMENTAL_MAX_WINDOW_PROP = 0.5
+
+
+class UCMResultCache:
+    # content-addressed on-disk cache of simulated air temperature arrays,
+    # keyed by a hash of the LULC array and the simulation inputs. If
+    # `max_size` (in bytes) is provided, the least recently used arrays are
+    # evicted when the cache exceeds it (the access time is kept as the
+    # modification time of the files so that it is shared among processes)
+    def __init__(self, cache_dir, max_size=None):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def get_key(self, lulc_arr, input_key):
+        h = hashlib.sha256(input_key.encode())
+        h.update(f'{lulc_arr.dtype.str}{lulc_arr.shape}'.encode())
+        h.update(np.ascontiguousarray(lulc_arr).data)
+        return h.hexdigest()
+
+    def _get_filepath(self, key):
+        return path.join(self.cache_dir, f'{key}.npy')
+
+    def load(self, key):
+        filepath = self._get_filepath(key)
+        try:
+            t_arr = np.load(filepath)
+            # mark it as the most recently used
+            os.utime(filepath)
+            return t_arr
+        except (FileNotFoundError, ValueError, OSError):
+            # missing, evicted in the meantime or partially written
+            return None
+
+    def save(self, key, t_arr):
+        # write to a temporary file and then rename it so that other
+        # processes never read a partially written array
+        fd, tmp_filepath = tempfile.mkstemp(suffix='.npy.tmp',
+                                            dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, t_arr)
+        os.replace(tmp_filepath, self._get_filepath(key))
+        if self.max_size is not None:
+            self.evict()
+
+    def evict(self):
+        # remove the least recently used arrays until the cache fits in
+        # `max_size`
+        file_stats = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.npy'):
+                filepath = path.join(self.cache_dir, filename)
+                try:
+                    file_stat = os.stat(filepath)
+                except FileNotFoundError:
+                    continue
+                file_stats.append(
+                    (file_stat.st_mtime, file_stat.st_size, filepath))
+        cache_size = sum(file_stat[1] for file_stat in file_stats)
+        for _, file_size, filepath in sorted(file_stats):
+            if cache_size <= self.max_size:
+                break
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                pass
+            cache_size -= file_size
+
+
+def get_ucm_input_key(rio_meta, biophysical_table_filepath,
+                      ref_et_raster_filepath, t_ref, uhi_max, ucm_params,
+                      cc_method, engine):
+    # hash of all the simulation inputs other than the LULC array (see
+    # `UCMResultCache`), including the contents of the input files and the
+    # engine (since the results of the engines might slightly differ)
+    h = hashlib.sha256()
+    for filepath in [biophysical_table_filepath, ref_et_raster_filepath]:
+        with open(filepath, 'rb') as src:
+            for chunk in iter(lambda: src.read(2**20), b''):
+                h.update(chunk)
+    params = [
+        repr(sorted(rio_meta.items())),
+        np.asarray(t_ref).tolist(),
+        np.asarray(uhi_max).tolist(), ucm_params, cc_method, engine
+    ]
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class UCMRunner:
+    # simulate the air temperature of LULC arrays with a single
+    # `UCMWrapper`, so that the fixed inputs (biophysical table, reference
+    # evapotranspiration, temperatures and model parameters) are only set up
+    # once, e.g., once per worker process. The LULC arrays are passed to the
+    # model as in-memory GDAL rasters (`/vsimem/`)
+    def __init__(self,
+                 rio_meta,
+                 biophysical_table_filepath,
+                 ref_et_raster_filepath,
+                 t_ref,
+                 uhi_max,
+                 ucm_params,
+                 cc_method='factors'):
+        self.rio_meta = rio_meta
+        self.lulc_raster_filepath = f'/vsimem/{uuid.uuid4().hex}/lulc.tif'
+        self.workspace_dir = tempfile.mkdtemp()
+        # remove the workspace when the runner is garbage-collected or at the
+        # latest when the (worker) process exits
+        weakref.finalize(self, shutil.rmtree, self.workspace_dir, True)
+
+        # the wrapper only reads the metadata and extent of the LULC raster
+        # on initialization, so we use an empty one
+        self._write_lulc_raster(
+            np.zeros((rio_meta['height'], rio_meta['width']),
+                     dtype=rio_meta['dtype']))
+        try:
+            self.ucm_wrapper = iuc.UCMWrapper(self.lulc_raster_filepath,
+                                              biophysical_table_filepath,
+                                              cc_method,
+                                              ref_et_raster_filepath,
+                                              t_ref,
+                                              uhi_max,
+                                              workspace_dir=self.workspace_dir,
+                                              extra_ucm_args=ucm_params)
+        finally:
+            rio_shutil.delete(self.lulc_raster_filepath)
+
+    def _write_lulc_raster(self, lulc_arr):
+        with rio.open(self.lulc_raster_filepath, 'w', **self.rio_meta) as dst:
+            dst.write(lulc_arr, 1)
+
+    def predict_t_arr(self, lulc_arr):
+        self._write_lulc_raster(lulc_arr)
+        try:
+            # start from an empty workspace (as with a new wrapper) so that
+            # InVEST's task graph never reuses the results of the previous
+            # LULC array
+            shutil.rmtree(path.join(self.workspace_dir, '0'),
+                          ignore_errors=True)
+            return self.ucm_wrapper.predict_t_arr(
+                0, ucm_args={'lulc_raster_path': self.lulc_raster_filepath})
+        finally:
+            rio_shutil.delete(self.lulc_raster_filepath)
+
+    def predict_t_arrs(self, lulc_arrs):
+        return np.array(
+            [self.predict_t_arr(lulc_arr) for lulc_arr in lulc_arrs])
+
+
+def _get_exponential_kernel(expected_distance):
+    # as in `natcap.invest.utils.exponential_decay_kernel_raster`, i.e.,
+    # normalized so that it sums to one
+    max_distance = expected_distance * 5
+    kernel_size = int(np.round(max_distance * 2 + 1))
+    kernel_dists = np.hypot(*(np.indices((kernel_size, kernel_size)) -
+                              max_distance))
+    kernel = np.where(kernel_dists > max_distance, 0,
+                      np.exp(-kernel_dists / expected_distance))
+    return kernel / kernel.sum()
+
+
+def _get_disk_kernel(max_distance):
+    # as in `natcap.invest.urban_cooling_model.flat_disk_kernel`
+    kernel_size = int(np.round(max_distance * 2 + 1))
+    kernel_dists = np.hypot(*(np.indices((kernel_size, kernel_size)) -
+                              max_distance))
+    return (kernel_dists < max_distance).astype(np.float64)
+
+
+class _FFTConvolver:
+    # convolve stacks of arrays of a given shape with a fixed kernel (with
+    # zero padding and the output cropped to the shape of the arrays, i.e.,
+    # as `scipy.signal.fftconvolve` with `mode='same'`), transforming the
+    # kernel only once
+    def __init__(self, shape, kernel):
+        self.shape = shape
+        self.kernel = kernel
+        self.kernel_sum = kernel.sum()
+        self.radius = max(kernel.shape) // 2
+        self.fft_shape = tuple(
+            fft.next_fast_len(size + kernel_size - 1, real=True)
+            for size, kernel_size in zip(shape, kernel.shape))
+        self.kernel_fft = fft.rfft2(kernel, self.fft_shape)
+        self.offsets = tuple(kernel_size // 2 for kernel_size in kernel.shape)
+
+    def __call__(self, arrs):
+        # transform in double precision (as `numpy.fft` in pygeoprocessing)
+        arrs_fft = fft.rfft2(arrs.astype(np.float64), self.fft_shape)
+        conv_arrs = fft.irfft2(arrs_fft * self.kernel_fft, self.fft_shape)
+        (i, j), (height, width) = self.offsets, self.shape
+        return conv_arrs[..., i:i + height, j:j + width]
+
+    def convolve_window(self, arr):
+        # convolve an array of any shape (e.g., a window of the full arrays)
+        return signal.fftconvolve(arr.astype(np.float64),
+                                  self.kernel,
+                                  mode='same')
+
+    def convolve_mask(self, valid_arrs):
+        # the valid mask is convolved only once if it is the same for all the
+        # arrays (e.g., all the scenarios of a simulation)
+        if (valid_arrs == valid_arrs[:1]).all():
+            valid_arrs = valid_arrs[:1]
+        return self(valid_arrs.astype(np.float64))
+
+    def convolve_ignore_nodata(self, arrs, valid_arrs, mask_conv_arrs=None):
+        # as `pygeoprocessing.convolve_2d` with `ignore_nodata=True`, i.e.,
+        # the convolution of the valid pixels is normalized by the
+        # convolution of the valid mask (which can be provided if it has
+        # already been computed), and the invalid pixels are set to
+        # `UCM_T_NODATA`
+        conv_arrs = self(np.where(valid_arrs, arrs, 0))
+        if mask_conv_arrs is None:
+            mask_conv_arrs = self.convolve_mask(valid_arrs)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(valid_arrs,
+                            conv_arrs / mask_conv_arrs * self.kernel_sum,
+                            UCM_T_NODATA)
+
+
+class NativeUCMRunner:
+    # in-process (NumPy/SciPy) implementation of the InVEST urban cooling
+    # model as run by `UCMRunner` (i.e., InVEST 3.8), which simulates the air
+    # temperature of a stack of LULC arrays at once. The cooling capacity of
+    # the parks and the air mixing are computed, as in InVEST, as
+    # convolutions with exponential decay kernels (with the nodata pixels
+    # ignored), which are done in the frequency domain with the transforms
+    # of the kernels computed only once. The intermediate arrays have the
+    # data types and nodata values of the intermediate rasters of InVEST
+    def __init__(self,
+                 rio_meta,
+                 biophysical_table_filepath,
+                 ref_et_raster_filepath,
+                 t_ref,
+                 uhi_max,
+                 ucm_params,
+                 cc_method='factors'):
+        self.lulc_nodata = rio_meta['nodata']
+        shape = (rio_meta['height'], rio_meta['width'])
+        # InVEST ensures square pixels by picking the smallest dimension
+        lulc_transform = rio_meta['transform']
+        cell_size = min(abs(lulc_transform.a), abs(lulc_transform.e))
+
+        ucm_params = {**iuc.settings.DEFAULT_UCM_PARAMS, **ucm_params}
+        # as in `UCMWrapper`, a single reference temperature and UHI magnitude
+        # (i.e., of the first date) are used
+        self.t_ref = float(np.ravel(t_ref)[0])
+        self.uhi_max = float(np.ravel(uhi_max)[0])
+        self.cc_method = cc_method
+        cc_weights = np.array([
+            float(ucm_params[f'cc_weight_{factor}'])
+            for factor in ['shade', 'albedo', 'eti']
+        ])
+        self.cc_weights = cc_weights / cc_weights.sum()
+
+        # lookup of the biophysical properties of each LULC code
+        biophysical_df = pd.read_csv(biophysical_table_filepath).rename(
+            columns=str.lower).sort_values('lucode')
+        self.lucodes = biophysical_df['lucode'].values
+        self.biophysical_df = biophysical_df
+
+        if cc_method == 'factors':
+            # align the reference evapotranspiration to the LULC grid
+            with rio.open(ref_et_raster_filepath) as src:
+                ref_et_nodata = src.nodata
+                if ref_et_nodata is None:
+                    ref_et_nodata = np.nan
+                ref_et_arr = np.full(shape, ref_et_nodata, dtype=src.dtypes[0])
+                warp.reproject(rio.band(src, 1),
+                               ref_et_arr,
+                               dst_transform=lulc_transform,
+                               dst_crs=rio_meta['crs'],
+                               dst_nodata=ref_et_nodata,
+                               resampling=warp.Resampling.cubic_spline)
+            ref_et_valid_arr = ~np.isclose(ref_et_arr, ref_et_nodata)
+            self.ref_et_arr = ref_et_arr
+            self.ref_et_valid_arr = ref_et_valid_arr
+            ref_et_max = np.nanmax(ref_et_arr[ref_et_valid_arr])
+            self.ref_et_max = np.round(float(ref_et_max), decimals=9)
+
+        green_area_kernel_dist = int(
+            np.round(
+                float(ucm_params['green_area_cooling_distance']) / cell_size))
+        self.green_area_convolver = _FFTConvolver(
+            shape, _get_exponential_kernel(green_area_kernel_dist))
+        self.green_area_sum_convolver = _FFTConvolver(
+            shape, _get_disk_kernel(green_area_kernel_dist))
+        # 2 hectares in number of pixels
+        self.green_area_threshold = 2e4 / cell_size**2
+        t_air_kernel_dist = int(
+            np.round(float(ucm_params['t_air_average_radius']) / cell_size))
+        self.t_air_convolver = _FFTConvolver(
+            shape, _get_exponential_kernel(t_air_kernel_dist))
+        self._base_state = None
+
+    def _reclassify(self, lulc_arrs, prop):
+        # map the LULC codes to the values of the `prop` column of the
+        # biophysical table, with the nodata pixels set to `UCM_NODATA`
+        lucode_idx = np.searchsorted(self.lucodes,
+                                     lulc_arrs).clip(max=len(self.lucodes) - 1)
+        nodata_arrs = lulc_arrs == self.lulc_nodata
+        if not (self.lucodes[lucode_idx] == lulc_arrs)[~nodata_arrs].all():
+            raise ValueError(
+                "The LULC arrays have codes that are not in the biophysical "
+                "table")
+        prop_arrs = self.biophysical_df[prop].values.astype(
+            np.float32)[lucode_idx]
+        prop_arrs[nodata_arrs] = UCM_NODATA
+        return prop_arrs
+
+    def _compute_cc_arrs(self, lulc_arrs, window=np.s_[:, :]):
+        # cooling capacity of LULC arrays that correspond to `window` of the
+        # grid
+        if self.cc_method == 'factors':
+            kc_arrs = self._reclassify(lulc_arrs, 'kc')
+            # evapotranspiration index
+            ref_et_arr = self.ref_et_arr[window]
+            valid_arrs = (kc_arrs
+                          != UCM_NODATA) & self.ref_et_valid_arr[window]
+            eti_arrs = np.where(valid_arrs,
+                                kc_arrs * ref_et_arr / self.ref_et_max,
+                                UCM_NODATA).astype(np.float32)
+            shade_arrs = self._reclassify(lulc_arrs, 'shade')
+            albedo_arrs = self._reclassify(lulc_arrs, 'albedo')
+            valid_arrs = ((shade_arrs != UCM_NODATA) &
+                          (albedo_arrs != UCM_NODATA) &
+                          (eti_arrs != UCM_NODATA))
+            weight_shade, weight_albedo, weight_eti = self.cc_weights
+            cc_arrs = (weight_shade * shade_arrs +
+                       weight_albedo * albedo_arrs + weight_eti * eti_arrs)
+        else:
+            intensity_arrs = self._reclassify(lulc_arrs, 'building_intensity')
+            valid_arrs = intensity_arrs != UCM_NODATA
+            cc_arrs = 1 - intensity_arrs
+        return np.where(valid_arrs, cc_arrs, UCM_NODATA).astype(np.float32)
+
+    def _compute_t_air_nomix_arrs(self, cc_arrs, cc_park_arrs,
+                                  green_area_sum_arrs):
+        # heat mitigation index
+        valid_arrs = ~((cc_arrs == UCM_NODATA) & (cc_park_arrs == UCM_NODATA))
+        # the convolutions are rounded so that the comparisons do not depend
+        # on their floating point errors, e.g., the green area sum of pixels
+        # fully surrounded by valid pixels is an integer number of pixels
+        cc_mask_arrs = ((cc_arrs >= np.round(cc_park_arrs, UCM_DECIMALS)) |
+                        (np.round(green_area_sum_arrs, UCM_DECIMALS)
+                         < self.green_area_threshold))
+        hm_arrs = np.where(cc_mask_arrs, cc_arrs, cc_park_arrs)
+        hm_arrs = np.where(valid_arrs, hm_arrs, UCM_NODATA).astype(np.float32)
+
+        # air temperature without air mixing
+        return np.where(hm_arrs != UCM_NODATA,
+                        self.t_ref + (1 - hm_arrs) * self.uhi_max,
+                        UCM_NODATA).astype(np.float32)
+
+    def _predict(self, lulc_arrs, mask_conv_arrs=None):
+        # returns the air temperature arrays and the intermediate arrays that
+        # are needed to update them incrementally (see `update_state`),
+        # i.e., the convolutions that are linear in the arrays of the
+        # individual pixels and the (normalizing) convolutions of the valid
+        # masks
+        lulc_arrs = np.asarray(lulc_arrs)
+        cc_arrs = self._compute_cc_arrs(lulc_arrs)
+
+        # cooling capacity of the parks and green area around each pixel
+        green_area_arrs = self._reclassify(lulc_arrs, 'green_area')
+        green_area_valid_arrs = green_area_arrs != UCM_NODATA
+        if mask_conv_arrs is None:
+            mask_conv_arrs = {
+                'green_area':
+                self.green_area_convolver.convolve_mask(green_area_valid_arrs),
+                'green_area_sum':
+                self.green_area_sum_convolver.convolve_mask(
+                    green_area_valid_arrs)
+            }
+        cc_park_arrs = self.green_area_convolver.convolve_ignore_nodata(
+            green_area_arrs, green_area_valid_arrs,
+            mask_conv_arrs['green_area'])
+        green_area_sum_arrs = (
+            self.green_area_sum_convolver.convolve_ignore_nodata(
+                green_area_arrs, green_area_valid_arrs,
+                mask_conv_arrs['green_area_sum']))
+
+        # air temperature without and with air mixing
+        t_air_nomix_arrs = self._compute_t_air_nomix_arrs(
+            cc_arrs, cc_park_arrs, green_area_sum_arrs)
+        t_air_nomix_valid_arrs = t_air_nomix_arrs != UCM_NODATA
+        if 't_air' not in mask_conv_arrs:
+            mask_conv_arrs['t_air'] = self.t_air_convolver.convolve_mask(
+                t_air_nomix_valid_arrs)
+        t_air_arrs = self.t_air_convolver.convolve_ignore_nodata(
+            t_air_nomix_arrs, t_air_nomix_valid_arrs, mask_conv_arrs['t_air'])
+        return dict(cc_park=cc_park_arrs,
+                    green_area_sum=green_area_sum_arrs,
+                    t_air_nomix=t_air_nomix_arrs,
+                    t_air=t_air_arrs,
+                    mask_conv=mask_conv_arrs)
+
+    def predict_t_arrs(self, lulc_arrs):
+        return self._predict(lulc_arrs)['t_air']
+
+    def predict_t_arr(self, lulc_arr):
+        return self.predict_t_arrs(lulc_arr[np.newaxis])[0]
+
+    def get_state(self, lulc_arr):
+        # full simulation of a LULC array, whose state can then be updated
+        # with `update_state`
+        state = {
+            key: arrs[0] if key != 'mask_conv' else arrs
+            for key, arrs in self._predict(lulc_arr[np.newaxis]).items()
+        }
+        state['lulc'] = lulc_arr
+        return state
+
+    def get_base_state(self, base_lulc_arr):
+        # state of the base of the incremental simulations (e.g., the
+        # scenario without changes), which is only simulated once
+        if self._base_state is None or not np.array_equal(
+                self._base_state['lulc'], base_lulc_arr):
+            self._base_state = self.get_state(base_lulc_arr)
+        return self._base_state
+
+    def _get_window(self, window, radius):
+        # dilate a window (tuple of row and column slices) by `radius`
+        # pixels, clipped to the grid
+        return tuple(
+            slice(max(_slice.start - radius, 0), min(_slice.stop +
+                                                     radius, size))
+            for _slice, size in zip(window, self.t_air_convolver.shape))
+
+    def update_state(self, state, lulc_arr):
+        # simulate a LULC array from the state of a simulated one (i.e., a
+        # base), only recomputing the windows that are affected by the
+        # changed pixels. Since the cooling capacity, the heat mitigation
+        # index and the air temperature without mixing are computed pixel by
+        # pixel, and the convolutions are linear (as long as the nodata
+        # pixels do not change), the arrays are patched with the convolutions
+        # of the differences with the base. The full simulation is performed
+        # if the nodata pixels change or if the changes are spread over a
+        # proportion of the grid greater than `INCREMENTAL_MAX_WINDOW_PROP`
+        base_lulc_arr = state['lulc']
+        change_arr = lulc_arr != base_lulc_arr
+        if not change_arr.any():
+            return dict(state, lulc=lulc_arr)
+        changed_rows = np.flatnonzero(change_arr.any(axis=1))
+        changed_cols = np.flatnonzero(change_arr.any(axis=0))
+        change_window = (slice(changed_rows[0], changed_rows[-1] + 1),
+                         slice(changed_cols[0], changed_cols[-1] + 1))
+        # window where the heat mitigation index might change, and window
+        # where the air temperature might change
+        hm_window = self._get_window(
+            change_window,
+            max(self.green_area_convolver.radius,
+                self.green_area_sum_convolver.radius))
+        t_air_window = self._get_window(hm_window, self.t_air_convolver.radius)
+        t_air_window_size = np.prod(
+            [_slice.stop - _slice.start for _slice in t_air_window])
+        nodata_arr = lulc_arr == self.lulc_nodata
+        if not np.array_equal(nodata_arr, base_lulc_arr == self.lulc_nodata):
+            return self.get_state(lulc_arr)
+        if t_air_window_size > INCREMENTAL_MAX_WINDOW_PROP * lulc_arr.size:
+            return self.get_state(lulc_arr)
+
+        def patch(arr, convolver, diff_arr, window, mask_conv_arr):
+            # add the convolution of `diff_arr` (which is zero outside
+            # `window`) to the valid pixels of `arr` within `window`
+            arr = arr.copy()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                diff_conv_arr = (convolver.convolve_window(diff_arr) /
+                                 mask_conv_arr[window] * convolver.kernel_sum)
+            valid_arr = ~nodata_arr[window]
+            arr[window][valid_arr] += diff_conv_arr[valid_arr]
+            return arr
+
+        # cooling capacity of the parks and green area around each pixel
+        hm_lulc_arr = lulc_arr[hm_window][np.newaxis]
+        green_area_arr = self._reclassify(hm_lulc_arr, 'green_area')[0]
+        base_green_area_arr = self._reclassify(
+            base_lulc_arr[hm_window][np.newaxis], 'green_area')[0]
+        green_area_diff_arr = np.where(nodata_arr[hm_window], 0,
+                                       green_area_arr - base_green_area_arr)
+        mask_conv = state['mask_conv']
+        cc_park_arr = patch(state['cc_park'], self.green_area_convolver,
+                            green_area_diff_arr, hm_window,
+                            mask_conv['green_area'][0])
+        green_area_sum_arr = patch(state['green_area_sum'],
+                                   self.green_area_sum_convolver,
+                                   green_area_diff_arr, hm_window,
+                                   mask_conv['green_area_sum'][0])
+
+        # air temperature without and with air mixing
+        t_air_nomix_arr = state['t_air_nomix'].copy()
+        t_air_nomix_arr[hm_window] = self._compute_t_air_nomix_arrs(
+            self._compute_cc_arrs(hm_lulc_arr, hm_window),
+            cc_park_arr[hm_window][np.newaxis],
+            green_area_sum_arr[hm_window][np.newaxis])[0]
+        # the differences are within `hm_window`, which is placed within the
+        # (larger) `t_air_window`
+        t_air_nomix_diff_arr = np.zeros(
+            [_slice.stop - _slice.start for _slice in t_air_window])
+        hm_subwindow = tuple(
+            slice(hm_slice.start - t_air_slice.start, hm_slice.stop -
+                  t_air_slice.start)
+            for hm_slice, t_air_slice in zip(hm_window, t_air_window))
+        t_air_nomix_diff_arr[hm_subwindow] = np.where(
+            nodata_arr[hm_window], 0,
+            t_air_nomix_arr[hm_window].astype(np.float64) -
+            state['t_air_nomix'][hm_window])
+        t_air_arr = patch(state['t_air'], self.t_air_convolver,
+                          t_air_nomix_diff_arr, t_air_window,
+                          mask_conv['t_air'][0])
+        return dict(lulc=lulc_arr,
+                    cc_park=cc_park_arr,
+                    green_area_sum=green_area_sum_arr,
+                    t_air_nomix=t_air_nomix_arr,
+                    t_air=t_air_arr,
+                    mask_conv=mask_conv)
+
+
+# UCM runner classes of each simulation engine
+UCM_RUNNERS = {'invest': UCMRunner, 'native': NativeUCMRunner}
+
+# UCM runner of each process (or thread, since the runners cannot be shared
+# among threads), keyed by the simulation that it belongs to (see
+# `t_from_lulc_arrs`)
+_ucm_runners = threading.local()
+
+
+def _get_ucm_runner(runner_key, runner_args, engine):
+    # runner of this process, which is only initialized on the first task of
+    # each simulation
+    ucm_runner = getattr(_ucm_runners, runner_key, None)
+    if ucm_runner is None:
+        # drop the runners of previous simulations
+        _ucm_runners.__dict__.clear()
+        ucm_runner = UCM_RUNNERS[engine](*runner_args)
+        setattr(_ucm_runners, runner_key, ucm_runner)
+    return ucm_runner
+
+
+def t_from_lulc_arrs(lulc_arrs,
+                     runner_key,
+                     runner_args,
+                     ucm_cache=None,
+                     input_key=None,
+                     engine='invest'):
+    # serve the arrays from the cache if possible
+    t_arrs = [None] * len(lulc_arrs)
+    if ucm_cache is not None:
+        keys = [
+            ucm_cache.get_key(lulc_arr, input_key) for lulc_arr in lulc_arrs
+        ]
+        t_arrs = [ucm_cache.load(key) for key in keys]
+    simulate_idx = [i for i, t_arr in enumerate(t_arrs) if t_arr is None]
+    if not simulate_idx:
+        return t_arrs
+
+    ucm_runner = _get_ucm_runner(runner_key, runner_args, engine)
+    simulated_t_arrs = ucm_runner.predict_t_arrs(
+        np.array([lulc_arrs[i] for i in simulate_idx]))
+
+    for i, t_arr in zip(simulate_idx, simulated_t_arrs):
+        t_arrs[i] = t_arr
+        if ucm_cache is not None:
+            ucm_cache.save(keys[i], t_arr)
+    return t_arrs
+
+
+def t_from_lulc(lulc_arr, *args):
+    return t_from_lulc_arrs([lulc_arr], *args)[0]
+
+
+def t_from_lulc_chain(lulc_arrs,
+                      base_lulc_arr,
+                      runner_key,
+                      runner_args,
+                      ucm_cache=None,
+                      input_key=None):
+    # simulate the LULC arrays incrementally with the native engine (see
+    # `NativeUCMRunner.update_state`), each from the previous one and the
+    # first one from `base_lulc_arr` (or from scratch if it is None). The
+    # arrays are served from the cache if possible, and since the state of
+    # a cached array is not available, the chain is restarted with a full
+    # simulation after each cached array
+    t_arrs = [None] * len(lulc_arrs)
+    if ucm_cache is not None:
+        keys = [
+            ucm_cache.get_key(lulc_arr, input_key) for lulc_arr in lulc_arrs
+        ]
+        t_arrs = [ucm_cache.load(key) for key in keys]
+    simulate_idx = [i for i, t_arr in enumerate(t_arrs) if t_arr is None]
+    if not simulate_idx:
+        return t_arrs
+
+    ucm_runner = _get_ucm_runner(runner_key, runner_args, 'native')
+    state = None
+    prev_i = None
+    for i in simulate_idx:
+        if i == 0 and base_lulc_arr is not None:
+            state = ucm_runner.update_state(
+                ucm_runner.get_base_state(base_lulc_arr), lulc_arrs[i])
+        elif prev_i == i - 1:
+            state = ucm_runner.update_state(state, lulc_arrs[i])
+        else:
+            state = ucm_runner.get_state(lulc_arrs[i])
+        prev_i = i
+        t_arrs[i] = state['t_air']
+        if ucm_cache is not None:
+            ucm_cache.save(keys[i], t_arrs[i])
+    return t_arrs
+
+
+def simulate_batch(simulate_func, lulc_arrs, metrics_args, *args):
+    # run `simulate_func` (i.e., `t_from_lulc_arrs` or `t_from_lulc_chain`)
+    # and, unless `metrics_args` is None, compute the landscape metrics of
+    # the LULC arrays while they are at hand (see `compute_lulc_metrics`).
+    # Returns the temperature arrays and the metrics (or None)
+    t_arrs = simulate_func(lulc_arrs, *args)
+    if metrics_args is None:
+        return t_arrs, None
+    return t_arrs, compute_lulc_metrics(lulc_arrs, *metrics_args)
+
+
+def compute_tasks(tasks,
+                  backend='processes',
+                  num_workers=None,
+                  chunksize=None,
+                  scheduler_address=None):
+    # execute the (delayed) tasks, e.g., the simulations, with the selected
+    # backend and return their results
+    if backend == 'distributed':
+        # optional dependency, only needed for this backend
+        from dask import distributed
+
+        if scheduler_address is None:
+            # each worker is a single-threaded process (see `_ucm_runners`)
+            cluster = distributed.LocalCluster(n_workers=num_workers,
+                                               threads_per_worker=1)
+            client = distributed.Client(cluster)
+        else:
+            cluster = None
+            client = distributed.Client(scheduler_address)
+        try:
+            return dask.compute(*tasks, scheduler=client)
+        finally:
+            client.close()
+            if cluster is not None:
+                cluster.close()
+
+    if backend == 'serial':
+        compute_kws = dict(scheduler='synchronous')
+    elif backend == 'threads':
+        compute_kws = dict(scheduler='threads', num_workers=num_workers)
+    elif backend == 'processes':
+        compute_kws = dict(scheduler='processes',
+                           num_workers=num_workers,
+                           chunksize=chunksize)
+    else:
+        raise ValueError(f"Unknown backend: {backend}")
+    with diagnostics.ProgressBar():
+        return dask.compute(*tasks, **compute_kws)
+
+
+class _MemmapArrayRef:
+    # reference to the array at `idx` of a memory-mapped array, which is
+    # pickled as the location of the file (rather than the data) so that the
+    # worker processes can read and write it in place
+    def __init__(self, memmap_arr, idx):
+        self.filename = memmap_arr.filename
+        self.offset = memmap_arr.offset
+        self.shape = memmap_arr.shape
+        self.dtype = memmap_arr.dtype
+        self.idx = idx
+
+    def open(self, mode='r'):
+        return np.memmap(self.filename,
+                         dtype=self.dtype,
+                         mode=mode,
+                         offset=self.offset,
+                         shape=self.shape)[self.idx]
+
+
+def _open_memmap_ref(arg):
+    if isinstance(arg, _MemmapArrayRef):
+        return arg.open()
+    return arg
+
+
+def _simulate_to_memmap(simulate_func, lulc_arrs, t_arr_refs, metrics_args,
+                        *args):
+    # run `simulate_batch` with the arrays given as `_MemmapArrayRef` read
+    # from their files, and write the temperature arrays in place. Only the
+    # landscape metrics (if any) are returned
+    lulc_arrs = [_open_memmap_ref(lulc_arr) for lulc_arr in lulc_arrs]
+    args = [_open_memmap_ref(arg) for arg in args]
+    t_arrs, metrics_arr = simulate_batch(simulate_func, lulc_arrs,
+                                         metrics_args, *args)
+    for t_arr_ref, t_arr in zip(t_arr_refs, t_arrs):
+        dst_arr = t_arr_ref.open('r+')
+        dst_arr[:] = t_arr
+        dst_arr.flush()
+    return metrics_arr
+
+
+def simulate_memmap(scenario_lulc_arrs, scenario_T_arrs, batches,
+                    simulate_func, simulate_args, metrics_args, dst_t_dtype,
+                    compute_kws):
+    # simulate the scenarios of `batches` exchanging the arrays with the
+    # workers through temporary memory-mapped files (see `_MemmapArrayRef`),
+    # which are removed once the simulations are done. The LULC arrays that
+    # are lazy (i.e., dask-backed) are still generated within the workers.
+    # Returns the temperature arrays and the landscape metrics of each batch
+    # (see `simulate_batch`)
+    if not batches:
+        return scenario_T_arrs, []
+    tmp_filepaths = []
+
+    def create_memmap(shape, dtype):
+        fd, tmp_filepath = tempfile.mkstemp(suffix='.dat')
+        os.close(fd)
+        tmp_filepaths.append(tmp_filepath)
+        return np.memmap(tmp_filepath, dtype=dtype, mode='w+', shape=shape)
+
+    try:
+        # the temperature arrays are written as `dst_t_dtype`, i.e., the
+        # workers never send back the (larger) simulated arrays
+        num_scenarios = len(scenario_lulc_arrs)
+        shape = scenario_lulc_arrs[0].shape
+        t_memmap_arr = create_memmap((num_scenarios, *shape), dst_t_dtype)
+        # the eager LULC arrays (and the base LULC array of the incremental
+        # simulations, if any, in the last position) are written once
+        simulate_idx = [i for batch in batches for i in batch]
+        lulc_arrs = list(scenario_lulc_arrs)
+        simulate_args = list(simulate_args)
+        eager_idx = [
+            i for i in simulate_idx
+            if isinstance(scenario_lulc_arrs[i], np.ndarray)
+        ]
+        base_lulc_arr = None
+        if simulate_func is t_from_lulc_chain:
+            # first argument of `t_from_lulc_chain`
+            base_lulc_arr = simulate_args[0]
+        if eager_idx or base_lulc_arr is not None:
+            lulc_memmap_arr = create_memmap((num_scenarios + 1, *shape),
+                                            scenario_lulc_arrs[0].dtype)
+            for i in eager_idx:
+                lulc_memmap_arr[i] = lulc_arrs[i]
+                lulc_arrs[i] = _MemmapArrayRef(lulc_memmap_arr, i)
+            if base_lulc_arr is not None:
+                lulc_memmap_arr[num_scenarios] = base_lulc_arr
+                simulate_args[0] = _MemmapArrayRef(lulc_memmap_arr,
+                                                   num_scenarios)
+            lulc_memmap_arr.flush()
+        tasks = [
+            dask.delayed(_simulate_to_memmap)(
+                simulate_func, [lulc_arrs[i] for i in batch],
+                [_MemmapArrayRef(t_memmap_arr, i)
+                 for i in batch], metrics_args, *simulate_args)
+            for batch in batches
+        ]
+        batch_metrics_arrs = compute_tasks(tasks, **compute_kws)
+        scenario_T_arrs = list(scenario_T_arrs)
+        for i in simulate_idx:
+            scenario_T_arrs[i] = t_memmap_arr[i]
+        return scenario_T_arrs, batch_metrics_arrs
+    finally:
+        # the memory maps remain valid after the files are unlinked (on POSIX
+        # systems), so we do not leave the files behind
+        for tmp_filepath in tmp_filepaths:
+            os.remove(tmp_filepath)
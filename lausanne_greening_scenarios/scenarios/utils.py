@@ -1,16 +1,30 @@
+import collections
+import os
 import tempfile
+import uuid
+import zlib
+from concurrent import futures
 from os import path
 
 import dask
-import invest_ucm_calibration as iuc
+import dask.array as da
 import numpy as np
 import pandas as pd
 import rasterio as rio
 import xarray as xr
-from dask import diagnostics
-from rasterio import transform
+from rasterio import transform, windows
 from scipy import ndimage as ndi
 
+# the scripts use the metrics, runners and backends through this module
+from lausanne_greening_scenarios.scenarios.metrics import (  # noqa: F401
+    HIGH_TREE_CLASS_VAL, NATIVE_LANDSCAPE_METRICS, NATIVE_METRICS_BATCH_SIZE,
+    compute_incremental_landscape_metrics, compute_landscape_metrics,
+    compute_lulc_metrics, get_landscape_arr, get_landscape_lut)
+from lausanne_greening_scenarios.scenarios.ucm import (  # noqa: F401
+    NATIVE_UCM_BATCH_SIZE, UCMResultCache, compute_tasks, get_ucm_input_key,
+    simulate_batch, simulate_memmap, t_from_lulc, t_from_lulc_arrs,
+    t_from_lulc_chain)
+
 ORIG_LULC_CODES = [
     0,  # building
     1,  # road
@@ -20,8 +34,202 @@ ORIG_LULC_CODES = [
     11,  # garden
 ]
 ROAD_CODE = 1
-
 KERNEL_MOORE = ndi.generate_binary_structure(2, 2)
+# maximum number of shade thresholds for which the pixel rankings are kept
+RANKING_CACHE_SIZE = 4
+# maximum number of scenario arrays kept by `ScenarioReader`
+SCENARIO_CACHE_SIZE = 4
+# proportion of the changeable pixels that are converted at each step of the
+# dynamic interactions (see `ScenarioGenerator._generate_dynamic_order`)
+DYNAMIC_BATCH_PROP = 0.001
+# interactions where the neighbourhood counts are updated as pixels are
+# converted
+DYNAMIC_INTERACTIONS = ['cluster_dynamic', 'scatter_dynamic']
+# size (in pixels) of the square tiles of `TiledScenarioGenerator`
+TILE_SIZE = 1024
+# fill value of the temperatures packed as 16-bit integers (see
+# `get_scenario_encoding`)
+PACKED_T_FILL_VALUE = np.iinfo(np.int16).min
+
+
+def _select_pixels(scores, num_to_select, rng):
+    # select the `num_to_select` positions of `scores` with the lowest values
+    # in linear time, breaking the ties at the threshold score at random
+    if num_to_select == 0:
+        return np.array([], dtype=np.intp)
+    partition_idx = np.argpartition(scores, num_to_select - 1)
+    threshold_score = scores[partition_idx[num_to_select - 1]]
+    # all the positions with a score lower than the threshold are within the
+    # first `num_to_select` positions of the partition
+    select_pos = partition_idx[:num_to_select]
+    select_pos = select_pos[scores[select_pos] < threshold_score]
+    return np.concatenate([
+        select_pos,
+        rng.choice(np.flatnonzero(scores == threshold_score),
+                   num_to_select - len(select_pos),
+                   replace=False)
+    ])
+
+
+def _get_next_code_dict(biophysical_df, orig_lulc_col, lulc_col):
+    # map each changeable LULC code to the equivalent code with greater tree
+    # cover
+    next_code_dict = {}
+    for orig_lulc_code in ORIG_LULC_CODES:
+        shade_gb = biophysical_df[biophysical_df[orig_lulc_col] ==
+                                  orig_lulc_code].groupby('shade')
+        if len(shade_gb) == 1:
+            pass
+        else:
+            for i in range(len(shade_gb)):
+                # select lucodes that have the same base `lulc_code` and
+                # `building_intensity`
+                eligible_lucode_df = shade_gb.nth(i)
+                # filter the above data frame to enforce that the
+                # proportion tree canopy cover plus the proportion of
+                # building cover is not more than 1 (i.e., 100% of the
+                # pixel)
+                eligible_lucode_df = eligible_lucode_df[
+                    eligible_lucode_df.index +
+                    eligible_lucode_df['building_intensity'] <= 1]
+                # select the next lucode as the lucode with maximum
+                # possible tree canopy cover
+                next_lucode = eligible_lucode_df.iloc[-1][lulc_col]
+                for lucode in eligible_lucode_df.iloc[:-1][lulc_col]:
+                    next_code_dict[lucode] = next_lucode
+
+    return next_code_dict
+
+
+def _pop_bucket(bucket, num_to_pop, is_valid):
+    # pop up to `num_to_pop` valid positions from the front of a bucket (a
+    # deque of position arrays), pushing back the ones that are not needed
+    popped = []
+    num_popped = 0
+    while bucket and num_popped < num_to_pop:
+        pos = bucket.popleft()
+        pos = pos[is_valid(pos)]
+        if num_popped + len(pos) > num_to_pop:
+            bucket.appendleft(pos[num_to_pop - num_popped:])
+            pos = pos[:num_to_pop - num_popped]
+        popped.append(pos)
+        num_popped += len(pos)
+    if popped:
+        return np.concatenate(popped)
+    else:
+        return np.array([], dtype=np.intp)
+
+
+def _get_inner_slice(change_props):
+    # bounds of the change proportions other than the endpoints (0 and 1),
+    # which are the same for all the scenario runs and interactions
+    start, stop = 0, len(change_props)
+    if change_props[0] == 0:
+        start += 1
+    if change_props[-1] == 1:
+        stop -= 1
+    return start, stop
+
+
+def _broadcast_endpoints(inner_arr, start_arr=None, end_arr=None):
+    # stack the scenario arrays of the change proportions other than the
+    # endpoints, i.e., `inner_arr` of shape (interactions, change props,
+    # scenario runs, height, width), between the arrays of the endpoints
+    # (change proportions of 0 and 1), which are the same for all the
+    # interactions and scenario runs and are therefore broadcast rather than
+    # repeated, i.e., each endpoint array is stored only once. Returns a dask
+    # array with one chunk per scenario (or `inner_arr` if there are no
+    # endpoints)
+    if start_arr is None and end_arr is None:
+        return inner_arr
+    num_interactions, _, num_scenario_runs, *shape = inner_arr.shape
+    chunks = (1, 1, 1, *shape)
+
+    def broadcast(endpoint_arr):
+        return da.broadcast_to(
+            da.asarray(endpoint_arr).rechunk(shape),
+            (num_interactions, 1, num_scenario_runs, *shape),
+            chunks=chunks)
+
+    arrs = []
+    if start_arr is not None:
+        arrs.append(broadcast(start_arr))
+    if inner_arr.shape[1] > 0:
+        if isinstance(inner_arr, da.Array):
+            arrs.append(inner_arr.rechunk(chunks))
+        else:
+            arrs.append(da.from_array(inner_arr, chunks=chunks))
+    if end_arr is not None:
+        arrs.append(broadcast(end_arr))
+    return da.concatenate(arrs, axis=1)
+
+
+# state of the scenario generation worker processes (see
+# `ScenarioGenerator._generate_scenario_lulc_arr`)
+_generation_worker_state = {}
+
+
+def _init_generation_worker(sg, filename, offset, shape, dtype,
+                            shade_threshold, change_props):
+    scenario_lulc_arr = np.memmap(filename,
+                                  dtype=dtype,
+                                  mode='r+',
+                                  offset=offset,
+                                  shape=shape)
+    _generation_worker_state.update(sg=sg,
+                                    scenario_lulc_arr=scenario_lulc_arr,
+                                    shade_threshold=shade_threshold,
+                                    change_props=change_props)
+
+
+def _generate_scenario_task(task):
+    state = _generation_worker_state
+    state['sg']._generate_scenario(state['scenario_lulc_arr'], task,
+                                   state['shade_threshold'],
+                                   state['change_props'])
+    # flush so that the parent process sees the written pages
+    state['scenario_lulc_arr'].flush()
+
+
+# scenario generator of each process, keyed by the generator that it
+# replicates (see `ScenarioGenerator._generate_lazy_scenario_lulc_arr`)
+_scenario_generators = {}
+
+
+def _get_scenario_generator(generator_key, generator_kws):
+    # generator of this process, which is only initialized (from the same
+    # arguments as the generator that it replicates) on the first lazy
+    # scenario that the process computes
+    sg = _scenario_generators.get(generator_key)
+    if sg is None:
+        # drop the generators of previous scenario arrays
+        _scenario_generators.clear()
+        sg = ScenarioGenerator(**generator_kws)
+        _scenario_generators[generator_key] = sg
+    return sg
+
+
+def _generate_lazy_scenario(generator_key, generator_kws, shade_threshold,
+                            interaction, change_prop, scenario_run, nested):
+    # generate the LULC array of a scenario of a lazy scenario array, whose
+    # seed sequence is derived from the scenario labels (see `get_seed_seq`)
+    sg = _get_scenario_generator(generator_key, generator_kws)
+    if change_prop == 1:
+        return sg.generate_lulc_arr(shade_threshold, 1)
+    elif nested:
+        return sg._generate_nested_lulc_arr(shade_threshold,
+                                            change_prop,
+                                            interaction=interaction,
+                                            rng=sg.get_seed_seq(
+                                                interaction, scenario_run))
+    else:
+        return sg.generate_lulc_arr(shade_threshold,
+                                    change_prop,
+                                    interaction=interaction,
+                                    rng=sg.get_seed_seq(
+                                        interaction,
+                                        scenario_run,
+                                        change_prop=change_prop))
 
 
 class ScenarioGenerator:
@@ -29,7 +237,10 @@ class ScenarioGenerator:
                  agglom_lulc_filepath,
                  biophysical_table_filepath,
                  orig_lulc_col='orig_lucode',
-                 lulc_col='lucode'):
+                 lulc_col='lucode',
+                 ranking_cache_size=None,
+                 dynamic_batch_size=None,
+                 seed=None):
         # read the LULC raster
         with rio.open(agglom_lulc_filepath) as src:
             lulc_arr = src.read(1)
@@ -49,42 +260,28 @@ class ScenarioGenerator:
         # increase the tree cover by changing the land cover code of
         # roads/paths, sidewalks, blocks and other impervious surfaces to the
         # equivalent code with greater tree cover
-        next_code_dict = {}
-        for orig_lulc_code in ORIG_LULC_CODES:
-            shade_gb = biophysical_df[biophysical_df[orig_lulc_col] ==
-                                      orig_lulc_code].groupby('shade')
-            if len(shade_gb) == 1:
-                pass
-            else:
-                for i in range(len(shade_gb)):
-                    # select lucodes that have the same base `lulc_code` and
-                    # `building_intensity`
-                    eligible_lucode_df = shade_gb.nth(i)
-                    # filter the above data frame to enforce that the
-                    # proportion tree canopy cover plus the proportion of
-                    # building cover is not more than 1 (i.e., 100% of the
-                    # pixel)
-                    eligible_lucode_df = eligible_lucode_df[
-                        eligible_lucode_df.index +
-                        eligible_lucode_df['building_intensity'] <= 1]
-                    # select the next lucode as the lucode with maximum
-                    # possible tree canopy cover
-                    next_lucode = eligible_lucode_df.iloc[-1][lulc_col]
-                    for lucode in eligible_lucode_df.iloc[:-1][lulc_col]:
-                        next_code_dict[lucode] = next_lucode
-
-        # generate a dataframe of
-        change_df = pd.DataFrame(index=np.flatnonzero(lulc_arr))
-        # get list of pixels that can be changed and their next code
-        for lucode in next_code_dict:
-            change_df.loc[np.flatnonzero(lulc_arr == lucode),
-                          'next_code'] = next_code_dict[lucode]
-        # drop nan values
-        change_df = change_df.dropna()
-        # exclude the inner road pixels
-        change_df = change_df.drop(np.flatnonzero(inner_road_mask),
-                                   errors='ignore')
-        change_df['next_code'] = change_df['next_code'].astype(np.int32)
+        next_code_dict = _get_next_code_dict(biophysical_df, orig_lulc_col,
+                                             lulc_col)
+
+        # build a dense look-up table that maps each LULC code to its next code
+        # (or -1 if the pixels of such code cannot be changed)
+        next_code_lut = np.full(
+            max(int(lulc_arr.max()), int(biophysical_df[lulc_col].max())) + 1,
+            -1,
+            dtype=np.int32)
+        next_code_lut[list(next_code_dict)] = list(next_code_dict.values())
+        # zero-valued pixels are never changed
+        next_code_lut[0] = -1
+
+        # get the flat indices of the pixels that can be changed and their
+        # next code in a single pass over the raster, excluding the inner road
+        # pixels
+        next_code_arr = next_code_lut[lulc_arr.ravel()]
+        next_code_arr[inner_road_mask.ravel()] = -1
+        change_idx = np.flatnonzero(next_code_arr >= 0)
+        change_next_code = next_code_arr[change_idx].astype(lulc_arr.dtype)
+        if lulc_arr.size <= np.iinfo(np.int32).max:
+            change_idx = change_idx.astype(np.int32)
 
         # prepare grid metadata for xarray
         rows = np.arange(lulc_meta['height'])
@@ -94,121 +291,1384 @@ class ScenarioGenerator:
         _, ys = transform.xy(lulc_transform, rows, rows)
         coords = {'y': ys, 'x': xs}
 
-        # save the LULC raster, biophysical table and the change data frame as
+        # save the LULC raster, biophysical table and the change arrays as
         # attributes so that they can be used in the methods below
         self.lulc_arr = lulc_arr
         self.lulc_meta = lulc_meta
         self.lulc_bounds = lulc_bounds
         self.biophysical_df = biophysical_df
         self.lulc_col = lulc_col
-        # use this in `generate_lulc_arr`
-        # self.change_df_idx = np.flatnonzero(self.lulc_arr)
-        self.change_df = change_df
+        self.next_code_lut = next_code_lut
+        self.change_idx = change_idx
+        self.change_next_code = change_next_code
         self.coords = coords
 
-    def generate_lulc_arr(self,
-                          shade_threshold,
-                          change_prop,
-                          interaction='random'):
+        # the neighbourhood rankings of the changeable pixels only depend on
+        # the shade threshold, so we cache them (see `_get_ranking`)
+        if ranking_cache_size is None:
+            ranking_cache_size = RANKING_CACHE_SIZE
+        self.ranking_cache_size = ranking_cache_size
+        self._ranking_cache = collections.OrderedDict()
+
+        # number of pixels converted at each step of the dynamic interactions
+        # (see `_generate_dynamic_order`). Note that it does not depend on
+        # the change proportion so that the orderings are nested
+        if dynamic_batch_size is None:
+            dynamic_batch_size = max(int(len(change_idx) * DYNAMIC_BATCH_PROP),
+                                     1)
+        self.dynamic_batch_size = dynamic_batch_size
+        # full-raster map from pixels to positions of `change_idx`, only
+        # built when a dynamic interaction is used
+        self._padded_change_pos = None
+
+        # root of the random streams of the scenarios (see `get_rng`). If no
+        # seed is provided, fresh entropy is drawn from the OS and kept in
+        # `seed` so that the scenarios can still be reproduced afterwards
+        self.seed_seq = np.random.SeedSequence(seed)
+        self.seed = self.seed_seq.entropy
+
+        # arguments to replicate the generator in other processes (see
+        # `_get_scenario_generator`), where it is identified by a unique key
+        self._init_kws = dict(
+            agglom_lulc_filepath=agglom_lulc_filepath,
+            biophysical_table_filepath=biophysical_table_filepath,
+            orig_lulc_col=orig_lulc_col,
+            lulc_col=lulc_col,
+            ranking_cache_size=ranking_cache_size,
+            dynamic_batch_size=dynamic_batch_size,
+            seed=self.seed)
+        self._key = uuid.uuid4().hex
+
+    def _get_ranking(self, shade_threshold):
+        try:
+            ranking = self._ranking_cache[shade_threshold]
+            # mark it as the most recently used
+            self._ranking_cache.move_to_end(shade_threshold)
+        except KeyError:
+            # count the high tree cover pixels in the Moore neighbourhood of
+            # each changeable pixel (the counts range from 0 to 9, so they
+            # fit in `int8`)
+            high_shade_arr = np.isin(
+                self.lulc_arr,
+                self._get_high_shade_codes(shade_threshold)).astype(np.int8)
+            ranking = ndi.convolve(high_shade_arr,
+                                   KERNEL_MOORE).ravel()[self.change_idx]
+            self._ranking_cache[shade_threshold] = ranking
+            # evict the least recently used rankings
+            while len(self._ranking_cache) > self.ranking_cache_size:
+                self._ranking_cache.popitem(last=False)
+
+        return ranking
+
+    def get_seed_seq(self, interaction, scenario_run, change_prop=None):
+        # derive the seed sequence of a scenario from the root seed and the
+        # scenario labels (rather than by spawning children sequentially), so
+        # that the random stream of each scenario is independent of the
+        # others and does not depend on the order in which the scenarios are
+        # generated (e.g., in parallel workers) nor on which other scenarios
+        # are generated. In the nested mode, all the change proportions of a
+        # scenario run share the same stream, so `change_prop` is omitted
+        spawn_key = [zlib.crc32(interaction.encode()), int(scenario_run)]
+        if change_prop is not None:
+            # use the bits of the float so that the key is exact
+            spawn_key.append(int(np.float64(change_prop).view(np.uint64)))
+        return np.random.SeedSequence(self.seed_seq.entropy,
+                                      spawn_key=spawn_key)
+
+    def get_rng(self, interaction, scenario_run, change_prop=None):
+        # random number generator of a scenario (see `get_seed_seq`)
+        return np.random.default_rng(
+            self.get_seed_seq(interaction,
+                              scenario_run,
+                              change_prop=change_prop))
+
+    def _get_high_shade_codes(self, shade_threshold):
+        return self.biophysical_df[self.biophysical_df['shade'] >=
+                                   shade_threshold][self.lulc_col]
+
+    def _get_padded_change_pos(self):
+        # map each pixel of the raster padded by one pixel (so that the
+        # neighbours of the pixels at the border do not wrap around) to its
+        # position in `change_idx` (-1 for pixels that cannot be changed).
+        # Return it (flattened) together with the flat indices of the
+        # changeable pixels in the padded raster and the flat offsets of their
+        # Moore neighbours
+        if self._padded_change_pos is None:
+            height, width = self.lulc_arr.shape
+            change_pos = np.full(height * width, -1, dtype=np.int64)
+            change_pos[self.change_idx] = np.arange(len(self.change_idx))
+            padded_change_pos = np.pad(change_pos.reshape(height, width),
+                                       1,
+                                       constant_values=-1).ravel()
+            rows, cols = np.divmod(self.change_idx, width)
+            change_padded_idx = (rows + 1) * (width + 2) + cols + 1
+            offsets = np.array([
+                i * (width + 2) + j for i in (-1, 0, 1) for j in (-1, 0, 1)
+                if i != 0 or j != 0
+            ])
+            self._padded_change_pos = (padded_change_pos, change_padded_idx,
+                                       offsets)
+
+        return self._padded_change_pos
+
+    def _generate_dynamic_order(self, shade_threshold, num_to_change,
+                                interaction, rng):
+        # greedy allocation where the neighbourhood counts are updated as the
+        # pixels are converted, so that the pixels converted in the same
+        # scenario influence each other. At each step, a batch of pixels is
+        # taken from the bucket with the highest (cluster) or lowest
+        # (scatter) count, and the counts are only updated around the
+        # converted pixels. The buckets are queues with lazy deletion, i.e.,
+        # a pixel whose count increases is appended to its new bucket and
+        # its stale entry is skipped when popped, so that the whole
+        # allocation is O(`num_to_change`) besides the initial bucketing
+        padded_change_pos, change_padded_idx, offsets = (
+            self._get_padded_change_pos())
+        high_shade_codes = self._get_high_shade_codes(shade_threshold)
+        # only the pixels that become high tree cover increase the counts of
+        # their neighbours
+        is_high = np.isin(self.lulc_arr.ravel()[self.change_idx],
+                          high_shade_codes)
+        becomes_high = np.isin(self.change_next_code,
+                               high_shade_codes) & ~is_high
+        scores = self._get_ranking(shade_threshold).copy()
+        changed = np.zeros(len(self.change_idx), dtype=bool)
+
+        # initial buckets (the counts range from 0 to 9), in random order so
+        # that the ties are broken at random
+        max_score = KERNEL_MOORE.sum()
+        init_order = rng.permutation(len(self.change_idx))
+        init_order = init_order[scores[init_order].argsort(kind='stable')]
+        bounds = np.searchsorted(scores[init_order], np.arange(max_score + 2))
+        buckets = [
+            collections.deque([init_order[bounds[score]:bounds[score + 1]]])
+            for score in range(max_score + 1)
+        ]
+        if interaction == 'cluster_dynamic':
+            bucket_scores = range(max_score, -1, -1)
+        else:
+            bucket_scores = range(max_score + 1)
+
+        change_order = np.empty(num_to_change, dtype=np.intp)
+        num_changed = 0
+        while num_changed < num_to_change:
+            num_to_pop = min(self.dynamic_batch_size,
+                             num_to_change - num_changed)
+            for score in bucket_scores:
+                batch = _pop_bucket(
+                    buckets[score], num_to_pop,
+                    lambda pos: ~changed[pos] & (scores[pos] == score))
+                if len(batch) > 0:
+                    break
+            change_order[num_changed:num_changed + len(batch)] = batch
+            num_changed += len(batch)
+            changed[batch] = True
+
+            # update the counts of the (unchanged) neighbours and append them
+            # to their new buckets
+            batch = batch[becomes_high[batch]]
+            neighbour_pos = padded_change_pos[(
+                change_padded_idx[batch][:, np.newaxis] + offsets).ravel()]
+            neighbour_pos = neighbour_pos[neighbour_pos >= 0]
+            neighbour_pos, counts = np.unique(
+                neighbour_pos[~changed[neighbour_pos]], return_counts=True)
+            if len(neighbour_pos) > 0:
+                scores[neighbour_pos] += counts.astype(scores.dtype)
+                rng.shuffle(neighbour_pos)
+                neighbour_scores = scores[neighbour_pos]
+                for score in np.unique(neighbour_scores):
+                    buckets[score].append(
+                        neighbour_pos[neighbour_scores == score])
+
+        return change_order
+
+    def _select_change_pos(self,
+                           shade_threshold,
+                           change_prop,
+                           interaction='random',
+                           rng=None):
+        # select the pixels to change as positions of the `change_idx` and
+        # `change_next_code` arrays
         if change_prop == 0:
-            return self.lulc_arr.copy()
+            change_pos = slice(0)
         elif change_prop == 1:
-            pixels_to_change_df = self.change_df
+            change_pos = slice(None)
         else:
             # how many pixels will be changed
-            num_to_change = int(len(self.change_df) * change_prop)
+            num_change = len(self.change_idx)
+            num_to_change = int(num_change * change_prop)
+            rng = np.random.default_rng(rng)
 
             if interaction == 'random':
                 # just change pixels randomly
-                pixels_to_change_df = self.change_df.sample(num_to_change)
+                change_pos = rng.choice(num_change,
+                                        num_to_change,
+                                        replace=False)
+            elif interaction in DYNAMIC_INTERACTIONS:
+                change_pos = self._generate_dynamic_order(
+                    shade_threshold, num_to_change, interaction, rng)
             else:
-                # convolution
-                conv_result = ndi.convolve(
-                    np.isin(
-                        self.lulc_arr, self.biophysical_df[
-                            self.biophysical_df['shade'] >= shade_threshold][
-                                self.lulc_col]).astype(np.int32),
-                    KERNEL_MOORE).flatten()[self.change_df.index]
+                # get the (cached) convolution
+                conv_result = self._get_ranking(shade_threshold)
 
                 # decide which pixels will be changed (depending on desired
-                # interaction between high tree cover pixels)
-                # by default, `argsort` sorts in ascending order, which in our
-                # case corresponds to prioritizing scattering the pixels
-                sorted_idx = conv_result.argsort()
-                if interaction == 'scatter':
-                    comparison_op = np.less
-                else:  # 'cluster'
-                    sorted_idx = sorted_idx[::-1]
-                    comparison_op = np.greater
-
-                conv_result_threshold = conv_result[sorted_idx[num_to_change -
-                                                               1]]
-                # print(interaction)
-                # print(conv_result_threshold)
-                pixels_to_change_df = self.change_df[comparison_op(
-                    conv_result, conv_result_threshold)]
-                # print(num_to_change, len(pixels_to_change_df))
-                pixels_to_change_df = pd.concat([
-                    pixels_to_change_df,
-                    self.change_df[conv_result == conv_result_threshold].
-                    sample(num_to_change - len(pixels_to_change_df))
-                ])
-
-        # now build the new LULC array and change the pixels
-        new_lulc_arr = self.lulc_arr.copy()
-        for next_code, next_code_df in pixels_to_change_df.groupby(
-                'next_code'):
-            new_lulc_arr.ravel()[next_code_df.index] = next_code
-
-        return new_lulc_arr
+                # interaction between high tree cover pixels): selecting the
+                # lowest convolution values corresponds to prioritizing
+                # scattering the pixels, so for clustering we just negate them
+                if interaction == 'cluster':
+                    conv_result = -conv_result
+                change_pos = _select_pixels(conv_result, num_to_change, rng)
 
-    def generate_scenario_lulc_da(self,
+        return change_pos
+
+    def generate_lulc_arr(self,
+                          shade_threshold,
+                          change_prop,
+                          interaction='random',
+                          rng=None,
+                          out=None):
+        # select the pixels and build the new LULC array
+        change_pos = self._select_change_pos(shade_threshold,
+                                             change_prop,
+                                             interaction=interaction,
+                                             rng=rng)
+        return self._change_pixels(change_pos, out=out)
+
+    def _change_pixels(self, change_pos, out=None):
+        # copy the starting LULC array (into `out` if provided, e.g., a slice
+        # of a preallocated stack) and then write all the next codes of the
+        # selected pixels at once (note that `put` works on the flat indices
+        # even if `out` is not contiguous)
+        if out is None:
+            out = self.lulc_arr.copy()
+        else:
+            out[...] = self.lulc_arr
+        out.put(self.change_idx[change_pos], self.change_next_code[change_pos])
+
+        return out
+
+    def generate_change_order(self,
+                              shade_threshold,
+                              interaction='random',
+                              rng=None):
+        # priority ordering of the changeable pixels (as positions of the
+        # `change_idx` and `change_next_code` arrays), so that changing the
+        # first `num_to_change` pixels of the ordering is equivalent (in
+        # distribution) to `generate_lulc_arr`
+        rng = np.random.default_rng(rng)
+        if interaction in DYNAMIC_INTERACTIONS:
+            # the dynamic allocation is already an ordering, and since its
+            # batches do not depend on the number of pixels to change, its
+            # prefixes are the same as in `generate_lulc_arr`
+            return self._generate_dynamic_order(shade_threshold,
+                                                len(self.change_idx),
+                                                interaction, rng)
+        change_order = rng.permutation(len(self.change_idx))
+        if interaction != 'random':
+            conv_result = self._get_ranking(shade_threshold)
+            if interaction == 'cluster':
+                conv_result = -conv_result
+            # a stable sort of the randomly permuted pixels sorts them by
+            # their convolution value and breaks the ties at random (numpy
+            # uses a linear-time radix sort for stable sorts of `int8`)
+            change_order = change_order[conv_result[change_order].argsort(
+                kind='stable')]
+
+        return change_order
+
+    def generate_nested_lulc_arrs(self,
+                                  shade_threshold,
+                                  change_props,
+                                  interaction='random',
+                                  rng=None,
+                                  out=None):
+        # generate the LULC arrays for all the change proportions from a
+        # single priority ordering, so that the changed pixels of each
+        # proportion are a superset of those of any lower proportion. The
+        # arrays are written into `out` (of shape `(len(change_props), height,
+        # width)`), which is allocated if not provided
+        change_order = self.generate_change_order(shade_threshold,
+                                                  interaction=interaction,
+                                                  rng=rng)
+        num_change = len(self.change_idx)
+
+        if out is None:
+            out = np.empty((len(change_props), *self.lulc_arr.shape),
+                           dtype=self.lulc_arr.dtype)
+
+        # sweep the change proportions in ascending order, changing only the
+        # pixels that have not been changed in the previous proportion
+        lulc_arr = self.lulc_arr.copy()
+        num_changed = 0
+        for i in np.argsort(change_props):
+            num_to_change = int(num_change * change_props[i])
+            change_pos = change_order[num_changed:num_to_change]
+            lulc_arr.put(self.change_idx[change_pos],
+                         self.change_next_code[change_pos])
+            num_changed = max(num_changed, num_to_change)
+            out[i] = lulc_arr
+
+        return out
+
+    def _generate_nested_lulc_arr(self,
+                                  shade_threshold,
+                                  change_prop,
+                                  interaction='random',
+                                  rng=None):
+        # generate the LULC array of a single change proportion of the nested
+        # mode, i.e., as a prefix of the priority ordering drawn with `rng`
+        change_order = self.generate_change_order(shade_threshold,
+                                                  interaction=interaction,
+                                                  rng=rng)
+        return self._change_pixels(
+            change_order[:int(len(self.change_idx) * change_prop)])
+
+    def _generate_scenario(self, scenario_lulc_arr, task, shade_threshold,
+                           change_props):
+        # generate the LULC array(s) of a task (see
+        # `_generate_scenario_lulc_arr`) and write them in place
+        # note that `scenario_lulc_arr` only features the change proportions
+        # other than the endpoints
+        i, interaction, j, k, scenario_run = task
+        start, stop = _get_inner_slice(change_props)
+        if j is None:
+            # each scenario run draws a single priority ordering from which
+            # the arrays of all the change proportions (except the endpoints)
+            # are generated
+            self.generate_nested_lulc_arrs(shade_threshold,
+                                           change_props[start:stop],
+                                           interaction=interaction,
+                                           rng=self.get_rng(
+                                               interaction, scenario_run),
+                                           out=scenario_lulc_arr[i, :, k])
+        else:
+            rng = self.get_rng(interaction,
+                               scenario_run,
+                               change_prop=change_props[j])
+            self.generate_lulc_arr(shade_threshold,
+                                   change_props[j],
+                                   interaction=interaction,
+                                   rng=rng,
+                                   out=scenario_lulc_arr[i, j - start, k])
+
+    def _generate_scenario_lulc_arr(self,
+                                    change_props,
+                                    scenario_runs,
+                                    shade_threshold,
+                                    interactions,
+                                    nested,
+                                    num_workers=1,
+                                    executor='threads',
+                                    out=None):
+        # preallocate the array of all the scenarios except the endpoints
+        # (unless provided, e.g., as a memory-mapped array) and write each
+        # scenario LULC array in place. The endpoints are generated once and
+        # returned apart, i.e., as the arrays of the change proportions of 0
+        # and 1 (or None if they are not in `change_props`)
+        start, stop = _get_inner_slice(change_props)
+        shape = (len(interactions), stop - start, len(scenario_runs),
+                 *self.lulc_arr.shape)
+        dtype = self.lulc_arr.dtype
+        tmp_filepath = None
+        if out is not None:
+            scenario_lulc_arr = out
+        elif num_workers > 1 and executor == 'processes':
+            # the worker processes write to a memory-mapped temporary file
+            fd, tmp_filepath = tempfile.mkstemp(suffix='.dat')
+            os.close(fd)
+            scenario_lulc_arr = np.memmap(tmp_filepath,
+                                          dtype=dtype,
+                                          mode='w+',
+                                          shape=shape)
+        else:
+            scenario_lulc_arr = np.empty(shape, dtype=dtype)
+
+        # generate the arrays
+        if change_props[0] == 0:
+            # no pixels are changed, so we keep the starting LULC array for
+            # all scenario runs and interactions
+            start_lulc_arr = self.lulc_arr
+        else:
+            start_lulc_arr = None
+        if change_props[-1] == 1:
+            # we change all the candidate pixels only once and use the
+            # resulting LULC array for all scenario runs and interactions
+            end_lulc_arr = self.generate_lulc_arr(shade_threshold, 1)
+        else:
+            end_lulc_arr = None
+        # each task generates either a single scenario or (in the nested
+        # mode) all the change proportions of a scenario run. Since the
+        # random streams are derived from the scenario labels (see
+        # `get_seed_seq`), the result does not depend on the number of
+        # workers nor on the order in which the tasks are executed
+        if nested:
+            scenario_props = [None] if stop > start else []
+        else:
+            scenario_props = range(start, stop)
+        tasks = [(i, interaction, j, k, scenario_run)
+                 for i, interaction in enumerate(interactions)
+                 for j in scenario_props
+                 for k, scenario_run in enumerate(scenario_runs)]
+        if any(interaction != 'random' for interaction in interactions):
+            # compute the ranking once before shipping the generator to the
+            # workers
+            self._get_ranking(shade_threshold)
+
+        if num_workers == 1:
+            for task in tasks:
+                self._generate_scenario(scenario_lulc_arr, task,
+                                        shade_threshold, change_props)
+        elif executor == 'threads':
+            # the heavy parts (random selection, copies and scattered writes)
+            # run in NumPy, which releases the GIL for most of them
+            def _generate_scenario(task):
+                self._generate_scenario(scenario_lulc_arr, task,
+                                        shade_threshold, change_props)
+
+            with futures.ThreadPoolExecutor(num_workers) as pool:
+                for _ in pool.map(_generate_scenario, tasks):
+                    pass
+        elif executor == 'processes':
+            # ship the (compact) generator state to each worker only once,
+            # and let the workers write directly into the memory-mapped
+            # output
+            if not isinstance(scenario_lulc_arr, np.memmap):
+                raise ValueError(
+                    "`out` must be a `np.memmap` when using processes")
+            scenario_lulc_arr.flush()
+            initargs = (self, scenario_lulc_arr.filename,
+                        scenario_lulc_arr.offset, shape, dtype,
+                        shade_threshold, change_props)
+            chunksize = max(len(tasks) // (4 * num_workers), 1)
+            with futures.ProcessPoolExecutor(
+                    num_workers,
+                    initializer=_init_generation_worker,
+                    initargs=initargs) as pool:
+                for _ in pool.map(_generate_scenario_task,
+                                  tasks,
+                                  chunksize=chunksize):
+                    pass
+            if tmp_filepath is not None:
+                # the memory map remains valid after the file is unlinked (on
+                # POSIX systems), so we do not leave the file behind
+                os.remove(tmp_filepath)
+        else:
+            raise ValueError(f"Unknown executor: {executor}")
+
+        return scenario_lulc_arr, start_lulc_arr, end_lulc_arr
+
+    def _generate_lazy_scenario_lulc_arr(self, change_props, scenario_runs,
+                                         shade_threshold, interactions,
+                                         nested):
+        # build a dask array with one chunk per scenario, each of which is
+        # generated on demand. The seed sequences are derived from the
+        # scenario labels so that the chunks are the same regardless of how
+        # many times (or where) they are computed, and the same as in the
+        # eager mode (see `get_seed_seq`). The tasks only feature the
+        # scenario labels, i.e., rather than shipping the generator with
+        # each task, it is replicated once in each worker process (see
+        # `_get_scenario_generator`) and reused within this one. As in
+        # `_generate_scenario_lulc_arr`, the arrays of the endpoints are
+        # returned apart
+        _scenario_generators.clear()
+        _scenario_generators[self._key] = self
+        shape = self.lulc_arr.shape
+        dtype = self.lulc_arr.dtype
+
+        def _generate_lulc_arr(interaction, change_prop, scenario_run):
+            return da.from_delayed(
+                dask.delayed(_generate_lazy_scenario)(self._key,
+                                                      self._init_kws,
+                                                      shade_threshold,
+                                                      interaction, change_prop,
+                                                      scenario_run, nested),
+                shape, dtype)
+
+        start, stop = _get_inner_slice(change_props)
+        if start > 0:
+            start_lulc_arr = da.from_array(self.lulc_arr, chunks=shape)
+        else:
+            start_lulc_arr = None
+        if stop < len(change_props):
+            end_lulc_arr = _generate_lulc_arr(None, 1, None)
+        else:
+            end_lulc_arr = None
+
+        if stop > start:
+            scenario_lulc_arr = da.stack([
+                da.stack([
+                    da.stack([
+                        _generate_lulc_arr(interaction, change_prop,
+                                           scenario_run)
+                        for scenario_run in scenario_runs
+                    ]) for change_prop in change_props[start:stop]
+                ]) for interaction in interactions
+            ])
+        else:
+            scenario_lulc_arr = da.empty(
+                (len(interactions), 0, len(scenario_runs), *shape),
+                dtype=dtype,
+                chunks=(1, 1, 1, *shape))
+
+        return scenario_lulc_arr, start_lulc_arr, end_lulc_arr
+
+    def _get_attrs(self, nested):
+        # the seed is stored as a string because the entropy drawn from the
+        # OS is a 128-bit integer, which cannot be serialized as a netCDF
+        # attribute
+        return dict(nodata=self.lulc_meta['nodata'],
+                    pyproj_srs=f'epsg:{self.lulc_meta["crs"].to_epsg()}',
+                    nested=int(nested),
+                    seed=str(self.seed))
+
+    def generate_scenario_lulc_ds(self,
                                   change_props,
                                   scenario_runs,
                                   shade_threshold,
-                                  interactions=None):
+                                  interactions=None,
+                                  nested=False,
+                                  lazy=False,
+                                  num_workers=1,
+                                  executor='threads',
+                                  out=None):
+        # generate the scenarios as in `generate_scenario_lulc_da`, but return
+        # them in a dataset where the LULC arrays of the change proportions
+        # of 0 and 1 (if any) are only stored once, i.e., with the layout of
+        # `compact_scenario_endpoints`. The arrays of the other change
+        # proportions are kept as they are generated, e.g., in memory (or in
+        # `out`) in the eager mode, so that they can be passed to the
+        # simulations as they are (see `simulate_scenario_T_da`)
         if interactions is None:
             interactions = ['random', 'cluster', 'scatter']
 
-        # prepare the xarray data array
+        if lazy:
+            scenario_lulc_arr, start_lulc_arr, end_lulc_arr = \
+                self._generate_lazy_scenario_lulc_arr(
+                    change_props, scenario_runs, shade_threshold,
+                    interactions, nested)
+        else:
+            scenario_lulc_arr, start_lulc_arr, end_lulc_arr = \
+                self._generate_scenario_lulc_arr(change_props,
+                                                 scenario_runs,
+                                                 shade_threshold,
+                                                 interactions,
+                                                 nested,
+                                                 num_workers=num_workers,
+                                                 executor=executor,
+                                                 out=out)
+
+        change_props = np.asarray(change_props)
+        start, stop = _get_inner_slice(change_props)
         coords = {
             'interaction': interactions,
             'change_prop': change_props,
             'scenario_run': scenario_runs,
             **self.coords
         }
-        dims = ['interaction', 'change_prop', 'scenario_run', 'y', 'x']
-        scenario_lulc_da = xr.DataArray(
-            dims=dims,
-            coords=coords,
-            attrs=dict(nodata=self.lulc_meta['nodata'],
-                       pyproj_srs=f'epsg:{self.lulc_meta["crs"].to_epsg()}'))
+        attrs = self._get_attrs(nested)
+        endpoint_lulc_arrs = [
+            lulc_arr for lulc_arr in (start_lulc_arr, end_lulc_arr)
+            if lulc_arr is not None
+        ]
+        if not endpoint_lulc_arrs:
+            dims = ['interaction', 'change_prop', 'scenario_run', 'y', 'x']
+            return xr.Dataset({'LULC': (dims, scenario_lulc_arr, attrs)},
+                              coords=coords)
+
+        if lazy:
+            endpoint_lulc_arr = da.stack(endpoint_lulc_arrs)
+        else:
+            endpoint_lulc_arr = np.stack(endpoint_lulc_arrs)
+        dims = ['interaction', 'inner_change_prop', 'scenario_run', 'y', 'x']
+        coords.update(inner_change_prop=change_props[start:stop],
+                      endpoint_change_prop=np.concatenate(
+                          [change_props[:start], change_props[stop:]]))
+        return xr.Dataset(
+            {
+                'LULC': (dims, scenario_lulc_arr, attrs),
+                'LULC_endpoint':
+                (['endpoint_change_prop', 'y', 'x'], endpoint_lulc_arr, attrs)
+            },
+            coords=coords)
+
+    def generate_scenario_lulc_da(self,
+                                  change_props,
+                                  scenario_runs,
+                                  shade_threshold,
+                                  interactions=None,
+                                  nested=False,
+                                  lazy=False,
+                                  num_workers=1,
+                                  executor='threads',
+                                  out=None):
+        # `num_workers`, `executor` ('threads' or 'processes') and `out` (a
+        # preallocated array for the change proportions other than 0 and 1,
+        # which must be a `np.memmap` for processes) only apply to the eager
+        # (non-lazy) generation. The arrays of the change proportions of 0
+        # and 1 (if any) are stored once and broadcast along the interactions
+        # and scenario runs, in which case the data array is backed by dask
+        # (see `expand_scenario_endpoints`)
+        return expand_scenario_endpoints(
+            self.generate_scenario_lulc_ds(change_props,
+                                           scenario_runs,
+                                           shade_threshold,
+                                           interactions=interactions,
+                                           nested=nested,
+                                           lazy=lazy,
+                                           num_workers=num_workers,
+                                           executor=executor,
+                                           out=out))['LULC']
+
+    def generate_scenario_change_ds(self,
+                                    change_props,
+                                    scenario_runs,
+                                    shade_threshold,
+                                    interactions=None,
+                                    nested=False):
+        # sparse (delta) representation of the scenarios: rather than a full
+        # LULC array for each scenario, we store the starting LULC array once
+        # and, for each scenario, the flat indices of the changed pixels. The
+        # new codes can be derived from the next code look-up table, so we
+        # just need to store the indices as segments of a single
+        # concatenated array, where each scenario points to a segment by its
+        # start and count. Scenarios that change the same pixels share the
+        # same segment, e.g., the change proportion of 1 or (in the nested
+        # mode) all the change proportions of a scenario run, which are
+        # prefixes of the same priority ordering
+        if interactions is None:
+            interactions = ['random', 'cluster', 'scatter']
+
+        shape = (len(interactions), len(change_props), len(scenario_runs))
+        change_start = np.zeros(shape, dtype=np.int64)
+        change_count = np.zeros(shape, dtype=np.int64)
+        # the first segment features all the changeable pixels
+        segments = [self.change_idx]
+        num_stored = len(self.change_idx)
+        num_change = len(self.change_idx)
+        for i, interaction in enumerate(interactions):
+            for k, scenario_run in enumerate(scenario_runs):
+                if nested:
+                    change_order = self.generate_change_order(
+                        shade_threshold,
+                        interaction=interaction,
+                        rng=self.get_rng(interaction, scenario_run))
+                    segments.append(self.change_idx[change_order])
+                for j, change_prop in enumerate(change_props):
+                    if change_prop == 0:
+                        # no pixels are changed
+                        continue
+                    elif change_prop == 1:
+                        # all the pixels are changed (first segment)
+                        change_count[i, j, k] = num_change
+                    elif nested:
+                        change_start[i, j, k] = num_stored
+                        change_count[i, j, k] = int(num_change * change_prop)
+                    else:
+                        # sort the indices so that both the reconstruction
+                        # and the compression on disk are more efficient
+                        rng = self.get_rng(interaction,
+                                           scenario_run,
+                                           change_prop=change_prop)
+                        change_pos = self._select_change_pos(
+                            shade_threshold,
+                            change_prop,
+                            interaction=interaction,
+                            rng=rng)
+                        segments.append(np.sort(self.change_idx[change_pos]))
+                        change_start[i, j, k] = num_stored
+                        change_count[i, j, k] = len(segments[-1])
+                        num_stored += len(segments[-1])
+                if nested:
+                    num_stored += num_change
+
+        scenario_dims = ['interaction', 'change_prop', 'scenario_run']
+        return xr.Dataset(
+            {
+                'LULC_base': (['y', 'x'], self.lulc_arr),
+                'next_code': (['lucode'], self.next_code_lut),
+                'change_idx': (['change'], np.concatenate(segments)),
+                'change_start': (scenario_dims, change_start),
+                'change_count': (scenario_dims, change_count)
+            },
+            coords={
+                'interaction': interactions,
+                'change_prop': change_props,
+                'scenario_run': scenario_runs,
+                **self.coords
+            },
+            attrs=self._get_attrs(nested))
+
+
+class TiledScenarioGenerator:
+    # out-of-core version of `ScenarioGenerator` for rasters that do not fit
+    # in memory: the LULC raster is processed in tiles (read with a one-pixel
+    # halo so that the Moore neighbourhood operations are exact at the tile
+    # borders), the global selection is derived from per-tile partial
+    # results and the scenario rasters are written to disk tile by tile, so
+    # that the peak memory is bounded by the tile size. Only the static
+    # interactions ('random', 'cluster' and 'scatter') are supported
+    def __init__(self,
+                 agglom_lulc_filepath,
+                 biophysical_table_filepath,
+                 orig_lulc_col='orig_lucode',
+                 lulc_col='lucode',
+                 tile_size=None,
+                 seed=None):
+        with rio.open(agglom_lulc_filepath) as src:
+            lulc_meta = src.meta.copy()
+
+        biophysical_df = pd.read_csv(biophysical_table_filepath)
+        next_code_dict = _get_next_code_dict(biophysical_df, orig_lulc_col,
+                                             lulc_col)
+        # since we do not know the maximum code of the raster, the last entry
+        # of the look-up table (-1) is used for the codes that are not in the
+        # biophysical table (see `_read_tile`)
+        next_code_lut = np.full(int(biophysical_df[lulc_col].max()) + 2,
+                                -1,
+                                dtype=np.int32)
+        next_code_lut[list(next_code_dict)] = list(next_code_dict.values())
+        next_code_lut[0] = -1
+
+        # split the raster into tiles
+        if tile_size is None:
+            tile_size = TILE_SIZE
+        height, width = lulc_meta['height'], lulc_meta['width']
+        tiles = [
+            windows.Window(col_off, row_off, min(tile_size, width - col_off),
+                           min(tile_size, height - row_off))
+            for row_off in range(0, height, tile_size)
+            for col_off in range(0, width, tile_size)
+        ]
+
+        self.agglom_lulc_filepath = agglom_lulc_filepath
+        self.lulc_meta = lulc_meta
+        self.biophysical_df = biophysical_df
+        self.orig_lulc_col = orig_lulc_col
+        self.lulc_col = lulc_col
+        self.next_code_lut = next_code_lut
+        self.tiles = tiles
+        # histograms of the neighbourhood counts of the changeable pixels of
+        # each tile, by shade threshold (see `_get_tile_hists`)
+        self._tile_hists = {}
+
+        # see `ScenarioGenerator.get_seed_seq`
+        self.seed_seq = np.random.SeedSequence(seed)
+        self.seed = self.seed_seq.entropy
+
+    get_seed_seq = ScenarioGenerator.get_seed_seq
+    get_rng = ScenarioGenerator.get_rng
+
+    def _read_tile(self, src, tile, shade_threshold):
+        # read the tile with a one-pixel halo, clipped at the raster borders
+        # where both `binary_erosion` (with a `False` border) and `convolve`
+        # (reflecting the array) behave as on the full raster
+        row_start = max(tile.row_off - 1, 0)
+        col_start = max(tile.col_off - 1, 0)
+        row_stop = min(tile.row_off + tile.height + 1, src.height)
+        col_stop = min(tile.col_off + tile.width + 1, src.width)
+        halo_arr = src.read(1,
+                            window=windows.Window.from_slices(
+                                (row_start, row_stop), (col_start, col_stop)))
+        tile_slice = (slice(tile.row_off - row_start,
+                            tile.row_off - row_start + tile.height),
+                      slice(tile.col_off - col_start,
+                            tile.col_off - col_start + tile.width))
+        lulc_arr = halo_arr[tile_slice]
+
+        # same logic as in `ScenarioGenerator.__init__`
+        road_codes = self.biophysical_df[self.biophysical_df[
+            self.orig_lulc_col] == ROAD_CODE][self.lulc_col]
+        inner_road_mask = ndi.binary_erosion(np.isin(halo_arr, road_codes),
+                                             KERNEL_MOORE)[tile_slice]
+        next_code_arr = self.next_code_lut.take(lulc_arr.ravel(), mode='clip')
+        next_code_arr[inner_road_mask.ravel()] = -1
+        change_idx = np.flatnonzero(next_code_arr >= 0)
+        change_next_code = next_code_arr[change_idx].astype(lulc_arr.dtype)
+
+        # same as `ScenarioGenerator._get_ranking`
+        high_shade_codes = self.biophysical_df[self.biophysical_df['shade'] >=
+                                               shade_threshold][self.lulc_col]
+        high_shade_arr = np.isin(halo_arr, high_shade_codes).astype(np.int8)
+        ranking = ndi.convolve(high_shade_arr,
+                               KERNEL_MOORE)[tile_slice].ravel()[change_idx]
+
+        return lulc_arr, change_idx, change_next_code, ranking
+
+    def _get_tile_hists(self, shade_threshold):
+        # first pass over the tiles, which only keeps the histogram of the
+        # neighbourhood counts (from 0 to 9) of the changeable pixels of each
+        # tile, i.e., an array of shape `(num_tiles, 10)`
+        try:
+            return self._tile_hists[shade_threshold]
+        except KeyError:
+            num_bins = KERNEL_MOORE.sum() + 1
+            tile_hists = np.empty((len(self.tiles), num_bins), dtype=np.int64)
+            with rio.open(self.agglom_lulc_filepath) as src:
+                for i, tile in enumerate(self.tiles):
+                    ranking = self._read_tile(src, tile, shade_threshold)[-1]
+                    tile_hists[i] = np.bincount(ranking, minlength=num_bins)
+            self._tile_hists[shade_threshold] = tile_hists
+            return tile_hists
+
+    def generate_lulc_raster(self,
+                             dst_filepath,
+                             shade_threshold,
+                             change_prop,
+                             interaction='random',
+                             rng=None):
+        # the selection is equivalent (in distribution) to
+        # `ScenarioGenerator.generate_lulc_arr`: the number of pixels to
+        # change in each tile is drawn from a multivariate hypergeometric
+        # distribution, either over all the changeable pixels (random) or
+        # over the pixels tied at the global threshold count (cluster/
+        # scatter), and then the pixels are drawn within each tile
+        rng = np.random.default_rng(rng)
+        tile_hists = self._get_tile_hists(shade_threshold)
+        num_to_change = int(tile_hists.sum() * change_prop)
+        if interaction == 'random':
+            tile_num_to_draw = rng.multivariate_hypergeometric(
+                tile_hists.sum(axis=1), num_to_change)
+        elif interaction in ['cluster', 'scatter']:
+            # sort the bins by preference (lowest counts first for scatter)
+            if interaction == 'cluster':
+                tile_hists = tile_hists[:, ::-1]
+            threshold_bin = np.searchsorted(np.cumsum(tile_hists.sum(axis=0)),
+                                            num_to_change)
+            num_below = tile_hists[:, :threshold_bin].sum()
+            tile_num_to_draw = rng.multivariate_hypergeometric(
+                tile_hists[:, threshold_bin], num_to_change - num_below)
+            if interaction == 'cluster':
+                threshold_score = tile_hists.shape[1] - 1 - threshold_bin
+            else:
+                threshold_score = threshold_bin
+        else:
+            raise ValueError(
+                f"Interaction not supported in tiled mode: {interaction}")
+        tile_seeds = rng.integers(np.iinfo(np.int64).max, size=len(self.tiles))
+
+        # second pass over the tiles, where each scenario tile is written to
+        # disk as soon as it is generated
+        dst_meta = dict(self.lulc_meta,
+                        driver='GTiff',
+                        tiled=True,
+                        compress='lzw',
+                        BIGTIFF='IF_SAFER')
+        with rio.open(self.agglom_lulc_filepath) as src:
+            with rio.open(dst_filepath, 'w', **dst_meta) as dst:
+                for tile, num_to_draw, tile_seed in zip(
+                        self.tiles, tile_num_to_draw, tile_seeds):
+                    lulc_arr, change_idx, change_next_code, ranking = (
+                        self._read_tile(src, tile, shade_threshold))
+                    tile_rng = np.random.default_rng(tile_seed)
+                    if interaction == 'random':
+                        change_pos = tile_rng.choice(len(change_idx),
+                                                     num_to_draw,
+                                                     replace=False)
+                    else:
+                        # change all the pixels with a preferred count and
+                        # draw the ones tied at the threshold
+                        if interaction == 'cluster':
+                            preferred = ranking > threshold_score
+                        else:
+                            preferred = ranking < threshold_score
+                        change_pos = np.concatenate([
+                            np.flatnonzero(preferred),
+                            tile_rng.choice(
+                                np.flatnonzero(ranking == threshold_score),
+                                num_to_draw,
+                                replace=False)
+                        ])
+                    lulc_arr = lulc_arr.copy()
+                    lulc_arr.put(change_idx[change_pos],
+                                 change_next_code[change_pos])
+                    dst.write(lulc_arr, 1, window=tile)
+
+        return dst_filepath
+
+    def generate_scenario_lulc_rasters(self,
+                                       dst_dir,
+                                       change_props,
+                                       scenario_runs,
+                                       shade_threshold,
+                                       interactions=None):
+        # write a raster for each scenario and return a data frame with the
+        # file path of each scenario. The random streams are the same as in
+        # `ScenarioGenerator`, but the draws are not, since they are split
+        # by tiles
+        if interactions is None:
+            interactions = ['random', 'cluster', 'scatter']
+
+        scenario_rows = []
+        for interaction in interactions:
+            for change_prop in change_props:
+                for scenario_run in scenario_runs:
+                    rng = self.get_rng(interaction,
+                                       scenario_run,
+                                       change_prop=change_prop)
+                    dst_filepath = path.join(
+                        dst_dir,
+                        f'{interaction}-{change_prop}-{scenario_run}.tif')
+                    self.generate_lulc_raster(dst_filepath,
+                                              shade_threshold,
+                                              change_prop,
+                                              interaction=interaction,
+                                              rng=rng)
+                    scenario_rows.append(
+                        [interaction, change_prop, scenario_run, dst_filepath])
+
+        return pd.DataFrame(
+            scenario_rows,
+            columns=['interaction', 'change_prop', 'scenario_run', 'filepath'])
+
+
+def _apply_lulc_changes(base_lulc_arr, next_code_lut, change_idx):
+    lulc_arr = base_lulc_arr.copy()
+    lulc_arr.put(change_idx, next_code_lut[base_lulc_arr.take(change_idx)])
+    return lulc_arr
+
+
+@xr.register_dataset_accessor('scenario_lulc')
+class ScenarioLULCAccessor:
+    # reconstruct dense scenario LULC arrays from the sparse (delta)
+    # representation of `ScenarioGenerator.generate_scenario_change_ds`
+    def __init__(self, scenario_ds):
+        self._ds = scenario_ds
+
+    @property
+    def _change_arrs(self):
+        # load the (compact) arrays needed for the reconstruction only once
+        try:
+            return self._change_arrs_
+        except AttributeError:
+            self._change_arrs_ = (self._ds['LULC_base'].values,
+                                  self._ds['next_code'].values,
+                                  self._ds['change_idx'].values)
+            return self._change_arrs_
+
+    def _get_lulc_arr(self, change_start, change_count):
+        base_lulc_arr, next_code_lut, change_idx = self._change_arrs
+        return _apply_lulc_changes(
+            base_lulc_arr, next_code_lut,
+            change_idx[change_start:change_start + change_count])
+
+    def sel(self, **indexers):
+        # dense LULC data array of the scenario selected by label
+        lulc_arr = self._get_lulc_arr(
+            self._ds['change_start'].sel(indexers).item(),
+            self._ds['change_count'].sel(indexers).item())
+        return xr.DataArray(lulc_arr,
+                            dims=['y', 'x'],
+                            coords={
+                                'y': self._ds['y'],
+                                'x': self._ds['x']
+                            },
+                            attrs=self._ds.attrs)
+
+    def to_dataarray(self):
+        # lazy (dask-backed) data array of all the scenarios, with one chunk
+        # per scenario, which is reconstructed on demand
+        base_lulc_arr = self._change_arrs[0]
+        change_start_da = self._ds['change_start']
+        change_count_da = self._ds['change_count']
+        scenario_lulc_arrs = [
+            da.from_delayed(
+                dask.delayed(self._get_lulc_arr)(change_start, change_count),
+                base_lulc_arr.shape, base_lulc_arr.dtype)
+            for change_start, change_count in zip(change_start_da.values.flat,
+                                                  change_count_da.values.flat)
+        ]
+        scenario_lulc_arr = da.stack(scenario_lulc_arrs).reshape(
+            *change_start_da.shape, *base_lulc_arr.shape)
+        dims = [*change_start_da.dims, 'y', 'x']
+        coords = {dim: self._ds[dim] for dim in dims}
+        return xr.DataArray(scenario_lulc_arr,
+                            dims=dims,
+                            coords=coords,
+                            attrs=self._ds.attrs)
+
+
+def _get_scenario_vars(scenario_ds, change_prop_dim):
+    # variables of scenario arrays (i.e., with `change_prop_dim` and (y, x)
+    # dimensions)
+    return [
+        var for var, var_da in scenario_ds.data_vars.items()
+        if change_prop_dim in var_da.dims and var_da.dims[-2:] == ('y', 'x')
+    ]
+
+
+def compact_scenario_endpoints(scenario_ds):
+    # store the scenario arrays (e.g., LULC and T) of the change proportions
+    # of 0 and 1, which are the same for all the interactions and scenario
+    # runs, only once, i.e., in a `<var>_endpoint` variable with an
+    # `endpoint_change_prop` dimension. The arrays of the other change
+    # proportions are kept in their variable with an `inner_change_prop`
+    # dimension, so that the compacted dataset cannot be mistakenly indexed
+    # at the endpoints (see `expand_scenario_endpoints`)
+    change_props = scenario_ds['change_prop'].values
+    start, stop = _get_inner_slice(change_props)
+    endpoint_pos = list(range(start)) + list(range(stop, len(change_props)))
+    if not endpoint_pos:
+        return scenario_ds
+    data_vars = {}
+    for var in _get_scenario_vars(scenario_ds, 'change_prop'):
+        var_da = scenario_ds[var]
+        data_vars[var] = var_da.isel(change_prop=slice(start, stop)).rename(
+            change_prop='inner_change_prop')
+        endpoint_da = var_da.isel(change_prop=endpoint_pos,
+                                  interaction=0,
+                                  scenario_run=0,
+                                  drop=True)
+        data_vars[f'{var}_endpoint'] = endpoint_da.rename(
+            change_prop='endpoint_change_prop')
+    return scenario_ds.drop_vars(
+        [var for var in data_vars if var in scenario_ds]).assign(data_vars)
+
+
+def expand_scenario_endpoints(scenario_ds):
+    # reverse `compact_scenario_endpoints`, broadcasting the arrays of the
+    # endpoints along the interactions and scenario runs (lazily, see
+    # `_broadcast_endpoints`). Datasets that are not compacted are returned
+    # as they are
+    if 'endpoint_change_prop' not in scenario_ds.dims:
+        return scenario_ds
+    endpoint_change_props = scenario_ds['endpoint_change_prop'].values
+    data_vars = {}
+    for var in _get_scenario_vars(scenario_ds, 'inner_change_prop'):
+        inner_da = scenario_ds[var]
+        # one chunk per scenario, so that the arrays are only read on demand
+        inner_arr = inner_da.chunk({dim: 1 for dim in inner_da.dims[:-2]}).data
+        endpoint_arr = scenario_ds[f'{var}_endpoint'].chunk().data
+        start_arr, end_arr = None, None
+        for endpoint_change_prop, arr in zip(endpoint_change_props,
+                                             endpoint_arr):
+            if endpoint_change_prop == 0:
+                start_arr = arr
+            else:
+                end_arr = arr
+        dims = [
+            'change_prop' if dim == 'inner_change_prop' else dim
+            for dim in inner_da.dims
+        ]
+        scenario_arr = _broadcast_endpoints(inner_arr, start_arr, end_arr)
+        data_vars[var] = xr.DataArray(scenario_arr,
+                                      dims=dims,
+                                      attrs=inner_da.attrs)
+    drop_vars = [*data_vars, *[f'{var}_endpoint' for var in data_vars]]
+    return scenario_ds.drop_vars(
+        [*drop_vars, 'inner_change_prop',
+         'endpoint_change_prop']).assign(data_vars)
+
+
+def open_scenario_ds(scenario_ds_filepath, **open_kws):
+    # open a scenario dataset (netCDF or Zarr), broadcasting the endpoints if
+    # they are stored only once (see `compact_scenario_endpoints`)
+    return expand_scenario_endpoints(
+        xr.open_dataset(scenario_ds_filepath, **open_kws))
+
+
+def get_scenario_lulc_da(scenario_ds):
+    # get the scenario LULC data array regardless of whether the dataset
+    # stores dense LULC arrays or their sparse (delta) representation
+    scenario_ds = expand_scenario_endpoints(scenario_ds)
+    if 'LULC' in scenario_ds:
+        return scenario_ds['LULC']
+    else:
+        return scenario_ds.scenario_lulc.to_dataarray()
+
+
+class ScenarioReader:
+    # read the (y, x) arrays of a scenario data array (e.g., the output of
+    # `get_scenario_lulc_da`) one scenario at a time. The data array is
+    # chunked by scenario (if it is not already), so that each read only
+    # loads (or, if lazy, computes) the chunk of its scenario, and the labels
+    # of the scenario dimensions are resolved to chunk positions without
+    # going through xarray's indexing. The most recently read arrays are
+    # cached, so they must not be modified in place
+    def __init__(self, scenario_da, cache_size=None):
+        self.scenario_dims = scenario_da.dims[:-2]
+        if not isinstance(scenario_da.data, da.Array) or any(
+                max(dim_chunks) > 1 for dim_chunks in scenario_da.chunks[:-2]):
+            scenario_da = scenario_da.chunk(
+                {dim: 1
+                 for dim in self.scenario_dims})
+        self.scenario_da = scenario_da
+        self._indexes = [
+            scenario_da.indexes[dim] for dim in self.scenario_dims
+        ]
+        if cache_size is None:
+            cache_size = SCENARIO_CACHE_SIZE
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+
+    def read(self, scenario_sel):
+        # get the array of the scenario selected by label, i.e., a mapping
+        # of each scenario dimension to a label
+        idx = tuple(
+            index.get_loc(scenario_sel[dim])
+            for dim, index in zip(self.scenario_dims, self._indexes))
+        try:
+            arr = self._cache[idx]
+            # mark it as the most recently used
+            self._cache.move_to_end(idx)
+        except KeyError:
+            # the scenario is read within the calling thread (e.g., of a
+            # worker), i.e., without spawning a dask scheduler
+            arr = self.scenario_da.data.blocks[idx].compute(
+                scheduler='synchronous')[(0, ) * len(idx)]
+            self._cache[idx] = arr
+            # evict the least recently used arrays
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return arr
 
-        # generate the arrays
-        if change_props[0] == 0:
-            # no pixels are changed, so we keep the starting LULC array and
-            # repeat it for all scenario runs and interactions
-            scenario_lulc_da.loc[dict(change_prop=0)] = np.array(
-                [[self.lulc_arr for scenario_run in scenario_runs]
-                 for interaction in interactions])
-            change_props = change_props[1:]
-        if change_props[-1] == 1:
-            # we change all the candidate pixels only once and repeat the
-            # resulting LULC array for all scenario runs and interactions
-            end_lulc_arr = self.generate_lulc_arr(shade_threshold, 1)
-            scenario_lulc_da.loc[dict(change_prop=1)] = np.array(
-                [[end_lulc_arr for scenario_run in scenario_runs]
-                 for interaction in interactions])
-            change_props = change_props[:-1]
-        scenario_lulc_da.loc[dict(change_prop=change_props)] = np.array([[[
-            self.generate_lulc_arr(shade_threshold,
-                                   change_prop,
-                                   interaction=interaction)
-            for scenario_run in scenario_runs
-        ] for change_prop in change_props] for interaction in interactions])
 
-        # return the data array
-        return scenario_lulc_da
+def _get_scenario_metrics_df(scenario_coords, metrics):
+    # empty data frame of the metrics of each scenario, indexed by the
+    # product of the scenario coordinates (a mapping of dimension to values)
+    scenario_index = pd.MultiIndex.from_product(scenario_coords.values(),
+                                                names=list(scenario_coords))
+    return pd.DataFrame(index=scenario_index, columns=metrics, dtype=float)
+
+
+def _format_scenario_metrics_df(metrics_df):
+    # labels and metrics of each scenario, sorted by change proportion
+    return metrics_df.reset_index().sort_values('change_prop',
+                                                kind='stable',
+                                                ignore_index=True)
+
+
+def compute_scenario_metrics_df(scenario_lulc_da,
+                                high_tree_codes,
+                                res,
+                                metrics=None,
+                                incremental=False,
+                                batch_size=None):
+    # compute the landscape metrics of the high tree cover class of each
+    # scenario of a scenario LULC data array, e.g., right after generating it
+    # (rather than reading it back from the dumped dataset as in
+    # `make_scenario_metrics.py`). The metrics are computed with the native
+    # engine in batches of `batch_size` scenarios (see
+    # `compute_landscape_metrics`) or, if `incremental` is True, sweeping the
+    # change proportions of each scenario run of each interaction (see
+    # `compute_incremental_landscape_metrics`). Returns a data frame with the
+    # labels and the metrics (including the exact proportion of landscape) of
+    # each scenario, sorted by change proportion. Note that
+    # `simulate_scenario_T_da` can compute them within the simulation tasks,
+    # i.e., without reading the scenarios again
+    if metrics is None:
+        metrics = NATIVE_LANDSCAPE_METRICS
+    if batch_size is None:
+        batch_size = NATIVE_METRICS_BATCH_SIZE
+    scenario_reader = ScenarioReader(scenario_lulc_da)
+    scenario_dims = list(scenario_reader.scenario_dims)
+    nodata = scenario_lulc_da.attrs['nodata']
+
+    def compute_batch_metrics(batch_index, incremental=False):
+        return compute_lulc_metrics([
+            scenario_reader.read(dict(zip(scenario_dims, scenario_key)))
+            for scenario_key in batch_index
+        ], high_tree_codes, res, nodata, metrics, incremental)
+
+    metrics_df = _get_scenario_metrics_df(
+        {dim: scenario_lulc_da.indexes[dim]
+         for dim in scenario_dims}, metrics)
+    scenario_index = metrics_df.index
+    change_props = scenario_index.get_level_values('change_prop')
+    if incremental:
+        run_dims = [dim for dim in scenario_dims if dim != 'change_prop']
+        for _, run_df in metrics_df.groupby(level=run_dims):
+            run_index = run_df.sort_index(level='change_prop').index
+            metrics_df.loc[run_index] = compute_batch_metrics(run_index,
+                                                              incremental=True)
+    else:
+        # the scenarios of the change proportions of 0 and 1 are the same for
+        # all the interactions and scenario runs (see `_broadcast_endpoints`)
+        # so their metrics are computed only once
+        endpoint_cond = np.isin(change_props, [0, 1])
+        endpoint_index = metrics_df[endpoint_cond].groupby(
+            level='change_prop').head(1).index
+        for change_prop, endpoint_metrics in zip(
+                endpoint_index.get_level_values('change_prop'),
+                compute_batch_metrics(endpoint_index)):
+            metrics_df.loc[change_props == change_prop] = endpoint_metrics
+        inner_index = scenario_index[~endpoint_cond]
+        for start in range(0, len(inner_index), batch_size):
+            batch_index = inner_index[start:start + batch_size]
+            metrics_df.loc[batch_index] = compute_batch_metrics(batch_index)
+
+    return _format_scenario_metrics_df(metrics_df)
+
+
+def _get_min_int_dtype(arr, nodata=None):
+    # smallest integer dtype that can hold the values of `arr` (and `nodata`)
+    if arr.size == 0:
+        return arr.dtype
+    min_val, max_val = dask.compute(arr.min(), arr.max())
+    if nodata is not None:
+        nodata = int(nodata)
+        min_val, max_val = min(min_val, nodata), max(max_val, nodata)
+    return np.promote_types(np.min_scalar_type(min_val),
+                            np.min_scalar_type(max_val))
+
+
+def _get_packed_t_encoding(t_arr, t_precision):
+    # pack the temperatures as 16-bit integers with a scale factor of
+    # `t_precision`. The offset is only used if the range does not fit around
+    # zero, since otherwise xarray decodes the values as float32
+    min_t, max_t = dask.compute(da.nanmin(t_arr), da.nanmax(t_arr))
+    max_int = np.iinfo(np.int16).max
+    if max(abs(min_t), abs(max_t)) / t_precision <= max_int:
+        add_offset = 0
+    elif (max_t - min_t) / t_precision <= 2 * max_int:
+        add_offset = round((min_t + max_t) / 2 / t_precision) * t_precision
+    else:
+        raise ValueError(
+            f"The temperature range [{min_t}, {max_t}] cannot be packed as "
+            f"16-bit integers with a precision of {t_precision}")
+    return dict(dtype='int16',
+                scale_factor=t_precision,
+                add_offset=add_offset,
+                _FillValue=PACKED_T_FILL_VALUE)
+
+
+def get_scenario_encoding(scenario_ds,
+                          fmt='netcdf',
+                          complevel=None,
+                          t_precision=None):
+    # encoding of the variables of a scenario dataset so that each scenario
+    # can be read independently: the arrays with scenario dimensions and
+    # (y, x) are chunked by scenario (i.e., 1 x 1 x 1 x H x W), the integer
+    # arrays (e.g., LULC) are stored with the smallest dtype that fits their
+    # values and, if `complevel` is provided, the variables are compressed
+    # (zlib for netCDF, zstd for Zarr). If `t_precision` is provided, the
+    # temperatures are packed as 16-bit integers at such precision (in degC)
+    if fmt not in ('netcdf', 'zarr'):
+        raise ValueError(f"Unknown format: {fmt}")
+    if complevel is not None and fmt == 'zarr':
+        # optional dependency, only needed to write to a store
+        import numcodecs
+
+        compressor = numcodecs.Blosc(cname='zstd',
+                                     clevel=complevel,
+                                     shuffle=numcodecs.Blosc.SHUFFLE)
+    chunk_key = 'chunksizes' if fmt == 'netcdf' else 'chunks'
+
+    encoding = {}
+    for var, var_da in scenario_ds.data_vars.items():
+        var_encoding = {}
+        if var_da.dims[-2:] == ('y', 'x'):
+            var_encoding[chunk_key] = (1, ) * (var_da.ndim - 2) + tuple(
+                var_da.shape[-2:])
+        if var in ('T', 'T_endpoint') and t_precision is not None:
+            var_encoding.update(
+                _get_packed_t_encoding(var_da.data, t_precision))
+        elif np.issubdtype(var_da.dtype, np.integer):
+            nodata = var_da.attrs.get('nodata',
+                                      scenario_ds.attrs.get('nodata'))
+            if var not in ('LULC', 'LULC_endpoint', 'LULC_base', 'next_code'):
+                nodata = None
+            var_encoding['dtype'] = _get_min_int_dtype(var_da.data, nodata)
+        if complevel is not None:
+            if fmt == 'netcdf':
+                var_encoding.update(zlib=True,
+                                    complevel=complevel,
+                                    shuffle=True)
+            else:
+                var_encoding['compressor'] = compressor
+        encoding[var] = var_encoding
+
+    return encoding
+
+
+def dump_scenario_ds(scenario_ds,
+                     dst_filepath,
+                     fmt='netcdf',
+                     complevel=None,
+                     t_precision=None):
+    # dump the scenario dataset with the encoding of `get_scenario_encoding`.
+    # In the Zarr format, the arrays of the scenarios are written by chunk in
+    # parallel (by the dask scheduler)
+    encoding = get_scenario_encoding(scenario_ds,
+                                     fmt=fmt,
+                                     complevel=complevel,
+                                     t_precision=t_precision)
+    if fmt == 'netcdf':
+        scenario_ds.to_netcdf(dst_filepath, mode='w', encoding=encoding)
+    else:
+        # (lazily) chunk the arrays of the scenarios as they are encoded so
+        # that each chunk is written by a separate task
+        scenario_ds = scenario_ds.copy()
+        for var, var_encoding in encoding.items():
+            if 'chunks' in var_encoding:
+                scenario_ds[var] = scenario_ds[var].chunk(
+                    var_encoding['chunks'])
+        scenario_ds.to_zarr(dst_filepath, mode='w', encoding=encoding)
+
+
+def _split_scenario_endpoints(scenario_lulc_da, endpoint_lulc_da=None):
+    # split the scenario LULC arrays into the data array of the change
+    # proportions other than 0 and 1 and the arrays of the change
+    # proportions of 0 and 1 (or None if they are not featured), which are
+    # the same for all the interactions and scenario runs. If
+    # `endpoint_lulc_da` is provided, `scenario_lulc_da` and
+    # `endpoint_lulc_da` are the `LULC` and `LULC_endpoint` variables of a
+    # dataset with compacted endpoints (see `compact_scenario_endpoints`),
+    # e.g., from `ScenarioGenerator.generate_scenario_lulc_ds`, so that the
+    # arrays of the other change proportions are used as they are (e.g., in
+    # memory) rather than as chunks of a dask array. Also returns all the
+    # change proportions
+    if endpoint_lulc_da is None:
+        change_props = scenario_lulc_da['change_prop'].values
+        start, stop = _get_inner_slice(change_props)
+        endpoint_lulc_arrs = [
+            scenario_lulc_da.isel(interaction=0,
+                                  change_prop=pos,
+                                  scenario_run=0).values
+            for pos in (0, len(change_props) - 1)
+        ]
+        return (scenario_lulc_da.isel(change_prop=slice(start, stop)),
+                endpoint_lulc_arrs[0] if start > 0 else None,
+                endpoint_lulc_arrs[1] if stop < len(change_props) else None,
+                change_props)
+
+    inner_lulc_da = scenario_lulc_da.rename(inner_change_prop='change_prop')
+    start_lulc_arr = None
+    end_lulc_arr = None
+    for endpoint_change_prop, endpoint_lulc_arr in zip(
+            endpoint_lulc_da['endpoint_change_prop'].values,
+            endpoint_lulc_da.values):
+        if endpoint_change_prop == 0:
+            start_lulc_arr = endpoint_lulc_arr
+        else:
+            end_lulc_arr = endpoint_lulc_arr
+    change_props = inner_lulc_da['change_prop'].values
+    if start_lulc_arr is not None:
+        change_props = np.concatenate([[0], change_props])
+    if end_lulc_arr is not None:
+        change_props = np.concatenate([change_props, [1]])
+    return inner_lulc_da, start_lulc_arr, end_lulc_arr, change_props
+
+
+def _get_rio_meta(scenario_lulc_da):
+    x = scenario_lulc_da['x'].values
+    y = scenario_lulc_da['y'].values
+    # the coordinates are those of the pixel centers (see
+    # `ScenarioGenerator.__init__`)
+    xres = x[1] - x[0]
+    yres = y[0] - y[1]
+    west = x[0] - xres / 2
+    north = y[0] + yres / 2
+    # TODO: does the method to get the transform work for all grids, i.e.,
+    # regardless of whether the origin is in the upper left or lower left?
+    return dict(driver='GTiff',
+                dtype=scenario_lulc_da.dtype,
+                nodata=scenario_lulc_da.attrs['nodata'],
+                width=len(x),
+                height=len(y),
+                count=1,
+                crs=scenario_lulc_da.attrs['pyproj_srs'],
+                transform=transform.from_origin(west, north, xres, yres))
 
 
 def simulate_scenario_T_da(scenario_lulc_da,
@@ -219,85 +1679,475 @@ def simulate_scenario_T_da(scenario_lulc_da,
                            ucm_params,
                            dst_t_dtype,
                            rio_meta=None,
-                           cc_method='factors'):
+                           cc_method='factors',
+                           ucm_cache=None,
+                           backend='processes',
+                           num_workers=None,
+                           chunksize=None,
+                           scheduler_address=None,
+                           engine='invest',
+                           batch_size=None,
+                           incremental=False,
+                           endpoint_lulc_da=None,
+                           metrics_kws=None):
+    # `backend` can be 'serial', 'threads', 'processes' (with `num_workers`
+    # and `chunksize`, i.e., the number of tasks sent to a worker at once) or
+    # 'distributed' (a `dask.distributed` local cluster with `num_workers`
+    # or the scheduler at `scheduler_address`), see `compute_tasks`.
+    # `engine` can be 'invest' (`UCMRunner`) or 'native' (`NativeUCMRunner`),
+    # and each task simulates `batch_size` scenarios at once (by default,
+    # one for the 'invest' engine and `NATIVE_UCM_BATCH_SIZE` for the
+    # 'native' one). If `incremental` is True (only for the 'native' engine),
+    # each task simulates the scenarios of an interaction and scenario run,
+    # by increasing change proportion, each incrementally from the previous
+    # one (starting from the scenario with a change proportion of 0 if any),
+    # which is faster when the scenarios differ locally. If
+    # `endpoint_lulc_da` is provided, `scenario_lulc_da` only holds the
+    # change proportions other than 0 and 1 (see
+    # `_split_scenario_endpoints`), so that the eagerly generated scenarios
+    # are simulated from memory. If `metrics_kws` is provided (the keyword
+    # arguments of `compute_scenario_metrics_df` except `batch_size`), the
+    # landscape metrics of each scenario are computed within the task that
+    # simulates it, i.e., without generating or reading it again (with
+    # `incremental` metrics, the scenarios are batched along the chains of
+    # increasing change proportions regardless of `incremental`), and a tuple
+    # with the temperature data array and the metrics data frame is returned
+    if incremental and engine != 'native':
+        raise ValueError(
+            "Incremental simulations are only supported by the 'native' "
+            "engine")
+    if metrics_kws is not None:
+        metrics_kws = {
+            'metrics': NATIVE_LANDSCAPE_METRICS,
+            'incremental': False,
+            **metrics_kws
+        }
     if rio_meta is None:
-        x = scenario_lulc_da['x'].values
-        y = scenario_lulc_da['y'].values
-        west = x[0]
-        north = y[0]
-        # TODO: does the method to get the transform work for all grids, i.e.,
-        # regardless of whether the origin is in the upper left or lower left?
-        rio_meta = dict(driver='GTiff',
-                        dtype=scenario_lulc_da.dtype,
-                        nodata=scenario_lulc_da.attrs['nodata'],
-                        width=len(x),
-                        height=len(y),
-                        count=1,
-                        crs=scenario_lulc_da.attrs['pyproj_srs'],
-                        transform=transform.from_origin(
-                            west, north, x[1] - west, north - y[1]))
-
-    # define the function here so that the fixed arguments are curried
-    def _t_from_lulc(lulc_arr):
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            lulc_raster_filepath = path.join(tmp_dir, 'lulc.tif')
-            with rio.open(lulc_raster_filepath, 'w', **rio_meta) as dst:
-                dst.write(lulc_arr, 1)
-
-            ucm_wrapper = iuc.UCMWrapper(lulc_raster_filepath,
-                                         biophysical_table_filepath,
-                                         cc_method,
-                                         ref_et_raster_filepath,
-                                         t_ref,
-                                         uhi_max,
-                                         extra_ucm_args=ucm_params)
-            return ucm_wrapper.predict_t_arr(0)
+        rio_meta = _get_rio_meta(scenario_lulc_da)
 
-    scenario_T_da = xr.DataArray(
-        dims=scenario_lulc_da.dims,
-        coords=scenario_lulc_da.coords,
-        attrs=dict(nodata=np.nan,
-                   pyproj_srs=scenario_lulc_da.attrs['pyproj_srs']))
+    # the UCM runner is initialized once per process, and each process knows
+    # whether its runner belongs to this simulation by a unique key
+    runner_key = uuid.uuid4().hex
+    runner_args = (rio_meta, biophysical_table_filepath,
+                   ref_et_raster_filepath, t_ref, uhi_max, ucm_params,
+                   cc_method)
+    # the simulated arrays can be served from a `UCMResultCache`
+    if ucm_cache is not None:
+        input_key = get_ucm_input_key(*runner_args, engine)
+    else:
+        input_key = None
 
-    change_props = scenario_T_da['change_prop'].values
-    scenario_runs = scenario_T_da['scenario_run']
-    interactions = scenario_T_da['interaction']
-    if change_props[0] == 0:
-        # simulate once and repeat it for all scenario runs and interactions
-        start_T_arr = _t_from_lulc(
-            scenario_lulc_da.sel(change_prop=0).isel(interaction=0,
-                                                     scenario_run=0))
-        scenario_T_da.loc[dict(change_prop=0)] = np.array(
-            [[start_T_arr for scenario_run in scenario_runs]
-             for interaction in interactions])
-        change_props = change_props[1:]
-    if change_props[-1] == 1:
-        # simulate once and repeat it for all scenario runs and interactions
-        end_T_arr = _t_from_lulc(
-            scenario_lulc_da.sel(change_prop=1).isel(interaction=0,
-                                                     scenario_run=0))
-        scenario_T_da.loc[dict(change_prop=1)] = np.array(
-            [[end_T_arr for scenario_run in scenario_runs]
-             for interaction in interactions])
-        change_props = change_props[:-1]
-    # TODO: use a set difference to get all dimensions but ('x', 'y')?
-    scenario_dims = scenario_lulc_da.dims[:-2]
-    stacked_da = scenario_lulc_da.sel(change_prop=change_props).stack(
-        scenario=scenario_dims).transpose('scenario', 'y', 'x')
-    with diagnostics.ProgressBar():
-        scenario_T_da.loc[dict(change_prop=change_props)] = xr.DataArray(
-            np.array(
-                dask.compute(*[
-                    dask.delayed(_t_from_lulc)(scenario_lulc_da)
-                    for scenario_lulc_da in stacked_da
-                ],
-                             scheduler='processes')).astype(dst_t_dtype),
-            dims=stacked_da.dims,
-            coords={dim: stacked_da.coords[dim]
-                    for dim in stacked_da.dims},
-            attrs=dict(dtype=dst_t_dtype)).unstack(dim='scenario').transpose(
-                *scenario_dims, 'y', 'x')
     # replace nodata values - UCM/InVEST uses minus infinity, so we can use
     # temperatures lower than the absolute zero as a reference threshold which
     # (physically) makes sense
-    return scenario_T_da.where(scenario_T_da > -273.15, np.nan)
+    def _get_T_arr(t_arr):
+        return np.where(t_arr > -273.15, t_arr, np.nan).astype(dst_t_dtype)
+
+    # the endpoints are simulated once and broadcast for all scenario runs
+    # and interactions
+    inner_lulc_da, base_lulc_arr, end_lulc_arr, change_props = \
+        _split_scenario_endpoints(scenario_lulc_da, endpoint_lulc_da)
+    start_T_arr = None
+    end_T_arr = None
+    if base_lulc_arr is not None:
+        start_T_arr = _get_T_arr(
+            t_from_lulc(base_lulc_arr, runner_key, runner_args, ucm_cache,
+                        input_key, engine))
+    if end_lulc_arr is not None:
+        end_T_arr = _get_T_arr(
+            t_from_lulc(end_lulc_arr, runner_key, runner_args, ucm_cache,
+                        input_key, engine))
+    # TODO: use a set difference to get all dimensions but ('x', 'y')?
+    scenario_dims = inner_lulc_da.dims[:-2]
+    stacked_da = inner_lulc_da.stack(scenario=scenario_dims).transpose(
+        'scenario', 'y', 'x')
+    scenario_lulc_arrs = [
+        scenario_lulc_da.data for scenario_lulc_da in stacked_da
+    ]
+    scenario_T_arrs = [None] * len(scenario_lulc_arrs)
+    if metrics_kws is not None:
+        metrics_args = (metrics_kws['high_tree_codes'], metrics_kws['res'],
+                        inner_lulc_da.attrs['nodata'], metrics_kws['metrics'],
+                        metrics_kws['incremental'])
+        scenario_metrics_arrs = [None] * len(scenario_lulc_arrs)
+    else:
+        metrics_args = None
+    if ucm_cache is not None:
+        # consult the cache before dispatching any work (for the arrays that
+        # are already in memory, the lazy ones are looked up within their
+        # task)
+        for i, lulc_arr in enumerate(scenario_lulc_arrs):
+            if isinstance(lulc_arr, np.ndarray):
+                scenario_T_arrs[i] = ucm_cache.load(
+                    ucm_cache.get_key(lulc_arr, input_key))
+    simulate_idx = [
+        i for i, t_arr in enumerate(scenario_T_arrs) if t_arr is None
+    ]
+    incremental_metrics = metrics_kws is not None and bool(
+        metrics_kws['incremental'])
+    if incremental or incremental_metrics:
+        # one chain of scenarios (by increasing change proportion) for each
+        # interaction and scenario run
+        scenario_index = stacked_da.indexes['scenario']
+        chain_keys = scenario_index.droplevel('change_prop')
+        scenario_change_props = scenario_index.get_level_values('change_prop')
+        chain_dict = {}
+        for i in np.argsort(scenario_change_props, kind='stable'):
+            chain_dict.setdefault(chain_keys[i], []).append(i)
+        chains = list(chain_dict.values())
+    # note that if `scenario_lulc_da` is backed by dask (i.e., lazy), passing
+    # the `data` attribute to `dask.delayed` makes each scenario LULC array be
+    # generated within the task graph, so that the full array is never
+    # materialized
+    if incremental:
+        # since each scenario is simulated from the previous one, the chains
+        # with any scenario to simulate are dispatched as a whole (their
+        # cached scenarios are then served from the cache within the task,
+        # see `t_from_lulc_chain`)
+        batches = [
+            chain for chain in chains
+            if any(scenario_T_arrs[i] is None for i in chain)
+        ]
+        simulate_func = t_from_lulc_chain
+        simulate_args = [
+            base_lulc_arr, runner_key, runner_args, ucm_cache, input_key
+        ]
+    else:
+        if batch_size is None:
+            batch_size = NATIVE_UCM_BATCH_SIZE if engine == 'native' else 1
+        if incremental_metrics:
+            # batch the scenarios along the chains so that the metrics of
+            # each one are updated from the previous one
+            simulate_idx = [
+                i for chain in chains for i in chain
+                if scenario_T_arrs[i] is None
+            ]
+        batches = [
+            simulate_idx[start:start + batch_size]
+            for start in range(0, len(simulate_idx), batch_size)
+        ]
+        simulate_func = t_from_lulc_arrs
+        simulate_args = [runner_key, runner_args, ucm_cache, input_key, engine]
+
+    compute_kws = dict(backend=backend,
+                       num_workers=num_workers,
+                       chunksize=chunksize,
+                       scheduler_address=scheduler_address)
+    if backend == 'processes' or (backend == 'distributed'
+                                  and scheduler_address is None):
+        # the worker processes read the LULC arrays from and write the
+        # temperature arrays to temporary memory-mapped files, so that only
+        # their locations (rather than the arrays) are pickled
+        scenario_T_arrs, batch_metrics_arrs = simulate_memmap(
+            scenario_lulc_arrs, scenario_T_arrs, batches, simulate_func,
+            simulate_args, metrics_args, dst_t_dtype, compute_kws)
+    else:
+        tasks = [
+            dask.delayed(simulate_batch)(
+                simulate_func, [scenario_lulc_arrs[i]
+                                for i in batch], metrics_args, *simulate_args)
+            for batch in batches
+        ]
+        batch_metrics_arrs = []
+        for batch, (batch_T_arrs, batch_metrics_arr) in zip(
+                batches, compute_tasks(tasks, **compute_kws)):
+            for i, t_arr in zip(batch, batch_T_arrs):
+                scenario_T_arrs[i] = t_arr
+            batch_metrics_arrs.append(batch_metrics_arr)
+    # the scenarios are stacked in the (row-major) order of `scenario_dims`
+    shape = inner_lulc_da.shape[-2:]
+    inner_T_arr = np.empty(inner_lulc_da.shape, dtype=dst_t_dtype)
+    for dst_arr, t_arr in zip(inner_T_arr.reshape(-1, *shape),
+                              scenario_T_arrs):
+        dst_arr[:] = _get_T_arr(t_arr)
+
+    scenario_T_da = xr.DataArray(
+        _broadcast_endpoints(inner_T_arr, start_T_arr, end_T_arr),
+        dims=inner_lulc_da.dims,
+        coords={
+            **inner_lulc_da.coords, 'change_prop': change_props
+        },
+        attrs=dict(nodata=np.nan,
+                   pyproj_srs=inner_lulc_da.attrs['pyproj_srs']))
+    if metrics_kws is None:
+        return scenario_T_da
+
+    # the metrics of the scenarios that have not been dispatched (i.e.,
+    # served from the cache) are computed here, since their LULC arrays are
+    # in memory, as well as those of the endpoints, which are broadcast as
+    # their temperatures
+    for batch, batch_metrics_arr in zip(batches, batch_metrics_arrs):
+        for i, metrics_arr in zip(batch, batch_metrics_arr):
+            scenario_metrics_arrs[i] = metrics_arr
+    if incremental_metrics:
+        metrics_batches = [[
+            i for i in chain if scenario_metrics_arrs[i] is None
+        ] for chain in chains]
+        metrics_batches = [batch for batch in metrics_batches if batch]
+    else:
+        metrics_idx = [
+            i for i, metrics_arr in enumerate(scenario_metrics_arrs)
+            if metrics_arr is None
+        ]
+        metrics_batches = [
+            metrics_idx[start:start + NATIVE_METRICS_BATCH_SIZE]
+            for start in range(0, len(metrics_idx), NATIVE_METRICS_BATCH_SIZE)
+        ]
+    for batch in metrics_batches:
+        for i, metrics_arr in zip(
+                batch,
+                compute_lulc_metrics([scenario_lulc_arrs[i] for i in batch],
+                                     *metrics_args)):
+            scenario_metrics_arrs[i] = metrics_arr
+    scenario_coords = {
+        dim: inner_lulc_da.indexes[dim]
+        for dim in scenario_dims
+    }
+    scenario_coords['change_prop'] = change_props
+    metrics_df = _get_scenario_metrics_df(scenario_coords,
+                                          metrics_kws['metrics'])
+    if scenario_metrics_arrs:
+        metrics_df.loc[stacked_da.indexes['scenario']] = np.stack(
+            scenario_metrics_arrs)
+    scenario_change_props = metrics_df.index.get_level_values('change_prop')
+    for change_prop, endpoint_lulc_arr in zip([0, 1],
+                                              [base_lulc_arr, end_lulc_arr]):
+        if endpoint_lulc_arr is not None:
+            endpoint_metrics_arr = compute_lulc_metrics([endpoint_lulc_arr],
+                                                        *metrics_args[:-1])
+            metrics_df.loc[scenario_change_props ==
+                           change_prop] = endpoint_metrics_arr[0]
+
+    return scenario_T_da, _format_scenario_metrics_df(metrics_df)
+
+
+def _write_store_metrics(lulc_arrs, store_idxs, dst_store, metrics_args):
+    # compute the landscape metrics of the LULC arrays (see
+    # `compute_lulc_metrics`) and write them to the positions `store_idxs`
+    # (one list for each array) of the store, marking them as done
+    # optional dependency, only needed to write to a store
+    import zarr
+
+    store_group = zarr.open_group(dst_store, mode='r+')
+    for metrics_arr, store_idx in zip(
+            compute_lulc_metrics(lulc_arrs, *metrics_args), store_idxs):
+        for idx in store_idx:
+            store_group['landscape_metrics'][idx] = metrics_arr
+            store_group['landscape_metrics_done'][idx] = True
+
+
+def _simulate_to_store(lulc_arr, store_idx, dst_store, dst_t_dtype,
+                       metrics_args, *args):
+    # simulate the air temperature and write it to the positions `store_idx`
+    # of the store, marking them as done only once the array is written so
+    # that an interrupted run never marks a partially written scenario.
+    # Unless `metrics_args` is None, the landscape metrics are written too
+    t_arr = t_from_lulc(lulc_arr, *args)
+    # see `simulate_scenario_T_da` for the nodata values
+    t_arr = np.where(t_arr > -273.15, t_arr, np.nan).astype(dst_t_dtype)
+    if metrics_args is not None:
+        _write_store_metrics([lulc_arr], [store_idx], dst_store, metrics_args)
+    # optional dependency, only needed to write to a store
+    import zarr
+
+    store_group = zarr.open_group(dst_store, mode='r+')
+    for idx in store_idx:
+        store_group['T'][idx] = t_arr
+        store_group['T_done'][idx] = True
+
+
+def simulate_scenario_T_store(scenario_lulc_da,
+                              dst_store,
+                              biophysical_table_filepath,
+                              ref_et_raster_filepath,
+                              t_ref,
+                              uhi_max,
+                              ucm_params,
+                              dst_t_dtype,
+                              rio_meta=None,
+                              cc_method='factors',
+                              ucm_cache=None,
+                              backend='processes',
+                              num_workers=None,
+                              chunksize=None,
+                              scheduler_address=None,
+                              engine='invest',
+                              endpoint_lulc_da=None,
+                              metrics_kws=None):
+    # same as `simulate_scenario_T_da`, but each scenario temperature array
+    # is written to a Zarr store (with one chunk per scenario) by the worker
+    # that simulates it as soon as it is done, so that the results are never
+    # gathered in memory. The scenarios that have been completed are recorded
+    # in the `T_done` variable, so that if the store exists, only the missing
+    # scenarios are simulated (i.e., an interrupted run can be resumed). Each
+    # task simulates a single scenario, regardless of the `engine`. Returns
+    # the (lazy) temperature data array of the store. If `metrics_kws` is
+    # provided (see `simulate_scenario_T_da`), the landscape metrics of each
+    # scenario are written to the `landscape_metrics` variable of the store
+    # by the task that simulates it (the metrics of the scenarios that were
+    # done without them are computed here), and a tuple with the temperature
+    # data array and the metrics data frame is returned. Since each task
+    # holds a single scenario, the metrics are never computed incrementally
+    inner_lulc_da, start_lulc_arr, end_lulc_arr, change_props = \
+        _split_scenario_endpoints(scenario_lulc_da, endpoint_lulc_da)
+    attrs = inner_lulc_da.attrs
+    dims = inner_lulc_da.dims
+    coords = {**inner_lulc_da.coords, 'change_prop': change_props}
+    scenario_dims = dims[:-2]
+    change_prop_axis = scenario_dims.index('change_prop')
+    scenario_shape = list(inner_lulc_da.shape[:-2])
+    scenario_shape[change_prop_axis] = len(change_props)
+    scenario_shape = tuple(scenario_shape)
+    shape = scenario_shape + inner_lulc_da.shape[-2:]
+    scenario_chunks = (1, ) * len(scenario_dims)
+    if path.exists(dst_store):
+        store_ds = xr.open_zarr(dst_store)
+        for dim in dims:
+            if not np.array_equal(store_ds[dim].values, np.asarray(
+                    coords[dim])):
+                raise ValueError(
+                    f"The `{dim}` coordinates of {dst_store} do not match")
+        # the scenarios can only be resumed if they are generated from the
+        # same seed
+        if store_ds.attrs.get('seed') != attrs.get('seed'):
+            raise ValueError(f"The seed of {dst_store} does not match")
+    else:
+        # write the metadata and the `T_done` array only, the (lazy) `T`
+        # array is never computed
+        T_arr = da.full(shape,
+                        np.nan,
+                        dtype=dst_t_dtype,
+                        chunks=scenario_chunks + shape[-2:])
+        store_ds = xr.Dataset(
+            {
+                'T': (dims, T_arr),
+                'T_done': (scenario_dims, np.zeros(scenario_shape, dtype=bool))
+            },
+            coords=coords,
+            attrs=dict(pyproj_srs=attrs['pyproj_srs']))
+        if 'seed' in attrs:
+            store_ds.attrs['seed'] = attrs['seed']
+        store_ds['T'].attrs['nodata'] = np.nan
+        store_ds.to_zarr(dst_store,
+                         compute=False,
+                         encoding={'T_done': dict(chunks=scenario_chunks)})
+    T_done_arr = store_ds['T_done'].values
+    if metrics_kws is not None:
+        metrics = list(metrics_kws.get('metrics', NATIVE_LANDSCAPE_METRICS))
+        if 'landscape_metrics' in store_ds:
+            if list(store_ds['metric'].values) != metrics:
+                raise ValueError(f"The metrics of {dst_store} do not match")
+        else:
+            # add the (lazy) metrics and the `landscape_metrics_done` array
+            # to the store, e.g., if it was created without metrics (keeping
+            # its attributes, which would otherwise be overwritten)
+            metrics_shape = scenario_shape + (len(metrics), )
+            xr.Dataset(
+                {
+                    'landscape_metrics':
+                    (scenario_dims + ('metric', ),
+                     da.full(metrics_shape,
+                             np.nan,
+                             chunks=scenario_chunks + (len(metrics), ))),
+                    'landscape_metrics_done':
+                    (scenario_dims, np.zeros(scenario_shape, dtype=bool))
+                },
+                coords={
+                    'metric': metrics
+                },
+                attrs=store_ds.attrs).to_zarr(dst_store,
+                                              mode='a',
+                                              compute=False,
+                                              encoding={
+                                                  'landscape_metrics_done':
+                                                  dict(chunks=scenario_chunks)
+                                              })
+            store_ds = xr.open_zarr(dst_store)
+        metrics_done_arr = store_ds['landscape_metrics_done'].values
+        metrics_args = (metrics_kws['high_tree_codes'], metrics_kws['res'],
+                        attrs['nodata'], metrics)
+    else:
+        metrics_args = None
+
+    if rio_meta is None:
+        rio_meta = _get_rio_meta(scenario_lulc_da)
+    runner_key = uuid.uuid4().hex
+    runner_args = (rio_meta, biophysical_table_filepath,
+                   ref_et_raster_filepath, t_ref, uhi_max, ucm_params,
+                   cc_method)
+    if ucm_cache is not None:
+        input_key = get_ucm_input_key(*runner_args, engine)
+    else:
+        input_key = None
+
+    # the endpoints (if any) are simulated once and written to all the
+    # scenario runs and interactions
+    endpoint_lulc_arrs = {}
+    if start_lulc_arr is not None:
+        endpoint_lulc_arrs[0] = start_lulc_arr
+    if end_lulc_arr is not None:
+        endpoint_lulc_arrs[len(change_props) - 1] = end_lulc_arr
+    start = 1 if start_lulc_arr is not None else 0
+
+    def get_scenario_tasks(done_arr):
+        # LULC array and store positions of each scenario that is not done
+        scenario_tasks = []
+        for pos, endpoint_lulc_arr in endpoint_lulc_arrs.items():
+            store_idx = [
+                idx for idx in np.ndindex(scenario_shape)
+                if idx[change_prop_axis] == pos and not done_arr[idx]
+            ]
+            if store_idx:
+                scenario_tasks.append((endpoint_lulc_arr, store_idx))
+        for idx in np.ndindex(scenario_shape):
+            pos = idx[change_prop_axis]
+            if pos not in endpoint_lulc_arrs and not done_arr[idx]:
+                inner_idx = list(idx)
+                inner_idx[change_prop_axis] = pos - start
+                scenario_tasks.append(
+                    (inner_lulc_da.data[tuple(inner_idx)], [idx]))
+        return scenario_tasks
+
+    if metrics_args is not None:
+        # the metrics of the scenarios that are done but whose metrics are
+        # not (i.e., that were simulated without them) are computed here,
+        # since they are not dispatched
+        metrics_tasks = get_scenario_tasks(~T_done_arr | metrics_done_arr)
+        for batch_start in range(0, len(metrics_tasks),
+                                 NATIVE_METRICS_BATCH_SIZE):
+            batch_tasks = metrics_tasks[batch_start:batch_start +
+                                        NATIVE_METRICS_BATCH_SIZE]
+            _write_store_metrics(
+                [np.asarray(lulc_arr) for lulc_arr, _ in batch_tasks],
+                [store_idx
+                 for _, store_idx in batch_tasks], dst_store, metrics_args)
+
+    tasks = [
+        dask.delayed(_simulate_to_store)(lulc_arr, store_idx, dst_store,
+                                         dst_t_dtype, metrics_args, runner_key,
+                                         runner_args, ucm_cache, input_key,
+                                         engine)
+        for lulc_arr, store_idx in get_scenario_tasks(T_done_arr)
+    ]
+    compute_tasks(tasks,
+                  backend=backend,
+                  num_workers=num_workers,
+                  chunksize=chunksize,
+                  scheduler_address=scheduler_address)
+
+    store_ds = xr.open_zarr(dst_store)
+    if metrics_args is None:
+        return store_ds['T']
+
+    # the scenarios of the store are in the (row-major) order of
+    # `scenario_dims`
+    scenario_coords = {
+        dim: inner_lulc_da.indexes[dim]
+        for dim in scenario_dims
+    }
+    scenario_coords['change_prop'] = change_props
+    metrics_df = _get_scenario_metrics_df(scenario_coords, metrics)
+    metrics_df[:] = store_ds['landscape_metrics'].values.reshape(
+        -1, len(metrics))
+
+    return store_ds['T'], _format_scenario_metrics_df(metrics_df)
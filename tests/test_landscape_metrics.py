@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from scipy import ndimage as ndi
+
+# the native engine is checked against pylandstats
+pls = pytest.importorskip('pylandstats')
+
+from lausanne_greening_scenarios.scenarios import metrics  # noqa: E402
+
+RES = 10
+NODATA = 0
+CLASS_VAL = metrics.HIGH_TREE_CLASS_VAL
+OTHER_CLASS_VAL = metrics.OTHER_CLASS_VAL
+SHAPE = (60, 80)
+NUM_LANDSCAPES = 4
+
+
+def _get_landscape_arrs(pattern, with_nodata, num_landscapes, seed=0):
+    # landscape arrays with a random (i.e., salt and pepper) or clustered
+    # (i.e., smoothed random field) pattern of class pixels, optionally with
+    # nodata pixels both at the landscape boundary and within it
+    rng = np.random.default_rng(seed)
+    landscape_arrs = []
+    for _ in range(num_landscapes):
+        field = rng.random(SHAPE)
+        if pattern == 'clustered':
+            field = ndi.uniform_filter(field, size=7)
+        class_cond = field > np.quantile(field, rng.uniform(.5, .8))
+        landscape_arr = np.where(class_cond, CLASS_VAL,
+                                 OTHER_CLASS_VAL).astype(np.uint8)
+        if with_nodata:
+            landscape_arr[:5, :10] = NODATA
+            landscape_arr[30:35, 40:46] = NODATA
+            landscape_arr[rng.random(SHAPE) < .02] = NODATA
+        landscape_arrs.append(landscape_arr)
+    return landscape_arrs
+
+
+def _get_nested_landscape_arrs(pattern, with_nodata, num_landscapes):
+    # sequence of landscape arrays where each one converts pixels of the
+    # previous one to the class, e.g., the change proportions of a nested
+    # scenario run (see `compute_incremental_landscape_metrics`)
+    landscape_arr = _get_landscape_arrs(pattern, with_nodata, 1)[0]
+    rng = np.random.default_rng(1)
+    other_idx = rng.permutation(
+        np.flatnonzero(landscape_arr == OTHER_CLASS_VAL))
+    landscape_arrs = [landscape_arr]
+    for convert_idx in np.array_split(other_idx[:len(other_idx) // 2],
+                                      num_landscapes - 1):
+        landscape_arr = landscape_arr.copy()
+        landscape_arr.flat[convert_idx] = CLASS_VAL
+        landscape_arrs.append(landscape_arr)
+    return landscape_arrs
+
+
+def _get_pls_metrics(landscape_arrs):
+    metrics_rows = []
+    for landscape_arr in landscape_arrs:
+        ls = pls.Landscape(landscape_arr, (RES, RES), NODATA)
+        metrics_rows.append([
+            getattr(ls, metric)(CLASS_VAL)
+            for metric in metrics.NATIVE_LANDSCAPE_METRICS
+        ])
+    return np.array(metrics_rows)
+
+
+def _assert_metrics_close(metrics_df, landscape_arrs):
+    assert list(metrics_df.columns) == metrics.NATIVE_LANDSCAPE_METRICS
+    assert np.allclose(metrics_df.values, _get_pls_metrics(landscape_arrs))
+
+
+@pytest.mark.parametrize('pattern', ['random', 'clustered'])
+@pytest.mark.parametrize('with_nodata', [False, True])
+def test_compute_landscape_metrics(pattern, with_nodata):
+    landscape_arrs = _get_landscape_arrs(pattern, with_nodata, NUM_LANDSCAPES)
+    _assert_metrics_close(
+        metrics.compute_landscape_metrics(landscape_arrs, CLASS_VAL, RES,
+                                          NODATA), landscape_arrs)
+
+
+@pytest.mark.parametrize('pattern', ['random', 'clustered'])
+@pytest.mark.parametrize('with_nodata', [False, True])
+def test_compute_incremental_landscape_metrics(pattern, with_nodata):
+    # nested landscapes, i.e., updated incrementally
+    landscape_arrs = _get_nested_landscape_arrs(pattern, with_nodata,
+                                                NUM_LANDSCAPES)
+    _assert_metrics_close(
+        metrics.compute_incremental_landscape_metrics(landscape_arrs,
+                                                      CLASS_VAL, RES, NODATA),
+        landscape_arrs)
+
+    # class pixels that are no longer of the class, i.e., the landscape is
+    # labeled again
+    landscape_arrs = landscape_arrs + _get_landscape_arrs(
+        pattern, with_nodata, 2, seed=2)
+    _assert_metrics_close(
+        metrics.compute_incremental_landscape_metrics(landscape_arrs,
+                                                      CLASS_VAL, RES, NODATA),
+        landscape_arrs)
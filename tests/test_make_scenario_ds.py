@@ -0,0 +1,154 @@
+import itertools
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio as rio
+import xarray as xr
+from click import testing
+from rasterio import transform
+from scipy import ndimage as ndi
+
+# the temperature store requires zarr
+zarr = pytest.importorskip('zarr')
+pytest.importorskip('invest_ucm_calibration')
+
+from lausanne_greening_scenarios.scenarios import \
+    make_scenario_ds  # noqa: E402
+
+ORIG_LULC_CODES = [0, 1, 2, 11]
+# levels of both the tree and building cover of the codes of each class
+COVER_VALS = np.linspace(0, 1, 7)[1::2]
+SIZE = 40
+
+
+@pytest.fixture(scope='module')
+def script_inputs(tmp_path_factory):
+    # small synthetic LULC raster (with spatially autocorrelated original
+    # classes, each with codes for the combinations of tree and building
+    # cover), reference evapotranspiration raster, biophysical table, station
+    # temperatures and calibrated parameters
+    tmp_dir = tmp_path_factory.mktemp('make_scenario_ds')
+    rng = np.random.default_rng(0)
+
+    biophysical_df = pd.DataFrame([
+        dict(orig_lucode=orig_lucode,
+             shade=shade,
+             building_intensity=building_intensity,
+             kc=.2 + .6 * shade,
+             albedo=.2,
+             green_area=int(orig_lucode == 11))
+        for orig_lucode, shade, building_intensity in itertools.product(
+            ORIG_LULC_CODES, COVER_VALS, COVER_VALS)
+    ])
+    biophysical_df.insert(0, 'lucode', np.arange(len(biophysical_df)) + 1)
+    biophysical_table_filepath = str(tmp_dir / 'biophysical-table.csv')
+    biophysical_df.to_csv(biophysical_table_filepath, index=False)
+
+    noise = ndi.gaussian_filter(rng.normal(size=(SIZE, SIZE)), 2)
+    class_idx = np.digitize(
+        noise,
+        np.quantile(noise,
+                    np.linspace(0, 1,
+                                len(ORIG_LULC_CODES) + 1)[1:-1]))
+    lulc_arr = np.zeros((SIZE, SIZE), dtype=np.uint8)
+    for i, orig_lucode in enumerate(ORIG_LULC_CODES):
+        class_mask = class_idx == i
+        lulc_arr[class_mask] = rng.choice(
+            biophysical_df[biophysical_df['orig_lucode'] == orig_lucode]
+            ['lucode'], class_mask.sum())
+    lulc_arr[:3, :10] = 0
+    rio_meta = dict(driver='GTiff',
+                    dtype='uint8',
+                    nodata=0,
+                    width=SIZE,
+                    height=SIZE,
+                    count=1,
+                    crs='epsg:2056',
+                    transform=transform.from_origin(2530000, 1160000, 10, 10))
+    lulc_raster_filepath = str(tmp_dir / 'lulc.tif')
+    with rio.open(lulc_raster_filepath, 'w', **rio_meta) as dst:
+        dst.write(lulc_arr, 1)
+    ref_et_raster_filepath = str(tmp_dir / 'ref-et.tif')
+    with rio.open(ref_et_raster_filepath, 'w',
+                  **dict(rio_meta, dtype='float32', nodata=-1)) as dst:
+        dst.write(rng.uniform(3, 6, size=(SIZE, SIZE)).astype(np.float32), 1)
+
+    station_t_filepath = str(tmp_dir / 'station-t.csv')
+    pd.Series([20., 25.], name='t').to_csv(station_t_filepath)
+    calibrated_params_filepath = str(tmp_dir / 'params.json')
+    with open(calibrated_params_filepath, 'w') as dst:
+        json.dump({}, dst)
+
+    return tmp_dir, [
+        lulc_raster_filepath, biophysical_table_filepath, station_t_filepath,
+        ref_et_raster_filepath, calibrated_params_filepath
+    ]
+
+
+def _run_script(input_filepaths, dst_filepath, *options):
+    result = testing.CliRunner().invoke(make_scenario_ds.main, [
+        *input_filepaths, dst_filepath, '--num-scenario-runs', 2,
+        '--change-prop-step', .5, '--interaction', 'random', '--interaction',
+        'cluster', '--ucm-engine', 'native', '--simulation-backend', 'serial',
+        *options
+    ])
+    assert result.exit_code == 0, result.output
+    return xr.open_dataset(dst_filepath)
+
+
+def _mark_missing(t_store, variables):
+    # mark the scenarios of the first run as missing, as if the simulation
+    # had been interrupted
+    store_group = zarr.open_group(t_store, mode='r+')
+    for var in variables:
+        store_arr = store_group[var]
+        store_arr[tuple(0 if dim == 'scenario_run' else slice(None)
+                        for dim in store_arr.attrs['_ARRAY_DIMENSIONS'])] = \
+            np.nan if var == 'T' else False
+
+
+def test_resume_t_store_without_seed(script_inputs):
+    tmp_dir, input_filepaths = script_inputs
+    t_store = str(tmp_dir / 'T.zarr')
+
+    # no `--seed`, so that the first run draws fresh entropy
+    scenario_ds = _run_script(input_filepaths, str(tmp_dir / 'scenarios.nc'),
+                              '--t-store', t_store)
+    _mark_missing(t_store, ['T', 'T_done'])
+
+    # the resumed run reads the seed from the store, so that the scenarios
+    # and their temperatures are the same
+    resumed_scenario_ds = _run_script(input_filepaths,
+                                      str(tmp_dir / 'resumed-scenarios.nc'),
+                                      '--t-store', t_store)
+    assert xr.open_zarr(t_store)['T_done'].values.all()
+    xr.testing.assert_identical(resumed_scenario_ds, scenario_ds)
+
+
+def test_t_store_metrics(script_inputs):
+    tmp_dir, input_filepaths = script_inputs
+    t_store = str(tmp_dir / 'T-metrics.zarr')
+
+    def _get_metrics_df(dst_basename, *options):
+        metrics_filepath = str(tmp_dir / f'{dst_basename}.csv')
+        _run_script(input_filepaths, str(tmp_dir / f'{dst_basename}.nc'),
+                    '--seed', 0, '--metrics-filepath', metrics_filepath,
+                    *options)
+        return pd.read_csv(metrics_filepath)
+
+    metrics_df = _get_metrics_df('metrics')
+    # metrics computed by the store tasks
+    pd.testing.assert_frame_equal(
+        _get_metrics_df('store-metrics', '--t-store', t_store), metrics_df)
+    # resumed run where the metrics of the scenarios of the first interaction
+    # are missing (e.g., simulated without `--metrics-filepath`), and where
+    # the scenarios of the first scenario run are simulated again
+    store_group = zarr.open_group(t_store, mode='r+')
+    store_group['landscape_metrics'][0] = np.nan
+    store_group['landscape_metrics_done'][0] = False
+    _mark_missing(t_store, ['T', 'T_done'])
+    pd.testing.assert_frame_equal(
+        _get_metrics_df('resumed-store-metrics', '--t-store', t_store),
+        metrics_df)
@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio as rio
+from rasterio import transform
+
+# the native engine is checked against InVEST, so both must be installed
+pytest.importorskip('natcap.invest')
+pytest.importorskip('invest_ucm_calibration')
+
+from lausanne_greening_scenarios.scenarios import ucm  # noqa: E402
+
+# maximum absolute difference (in degrees Celsius) between the air
+# temperatures simulated by the native engine and InVEST
+T_ATOL = 1e-3
+
+# with 30 m pixels, the green area cooling distance is 3 pixels, so that
+# dense green areas reach the threshold of 2 ha (about 22 pixels) within the
+# cooling distance, and the air temperature kernel has a radius of 10 pixels
+CELL_SIZE = 30
+UCM_PARAMS = {
+    't_air_average_radius': 60,
+    'green_area_cooling_distance': 90,
+    'cc_weight_shade': 0.6,
+    'cc_weight_albedo': 0.2,
+    'cc_weight_eti': 0.2
+}
+T_REF = 20
+UHI_MAX = 4
+LULC_NODATA = 0
+GREEN_CODE = 5
+
+
+@pytest.fixture(scope='module')
+def ucm_inputs(tmp_path_factory):
+    # small synthetic LULC raster (with nodata pixels and a large green
+    # area), reference evapotranspiration raster on the same grid and
+    # biophysical table
+    tmp_dir = tmp_path_factory.mktemp('ucm')
+    rng = np.random.default_rng(0)
+
+    biophysical_df = pd.DataFrame({
+        'lucode': [1, 2, 3, 4, GREEN_CODE],
+        'shade': [0, .1, .4, .8, 1],
+        'albedo': [.1, .3, .2, .15, .2],
+        'kc': [.1, .3, .6, .9, 1],
+        'building_intensity': [.9, .6, .3, .1, 0],
+        'green_area': [0, 0, 0, 1, 1]
+    })
+    biophysical_table_filepath = str(tmp_dir / 'biophysical-table.csv')
+    biophysical_df.to_csv(biophysical_table_filepath, index=False)
+
+    height, width = 100, 120
+    lulc_arr = rng.choice(biophysical_df['lucode'],
+                          size=(height, width)).astype(np.uint8)
+    lulc_arr[40:60, 50:75] = GREEN_CODE
+    lulc_arr[:5, :20] = LULC_NODATA
+    rio_meta = dict(driver='GTiff',
+                    dtype='uint8',
+                    nodata=LULC_NODATA,
+                    width=width,
+                    height=height,
+                    count=1,
+                    crs='epsg:2056',
+                    transform=transform.from_origin(2530000, 1160000,
+                                                    CELL_SIZE, CELL_SIZE))
+
+    ref_et_raster_filepath = str(tmp_dir / 'ref-et.tif')
+    with rio.open(ref_et_raster_filepath, 'w',
+                  **dict(rio_meta, dtype='float32', nodata=-1)) as dst:
+        dst.write(
+            rng.uniform(3, 6, size=(height, width)).astype(np.float32), 1)
+
+    return rio_meta, lulc_arr, biophysical_table_filepath, \
+        ref_et_raster_filepath
+
+
+def _get_runners(ucm_inputs, cc_method):
+    rio_meta, _, biophysical_table_filepath, ref_et_raster_filepath = \
+        ucm_inputs
+    # copy the parameters since `UCMWrapper` updates them in place
+    return [
+        runner_cls(rio_meta, biophysical_table_filepath,
+                   ref_et_raster_filepath, [T_REF], [UHI_MAX],
+                   dict(UCM_PARAMS), cc_method)
+        for runner_cls in (ucm.NativeUCMRunner, ucm.UCMRunner)
+    ]
+
+
+def _assert_t_arrs_close(t_arrs, expected_t_arrs):
+    # same nodata pixels (see `simulate_scenario_T_da`) and close values
+    t_arrs = np.asarray(t_arrs)
+    expected_t_arrs = np.asarray(expected_t_arrs)
+    valid_arrs = t_arrs > -273.15
+    assert np.array_equal(valid_arrs, expected_t_arrs > -273.15)
+    assert np.abs(t_arrs[valid_arrs] -
+                  expected_t_arrs[valid_arrs]).max() <= T_ATOL
+
+
+@pytest.mark.parametrize('cc_method', ['factors', 'intensity'])
+def test_predict_t_arrs(ucm_inputs, cc_method):
+    _, lulc_arr, _, _ = ucm_inputs
+    native_runner, invest_runner = _get_runners(ucm_inputs, cc_method)
+
+    # a batch with the LULC array and a greener version of it
+    green_lulc_arr = lulc_arr.copy()
+    green_lulc_arr[(lulc_arr != LULC_NODATA) & (lulc_arr < 3)] = GREEN_CODE
+    lulc_arrs = np.stack([lulc_arr, green_lulc_arr])
+    _assert_t_arrs_close(native_runner.predict_t_arrs(lulc_arrs),
+                         invest_runner.predict_t_arrs(lulc_arrs))
+
+
+@pytest.mark.parametrize('cc_method', ['factors', 'intensity'])
+def test_update_state(ucm_inputs, cc_method):
+    _, lulc_arr, _, _ = ucm_inputs
+    native_runner, invest_runner = _get_runners(ucm_inputs, cc_method)
+
+    # local changes, so that only a window of the grid is updated (see
+    # `NativeUCMRunner.update_state`), first from the base state and then
+    # from the updated state
+    base_state = native_runner.get_base_state(lulc_arr)
+    state = base_state
+    for window in (np.s_[10:14, 10:14], np.s_[80:83, 95:99]):
+        lulc_arr = lulc_arr.copy()
+        lulc_arr[window] = GREEN_CODE
+        state = native_runner.update_state(state, lulc_arr)
+        _assert_t_arrs_close(state['t_air'],
+                             invest_runner.predict_t_arr(lulc_arr))
+        # the incremental update matches the full native simulation
+        assert np.allclose(state['t_air'],
+                           native_runner.predict_t_arr(lulc_arr),
+                           atol=1e-4)
+        if window[0].start == 10:
+            # the first change only affects the pixels within 25 pixels,
+            # i.e., the radii of the green area and air temperature kernels
+            assert np.array_equal(state['t_air'][40:],
+                                  base_state['t_air'][40:])